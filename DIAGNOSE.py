@@ -202,7 +202,7 @@ def print_summary(results):
     if all_passed:
         print("\n✅ ALL CHECKS PASSED!")
         print("\nYour setup is ready. Run:")
-        print("  Backend:  cd backend && python main.py")
+        print("  Backend:  cd backend && uvicorn main:app --host 0.0.0.0 --port 8000")
         print("  Frontend: cd frontend && npm start")
     else:
         print("\n⚠️  SOME ISSUES FOUND:")
@@ -35,7 +35,7 @@ echo ============================================================
 echo.
 echo Terminal 1 - Backend:
 echo   cd backend
-echo   python main.py
+echo   uvicorn main:app --host 0.0.0.0 --port 8000
 echo.
 echo Terminal 2 - Frontend:
 echo   cd frontend
@@ -0,0 +1,66 @@
+"""Content-addressed storage for uploaded files.
+
+Each distinct file content is stored once under ``UPLOAD_DIR/.blobs/<sha256>``.
+The user-visible ``UPLOAD_DIR/<filename>`` is a hard link to that blob (a
+copy where the filesystem has no hard links), so any number of filenames can
+alias the same content without storing, parsing or embedding it twice.
+"""
+import os
+import shutil
+import uuid
+from typing import Optional
+
+from fastapi import UploadFile
+
+from config import UPLOAD_DIR, MAX_FILE_SIZE
+from upload_stream import save_upload
+
+BLOB_DIR = os.path.join(UPLOAD_DIR, ".blobs")
+
+
+def blob_path(content_hash: str) -> str:
+    return os.path.join(BLOB_DIR, content_hash)
+
+
+def _link_into_place(source: str, dest_path: str):
+    """Atomically point ``dest_path`` at ``source`` (hard link, else copy)."""
+    tmp_path = os.path.join(os.path.dirname(dest_path) or ".", f".link-{uuid.uuid4().hex}")
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copyfile(source, tmp_path)
+    try:
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+async def store_upload(file: UploadFile, filename: str, max_size: Optional[int] = MAX_FILE_SIZE) -> dict:
+    """Save an upload as a deduplicated blob aliased by ``filename``.
+
+    Returns ``{"path", "size", "sha256", "duplicate"}`` where ``duplicate``
+    means identical content was already stored.
+    """
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    incoming = os.path.join(BLOB_DIR, f".incoming-{uuid.uuid4().hex}")
+    saved = await save_upload(file, incoming, max_size)
+
+    target = blob_path(saved["sha256"])
+    duplicate = os.path.exists(target)
+    if duplicate:
+        os.remove(incoming)
+    else:
+        os.replace(incoming, target)
+
+    dest_path = os.path.join(UPLOAD_DIR, filename)
+    _link_into_place(target, dest_path)
+    return {"path": dest_path, "size": saved["size"], "sha256": saved["sha256"], "duplicate": duplicate}
+
+
+def remove_blob(content_hash: str):
+    """Delete a blob once no filename refers to it any more."""
+    path = blob_path(content_hash)
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,211 @@
+"""Local BM25 keyword index over document chunks.
+
+Mirrors the chunks stored in the Chroma ``documents`` collection (same ids,
+text and filter metadata) in an SQLite inverted index, so exact terms such
+as question numbers ("Q7"), formula names or chemistry terms can be found
+even when dense search ranks them poorly. ``utils.embed_document`` keeps it
+in step chunk by chunk; ``semantic_search(mode="hybrid")`` fuses both result
+lists with reciprocal rank fusion.
+"""
+import json
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Optional
+
+from config import BM25_INDEX_PATH
+
+_TOKEN_RE = re.compile(r"\w+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were what when "
+    "where which who why will with how do does did".split()
+)
+
+# Standard BM25 parameters
+_K1 = 1.5
+_B = 0.75
+
+
+def tokenize(text: str) -> list[str]:
+    """Lower-cased word tokens without stopwords (keeps "q7", "h2so4", ...)."""
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS]
+
+
+class BM25Index:
+    """SQLite-backed inverted index with incremental add/update/delete."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._totals = None  # (chunk count, total length), reset on writes
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                " id TEXT PRIMARY KEY, length INTEGER NOT NULL, text TEXT NOT NULL, meta TEXT NOT NULL,"
+                " filename TEXT, content_hash TEXT, subject TEXT, owners TEXT)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS postings ("
+                " term TEXT NOT NULL, chunk_id TEXT NOT NULL, tf INTEGER NOT NULL,"
+                " PRIMARY KEY (term, chunk_id)) WITHOUT ROWID"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_postings_chunk ON postings (chunk_id)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_chunks_hash ON chunks (content_hash)")
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def _filter_columns(meta: dict) -> tuple:
+        owners = sorted(key[len("owner_"):] for key, value in meta.items() if key.startswith("owner_") and value)
+        return (
+            meta.get("filename"),
+            meta.get("content_hash"),
+            meta.get("subject"),
+            "," + ",".join(owners) + "," if owners else None,
+        )
+
+    def add(self, ids: list[str], texts: list[str], metadatas: list[dict]):
+        """Index (or re-index) chunks."""
+        with self._lock:
+            db = self._db()
+            for chunk_id, text, meta in zip(ids, texts, metadatas):
+                terms = Counter(tokenize(text))
+                db.execute("DELETE FROM postings WHERE chunk_id = ?", (chunk_id,))
+                db.execute(
+                    "INSERT OR REPLACE INTO chunks (id, length, text, meta, filename, content_hash, subject, owners)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (chunk_id, sum(terms.values()), text, json.dumps(meta), *self._filter_columns(meta)),
+                )
+                db.executemany(
+                    "INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)",
+                    [(term, chunk_id, tf) for term, tf in terms.items()],
+                )
+            db.commit()
+            self._totals = None
+
+    def update_metadata(self, ids: list[str], metadatas: list[dict]):
+        """Replace the stored metadata of already indexed chunks."""
+        with self._lock:
+            db = self._db()
+            db.executemany(
+                "UPDATE chunks SET meta = ?, filename = ?, content_hash = ?, subject = ?, owners = ? WHERE id = ?",
+                [(json.dumps(meta), *self._filter_columns(meta), chunk_id) for chunk_id, meta in zip(ids, metadatas)],
+            )
+            db.commit()
+
+    def delete(self, ids: list[str]):
+        with self._lock:
+            db = self._db()
+            db.executemany("DELETE FROM postings WHERE chunk_id = ?", [(i,) for i in ids])
+            db.executemany("DELETE FROM chunks WHERE id = ?", [(i,) for i in ids])
+            db.commit()
+            self._totals = None
+
+    def delete_content(self, content_hash: str):
+        """Drop every chunk of one document content."""
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "DELETE FROM postings WHERE chunk_id IN (SELECT id FROM chunks WHERE content_hash = ?)",
+                (content_hash,),
+            )
+            db.execute("DELETE FROM chunks WHERE content_hash = ?", (content_hash,))
+            db.commit()
+            self._totals = None
+
+    def clear(self):
+        with self._lock:
+            db = self._db()
+            db.execute("DELETE FROM postings")
+            db.execute("DELETE FROM chunks")
+            db.commit()
+            self._totals = None
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def search(self, query: str, top_k: int = 10, filename: Optional[str] = None,
+               content_hash: Optional[str] = None, owner_id: Optional[int] = None,
+               subject: Optional[str] = None) -> list[dict]:
+        """Top ``top_k`` chunks by BM25 score as ``{"id", "text", "meta", "score"}``.
+
+        Filters match ``utils.semantic_search`` and are applied in SQL before
+        scoring.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        clauses, params = [], []
+        if filename:
+            clauses.append("c.filename = ?")
+            params.append(filename)
+        if content_hash:
+            clauses.append("c.content_hash = ?")
+            params.append(content_hash)
+        if subject:
+            clauses.append("c.subject = ?")
+            params.append(subject.strip().lower())
+        if owner_id is not None:
+            clauses.append("c.owners LIKE ?")
+            params.append(f"%,{owner_id},%")
+        marks = ",".join("?" * len(terms))
+
+        with self._lock:
+            db = self._db()
+            if self._totals is None:
+                self._totals = db.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks").fetchone()
+            total_chunks, total_length = self._totals
+            if not total_chunks:
+                return []
+            avg_length = total_length / total_chunks or 1.0
+
+            df = dict(db.execute(
+                f"SELECT term, COUNT(*) FROM postings WHERE term IN ({marks}) GROUP BY term", terms
+            ).fetchall())
+            rows = db.execute(
+                f"SELECT p.chunk_id, p.term, p.tf, c.length FROM postings p JOIN chunks c ON c.id = p.chunk_id"
+                f" WHERE p.term IN ({marks})" + "".join(f" AND {c}" for c in clauses),
+                terms + params,
+            ).fetchall()
+
+            scores: dict[str, float] = {}
+            for chunk_id, term, tf, length in rows:
+                idf = math.log(1 + (total_chunks - df[term] + 0.5) / (df[term] + 0.5))
+                norm = tf * (_K1 + 1) / (tf + _K1 * (1 - _B + _B * length / avg_length))
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * norm
+
+            best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+            results = []
+            for chunk_id, score in best:
+                text, meta = db.execute("SELECT text, meta FROM chunks WHERE id = ?", (chunk_id,)).fetchone()
+                results.append({"id": chunk_id, "text": text, "meta": json.loads(meta), "score": round(score, 4)})
+            return results
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = 60) -> list[tuple[str, float]]:
+    """Fuse ranked id lists: score(id) = sum of 1 / (k + rank) over the lists."""
+    fused: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            fused[item_id] = fused.get(item_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+_INDEX: Optional[BM25Index] = None
+
+
+def get_index() -> BM25Index:
+    """Return the process-wide BM25 index."""
+    global _INDEX
+    if _INDEX is None:
+        _INDEX = BM25Index(BM25_INDEX_PATH)
+    return _INDEX
@@ -0,0 +1,302 @@
+"""Document chunking for the RAG pipeline.
+
+Chunkers split a document's text into ``(start, end, section)`` spans. The
+default ``structured`` chunker keeps headings, numbered questions, paragraphs
+and sentences intact, packs them up to ``CHUNK_MAX_TOKENS`` and repeats up to
+``CHUNK_OVERLAP_TOKENS`` of trailing sentences at the start of the next
+chunk. ``fixed`` reproduces the original 1000-character windows. Other
+strategies can be added with ``register_chunker``.
+
+Every chunk records its character offsets in the document text, so a
+retrieved excerpt can be widened to its neighbours with ``merge_chunks``.
+``chunk_stream`` produces the same chunks from a stream of page records,
+for documents too large to hold in memory as one string.
+"""
+import bisect
+import re
+from typing import Callable, Iterable, Iterator, Optional
+
+from config import CHUNK_STRATEGY, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
+
+# (text, max_tokens, overlap_tokens) -> [(start, end, section), ...]
+Chunker = Callable[[str, int, int], list[tuple[int, int, Optional[str]]]]
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_HEADING_RE = re.compile(r"^(#{1,6}\s+\S|(chapter|section|unit|part|lesson|topic)\s+[\w.]+)", re.IGNORECASE)
+_ITEM_RE = re.compile(r"^\s*(q(uestion)?\s*\d+[.):]?|\d+[.)])\s", re.IGNORECASE)
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])[\"')\]]*\s+")
+
+_CHUNKERS: dict[str, Chunker] = {}
+
+# Text the streaming chunker buffers before chunking a window
+_STREAM_WINDOW_CHARS = 64 * 1024
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (words and punctuation marks)."""
+    return len(_TOKEN_RE.findall(text))
+
+
+def register_chunker(name: str, chunker: Chunker):
+    """Make ``chunker`` selectable as ``CHUNK_STRATEGY=name``."""
+    _CHUNKERS[name] = chunker
+
+
+def _trim(text: str, start: int, end: int) -> tuple[int, int]:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def _is_heading(line: str) -> bool:
+    """Markdown headings, "Chapter 3 ..."-style lines and short ALL-CAPS titles."""
+    stripped = line.strip()
+    if not stripped or len(stripped) > 80 or _ITEM_RE.match(line):
+        return False
+    if _HEADING_RE.match(stripped):
+        return True
+    letters = [c for c in stripped if c.isalpha()]
+    return len(letters) >= 4 and stripped.isupper() and not stripped.endswith(".")
+
+
+def split_blocks(text: str) -> list[tuple[int, int, bool]]:
+    """Split text into (start, end, is_heading) blocks.
+
+    Blank lines end a paragraph; headings and numbered questions always start
+    a new block so they are never glued to the tail of the previous one.
+    """
+    blocks = []
+    block_start = None
+    position = 0
+    for line in text.splitlines(keepends=True):
+        line_start, position = position, position + len(line)
+        if not line.strip():
+            if block_start is not None:
+                blocks.append((block_start, line_start, False))
+                block_start = None
+            continue
+        if _is_heading(line):
+            if block_start is not None:
+                blocks.append((block_start, line_start, False))
+                block_start = None
+            blocks.append((line_start, position, True))
+            continue
+        if _ITEM_RE.match(line) and block_start is not None:
+            blocks.append((block_start, line_start, False))
+            block_start = None
+        if block_start is None:
+            block_start = line_start
+    if block_start is not None:
+        blocks.append((block_start, len(text), False))
+    return [(s, e, h) for s, e, h in (_trim(text, s, e) + (h,) for s, e, h in blocks) if e > s]
+
+
+def _split_words(text: str, start: int, end: int, max_tokens: int) -> list[tuple[int, int]]:
+    """Hard-split a span that has no usable sentence breaks."""
+    spans = []
+    tokens = list(_TOKEN_RE.finditer(text, start, end))
+    for i in range(0, len(tokens), max_tokens):
+        window = tokens[i:i + max_tokens]
+        spans.append((window[0].start(), window[-1].end()))
+    return spans
+
+
+def _split_sentences(text: str, start: int, end: int, max_tokens: int) -> list[tuple[int, int]]:
+    spans = []
+    cursor = start
+    for match in _SENTENCE_END_RE.finditer(text, start, end):
+        spans.append(_trim(text, cursor, match.start()))
+        cursor = match.end()
+    spans.append(_trim(text, cursor, end))
+
+    units = []
+    for s, e in spans:
+        if e <= s:
+            continue
+        if estimate_tokens(text[s:e]) > max_tokens:
+            units.extend(_split_words(text, s, e, max_tokens))
+        else:
+            units.append((s, e))
+    return units
+
+
+def structured_chunks(text: str, max_tokens: int, overlap_tokens: int) -> list[tuple[int, int, Optional[str]]]:
+    """Pack headings, paragraphs and sentences into token-budgeted chunks."""
+    max_tokens = max(8, max_tokens)
+    overlap_tokens = max(0, min(overlap_tokens, max_tokens // 2))
+
+    # Units are whole blocks where they fit, otherwise their sentences
+    units: list[tuple[int, int, bool, int]] = []
+    for start, end, heading in split_blocks(text):
+        tokens = estimate_tokens(text[start:end])
+        if heading or tokens <= max_tokens:
+            units.append((start, end, heading, tokens))
+        else:
+            for s, e in _split_sentences(text, start, end, max_tokens):
+                units.append((s, e, False, estimate_tokens(text[s:e])))
+
+    chunks = []
+    current: list[tuple[int, int, bool, int]] = []
+    section = None
+    current_section = None
+
+    def flush(carry_overlap: bool):
+        nonlocal current
+        if not any(not unit[2] for unit in current):
+            return
+        chunks.append((current[0][0], current[-1][1], current_section))
+        carried, budget = [], overlap_tokens
+        if carry_overlap:
+            for unit in reversed(current):
+                if unit[2] or unit[3] > budget:
+                    break
+                carried.insert(0, unit)
+                budget -= unit[3]
+        current = carried
+
+    for unit in units:
+        start, end, heading, tokens = unit
+        if heading:
+            if any(not u[2] for u in current):
+                flush(carry_overlap=False)
+                current = []
+            section = " ".join(text[start:end].lstrip("#").split())
+            current.append(unit)
+            current_section = section
+            continue
+        if current and sum(u[3] for u in current) + tokens > max_tokens:
+            flush(carry_overlap=True)
+            if current and sum(u[3] for u in current) + tokens > max_tokens:
+                current = []
+        if not current:
+            current_section = section
+        current.append(unit)
+    if current:
+        if any(not u[2] for u in current):
+            flush(carry_overlap=False)
+        else:
+            # Trailing headings with no body still get indexed
+            chunks.append((current[0][0], current[-1][1], current_section))
+    return chunks
+
+
+def fixed_chunks(text: str, max_tokens: int = 0, overlap_tokens: int = 0,
+                 chunk_size: int = 1000) -> list[tuple[int, int, Optional[str]]]:
+    """Fixed-size character windows without overlap (the original behaviour)."""
+    return [
+        (i, min(i + chunk_size, len(text)), None)
+        for i in range(0, len(text), chunk_size)
+        if text[i:i + chunk_size].strip()
+    ]
+
+
+register_chunker("structured", structured_chunks)
+register_chunker("fixed", fixed_chunks)
+
+
+def _get_chunker(strategy: Optional[str]) -> Chunker:
+    name = strategy or CHUNK_STRATEGY
+    chunker = _CHUNKERS.get(name)
+    if chunker is None:
+        print(f"Unknown chunk strategy {name!r}, using structured")
+        chunker = structured_chunks
+    return chunker
+
+
+def _describe(text: str, index: int, start: int, end: int, section: Optional[str],
+              page_offsets: Optional[list[int]], base: int = 0) -> dict:
+    """Chunk dict for ``text[start:end]``, whose offsets in the document are shifted by ``base``."""
+    chunk = {
+        "text": text[start:end],
+        "index": index,
+        "start": base + start,
+        "end": base + end,
+        "tokens": estimate_tokens(text[start:end]),
+    }
+    if section:
+        chunk["section"] = section
+    if page_offsets:
+        chunk["page"] = bisect.bisect_right(page_offsets, base + start)
+        chunk["page_end"] = bisect.bisect_right(page_offsets, base + max(start, end - 1))
+    return chunk
+
+
+def chunk_document(text: str, page_offsets: Optional[list[int]] = None, strategy: Optional[str] = None,
+                   max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> list[dict]:
+    """Chunk ``text`` and describe each chunk.
+
+    Returns dicts with ``text``, ``index``, ``start``/``end`` character
+    offsets, ``tokens`` and, where known, ``section`` and ``page``/``page_end``
+    (1-based, from the page start offsets of the extracted text).
+    """
+    spans = _get_chunker(strategy)(text, max_tokens, overlap_tokens)
+    if not spans and text:
+        spans = [(0, len(text), None)]
+    return [
+        _describe(text, index, start, end, section, page_offsets)
+        for index, (start, end, section) in enumerate(spans)
+    ]
+
+
+def chunk_stream(records: Iterable[dict], strategy: Optional[str] = None, max_tokens: int = CHUNK_MAX_TOKENS,
+                 overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> Iterator[dict]:
+    """Chunk sanitized ``{"page", "text"}`` records without holding the whole document.
+
+    Pages are joined with newlines as in the extracted-text store, so offsets
+    and page numbers match ``chunk_document`` on the joined text. Text is
+    buffered up to ``_STREAM_WINDOW_CHARS``; the window's chunks are yielded
+    except the last, which is re-chunked together with the next window.
+    """
+    chunker = _get_chunker(strategy)
+    page_offsets: list[int] = []
+    page = None
+    buffer, base = "", 0  # buffer holds the document text from offset base on
+    index = 0
+    section = None  # section in effect where the buffer starts
+
+    def window(spans):
+        nonlocal index
+        for start, end, span_section in spans:
+            yield _describe(buffer, index, start, end, span_section or section, page_offsets, base)
+            index += 1
+
+    for record in records:
+        if record["page"] != page:
+            if page is not None:
+                buffer += "\n"
+            page = record["page"]
+            page_offsets.append(base + len(buffer))
+        buffer += record["text"]
+        if len(buffer) < _STREAM_WINDOW_CHARS:
+            continue
+        spans = chunker(buffer, max_tokens, overlap_tokens)
+        if len(spans) < 2:
+            continue
+        yield from window(spans[:-1])
+        cut, _, held_section = spans[-1]
+        section = held_section or section
+        buffer, base = buffer[cut:], base + cut
+
+    spans = chunker(buffer, max_tokens, overlap_tokens)
+    if not spans and not index and buffer:
+        spans = [(0, len(buffer), None)]
+    yield from window(spans)
+
+
+def merge_chunks(pieces: list[tuple[int, str]]) -> str:
+    """Join ``(start offset, text)`` pieces of one document, collapsing overlaps."""
+    merged = ""
+    merged_end = None
+    for start, text in sorted(pieces):
+        end = start + len(text)
+        if merged_end is None:
+            merged, merged_end = text, end
+        elif start >= merged_end:
+            merged += "\n" + text
+            merged_end = end
+        elif end > merged_end:
+            merged += text[merged_end - start:]
+            merged_end = end
+    return merged
@@ -11,11 +11,90 @@ GROK_MODEL = "llama-3.1-8b-instant"
 # Configuration
 API_PROVIDER = "grok"  # Using Grok instead of Hugging Face
 
+# LLM client settings (shared async connection pool)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))  # in-flight completions per worker
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "10"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "30"))  # seconds
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))  # seconds
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+# LLM response cache (in-memory LRU + on-disk SQLite)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(os.path.dirname(__file__), "llm_cache.db"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))  # seconds
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "256"))
+LLM_CACHE_DISK_ENTRIES = int(os.getenv("LLM_CACHE_DISK_ENTRIES", "5000"))
+# Comma-separated endpoint names (e.g. "chat.send,lesson_plan.create") that bypass the cache
+LLM_CACHE_DISABLED_ENDPOINTS = {
+    e.strip() for e in os.getenv("LLM_CACHE_DISABLED_ENDPOINTS", "").split(",") if e.strip()
+}
+
+# Semantic cache for paraphrased chat questions
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "1") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))  # min cosine similarity
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", str(7 * 24 * 3600)))  # seconds
+
+# Bulk grading settings
+BULK_EVAL_CONCURRENCY = int(os.getenv("BULK_EVAL_CONCURRENCY", "6"))  # default parallel items per batch
+BULK_EVAL_MAX_CONCURRENCY = int(os.getenv("BULK_EVAL_MAX_CONCURRENCY", "16"))  # upper bound a client may request
+GRADING_JOB_WORKERS = int(os.getenv("GRADING_JOB_WORKERS", "4"))  # background grading workers per process
+BULK_IMAGE_MAX_SHEETS = int(os.getenv("BULK_IMAGE_MAX_SHEETS", "100"))  # answer-sheet images per batch request
+
 
 # Upload settings
 UPLOAD_DIR = "uploads"
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # bytes read/written per step when saving uploads
 ALLOWED_EXTENSIONS = {"pdf", "txt", "doc", "docx", "png", "jpg", "jpeg"}
+DOCUMENT_LIST_PAGE_SIZE = int(os.getenv("DOCUMENT_LIST_PAGE_SIZE", "50"))  # documents per /list page by default
+DOCUMENT_LIST_MAX_PAGE_SIZE = int(os.getenv("DOCUMENT_LIST_MAX_PAGE_SIZE", "500"))  # largest page a client may ask for
+
+# Embedding settings
+EMBED_MODEL_NAME = os.getenv("EMBED_MODEL_NAME", "all-MiniLM-L6-v2")
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))  # chunks per encode batch
+
+# Document chunking settings (see chunking.py)
+CHUNK_STRATEGY = os.getenv("CHUNK_STRATEGY", "structured")  # "structured" or "fixed"
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "256"))  # token budget per chunk
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))  # tokens repeated from the previous chunk
+
+# Hybrid (BM25 + vector) retrieval settings
+BM25_INDEX_PATH = os.getenv("BM25_INDEX_PATH", os.path.join(os.path.dirname(__file__), "bm25_index.db"))
+SEARCH_RRF_K = int(os.getenv("SEARCH_RRF_K", "60"))  # reciprocal rank fusion constant
+
+# Cross-encoder re-ranking of retrieved chunks (optional, off by default)
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "0") == "1"
+RERANK_MODEL_NAME = os.getenv("RERANK_MODEL_NAME", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))  # chunks over-fetched for re-scoring
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+RERANK_BUDGET_MS = int(os.getenv("RERANK_BUDGET_MS", "300"))  # fall back to vector order past this
+RERANK_CACHE_ENTRIES = int(os.getenv("RERANK_CACHE_ENTRIES", "4096"))  # cached (query, chunk) scores
+
+# Prompt assembly (see prompt_builder.py)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))  # max input tokens per prompt
+PROMPT_RESERVED_OUTPUT_TOKENS = int(os.getenv("PROMPT_RESERVED_OUTPUT_TOKENS", "1024"))  # kept free for the answer
+
+# Map-reduce explanations of long documents (see summarizer.py)
+EXPLAIN_SECTION_TOKENS = int(os.getenv("EXPLAIN_SECTION_TOKENS", "2500"))  # document tokens per map step
+
+# Local OCR of image uploads and handwritten answers (see ocr.py)
+OCR_LANG = os.getenv("OCR_LANG", "eng")  # tesseract language(s), e.g. "eng+hin"
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "3000"))  # larger scans are downscaled to this (px)
+OCR_TILE_HEIGHT = int(os.getenv("OCR_TILE_HEIGHT", "1200"))  # taller pages are recognized in bands
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(min(4, os.cpu_count() or 1))))  # tiles recognized at once
+OCR_MIN_CONFIDENCE = float(os.getenv("OCR_MIN_CONFIDENCE", "60"))  # 0-100; lower lines go to the LLM
+OCR_MAX_ESCALATIONS = int(os.getenv("OCR_MAX_ESCALATIONS", "4"))  # regions per image before sending it whole
+OCR_VISION_MODEL = os.getenv("OCR_VISION_MODEL", "meta-llama/llama-4-scout-17b-16e-instruct")  # "" = no LLM
+
+# Background ingestion (extraction + embedding) settings
+INGESTION_MAX_CONCURRENT = int(os.getenv("INGESTION_MAX_CONCURRENT", "2"))  # documents ingested at once
+INGESTION_PROCESS_WORKERS = int(os.getenv("INGESTION_PROCESS_WORKERS", "2"))  # extraction worker processes
+
+# Page-parallel PDF extraction (see pdf_extract.py)
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))  # 0 = in-process
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "8"))  # pages handed to a worker at a time
+PDF_PAGE_TIMEOUT = float(os.getenv("PDF_PAGE_TIMEOUT", "30"))  # seconds before a page is given up on
 
 # Create uploads directory if it doesn't exist
 os.makedirs(UPLOAD_DIR, exist_ok=True)
@@ -0,0 +1,212 @@
+"""Catalog of uploaded documents.
+
+Listing documents used to ``os.listdir`` the upload directory and stat every
+file on each call. The ``documents`` table now holds one row per upload
+(owner, subject, content hash, size, type, page count, ingestion status),
+written by the upload route and kept current by the ingestion pipeline.
+Listings are per owner and keyset-paginated, on the row id (newest first)
+or on the filename for prefix searches, over indexed filter columns, so a
+page costs about the same however many uploads there are.
+
+On startup an empty catalog is filled once from the files already on disk,
+and entries left mid-ingestion by a previous run are marked failed.
+Subjects are stored and matched lowercased, as on the embedded chunks.
+"""
+import os
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import func
+
+from config import UPLOAD_DIR, DOCUMENT_LIST_PAGE_SIZE, DOCUMENT_LIST_MAX_PAGE_SIZE
+from models import SessionLocal, Document, DocumentFile, ExtractedText
+
+# Statuses of an ingestion that was still running
+_IN_FLIGHT = ("queued", "extracting", "embedding")
+
+
+def _file_type(filename: str) -> str:
+    return filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+
+
+def _subject(subject: Optional[str]) -> Optional[str]:
+    # Same normalization as the subject tag on embedded chunks
+    subject = (subject or "").strip().lower()
+    return subject or None
+
+
+def _entry(row: Document) -> dict:
+    return {
+        "id": row.id,
+        "filename": row.filename,
+        "size": row.size,
+        "path": os.path.join(UPLOAD_DIR, row.filename),
+        "file_type": row.file_type,
+        "content_hash": row.content_hash,
+        "page_count": row.page_count,
+        "status": row.status,
+        "error": row.error,
+        "owner_id": row.owner_id,
+        "subject": row.subject,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+    }
+
+
+def record_upload(filename: str, size: int, content_hash: str, owner_id: Optional[int] = None,
+                  subject: Optional[str] = None) -> dict:
+    """Add or refresh an upload's entry, queued for ingestion.
+
+    Re-uploading a filename keeps its original ``created_at`` (and its place
+    in listings) but takes the new content, owner and subject.
+    """
+    db = SessionLocal()
+    try:
+        row = db.query(Document).filter(Document.filename == filename).first()
+        if row is None:
+            row = Document(filename=filename)
+            db.add(row)
+        row.size = size
+        row.content_hash = content_hash
+        row.file_type = _file_type(filename)
+        row.owner_id = owner_id
+        row.subject = _subject(subject)
+        row.page_count = None
+        row.status = "queued"
+        row.error = None
+        db.commit()
+        return _entry(row)
+    finally:
+        db.close()
+
+
+def set_status(filename: str, status: str, content_hash: Optional[str] = None,
+               page_count: Optional[int] = None, error: Optional[str] = None):
+    """Record an ingestion status change; fields left as None are kept."""
+    db = SessionLocal()
+    try:
+        row = db.query(Document).filter(Document.filename == filename).first()
+        if row is None:
+            return
+        row.status = status
+        row.error = error
+        if content_hash is not None:
+            row.content_hash = content_hash
+        if page_count is not None:
+            row.page_count = page_count
+        db.commit()
+    except Exception as e:
+        # The in-memory status is still current; the catalog catches up next change
+        print(f"Error updating catalog entry for {filename}: {str(e)}")
+    finally:
+        db.close()
+
+
+def get_document(filename: str) -> Optional[dict]:
+    """Catalog entry for one upload, or None."""
+    db = SessionLocal()
+    try:
+        row = db.query(Document).filter(Document.filename == filename).first()
+        return _entry(row) if row else None
+    finally:
+        db.close()
+
+
+def list_documents(owner_id: Optional[int] = None, file_type: Optional[str] = None,
+                   status: Optional[str] = None, subject: Optional[str] = None,
+                   prefix: Optional[str] = None, limit: int = DOCUMENT_LIST_PAGE_SIZE,
+                   cursor: Optional[str] = None) -> dict:
+    """One page of one owner's uploads, with optional filters.
+
+    ``owner_id`` None lists the uploads made without a token. Pages are
+    newest first, or in filename order when ``prefix`` (the start of the
+    filename) is given, so every page is read off an index in order.
+    Returns ``{"documents", "next_cursor"}``; pass ``next_cursor`` back as
+    ``cursor`` for the following page (it is None on the last one).
+    Raises ValueError for a malformed cursor.
+    """
+    limit = max(1, min(limit, DOCUMENT_LIST_MAX_PAGE_SIZE))
+    db = SessionLocal()
+    try:
+        query = db.query(Document)
+        if owner_id is not None:
+            query = query.filter(Document.owner_id == owner_id)
+        else:
+            query = query.filter(Document.owner_id.is_(None))
+        if file_type:
+            query = query.filter(Document.file_type == file_type.lower().lstrip("."))
+        if status:
+            query = query.filter(Document.status == status)
+        subject = _subject(subject)
+        if subject:
+            query = query.filter(Document.subject == subject)
+
+        if prefix:
+            # A range rather than LIKE, so (owner_id, filename) serves both the
+            # filter and the order
+            query = query.filter(Document.filename >= prefix, Document.filename < prefix + "\U0010ffff")
+            if cursor is not None:
+                query = query.filter(Document.filename > cursor)
+            query = query.order_by(Document.filename)
+        else:
+            if cursor is not None:
+                query = query.filter(Document.id < int(cursor))
+            query = query.order_by(Document.id.desc())
+
+        rows = query.limit(limit + 1).all()
+        page = rows[:limit]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = page[-1].filename if prefix else str(page[-1].id)
+        return {"documents": [_entry(row) for row in page], "next_cursor": next_cursor}
+    finally:
+        db.close()
+
+
+def _backfill(db) -> int:
+    """Catalog the files already in the upload directory (one directory scan)."""
+    hashes = {f.filename: f.content_hash for f in db.query(DocumentFile.filename, DocumentFile.content_hash)}
+    page_counts = dict(db.query(ExtractedText.content_hash, ExtractedText.page_count))
+
+    entries = []
+    with os.scandir(UPLOAD_DIR) as it:
+        for entry in it:
+            # Skip the blob store and in-flight temp files
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            stat = entry.stat()
+            content_hash = hashes.get(entry.name)
+            page_count = page_counts.get(content_hash)
+            entries.append(Document(
+                filename=entry.name, size=stat.st_size, file_type=_file_type(entry.name),
+                content_hash=content_hash, page_count=page_count,
+                status="ready" if page_count is not None else "unknown",
+                created_at=datetime.utcfromtimestamp(stat.st_mtime),
+            ))
+    # Oldest first, so ids follow upload order
+    entries.sort(key=lambda row: row.created_at)
+    db.add_all(entries)
+    db.commit()
+    return len(entries)
+
+
+def sync_catalog() -> dict:
+    """Backfill an empty catalog, fail ingestions cut short by a restart and
+    lowercase subjects recorded before they were normalized (call on startup)."""
+    db = SessionLocal()
+    try:
+        backfilled = 0
+        if db.query(Document.id).first() is None:
+            backfilled = _backfill(db)
+        interrupted = (
+            db.query(Document)
+            .filter(Document.status.in_(_IN_FLIGHT))
+            .update({"status": "failed", "error": "Interrupted by a server restart; upload again"},
+                    synchronize_session=False)
+        )
+        db.query(Document).filter(Document.subject != func.lower(func.trim(Document.subject))).update(
+            {"subject": func.lower(func.trim(Document.subject))}, synchronize_session=False
+        )
+        db.commit()
+        return {"backfilled": backfilled, "interrupted": interrupted}
+    finally:
+        db.close()
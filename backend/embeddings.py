@@ -0,0 +1,92 @@
+"""Embedding service owning the single sentence-transformer instance.
+
+Every vector in the app (document chunks, search queries, the semantic
+cache) is produced here, in batches of ``EMBED_BATCH_SIZE``, as L2-normalised
+float32 arrays. Vectors are handed to Chroma explicitly, so Chroma never
+loads its own default embedding model alongside ours.
+"""
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+from config import EMBED_MODEL_NAME, EMBED_BATCH_SIZE
+
+# Try to import sentence-transformers for dense embeddings
+try:
+    from sentence_transformers import SentenceTransformer
+    SENTENCE_AVAILABLE = True
+except Exception:
+    SentenceTransformer = None
+    SENTENCE_AVAILABLE = False
+
+
+class EmbeddingService:
+    """Lazily loaded sentence-transformer with batched, normalised encoding."""
+
+    def __init__(self, model_name: str = EMBED_MODEL_NAME, batch_size: int = EMBED_BATCH_SIZE):
+        self.model_name = model_name
+        self.batch_size = max(1, batch_size)
+        self._model = None
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "chunks": 0, "batches": 0, "seconds": 0.0}
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """Encode ``texts`` into an (n, dim) float32 array of unit vectors."""
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+
+        start = time.perf_counter()
+        vectors = self.model.encode(
+            list(texts),
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["chunks"] += len(texts)
+            self._stats["batches"] += -(-len(texts) // self.batch_size)
+            self._stats["seconds"] += elapsed
+        return np.asarray(vectors, dtype=np.float32)
+
+    def stats(self) -> dict:
+        """Encode counters and throughput (chunks/sec)."""
+        seconds = self._stats["seconds"]
+        return {
+            "model": self.model_name,
+            "batch_size": self.batch_size,
+            "loaded": self._model is not None,
+            **self._stats,
+            "seconds": round(seconds, 3),
+            "chunks_per_sec": round(self._stats["chunks"] / seconds, 1) if seconds > 0 else 0.0,
+        }
+
+
+_EMBEDDER: Optional[EmbeddingService] = None
+
+
+def get_embedder() -> Optional[EmbeddingService]:
+    """Return the process-wide embedding service, or None if unavailable."""
+    global _EMBEDDER
+    if not SENTENCE_AVAILABLE:
+        return None
+    if _EMBEDDER is None:
+        _EMBEDDER = EmbeddingService()
+    return _EMBEDDER
@@ -0,0 +1,184 @@
+"""Concurrent bulk grading engine.
+
+Dispatches every answer in a batch to the LLM concurrently under a semaphore,
+keeps results in input order, records per-item failures instead of failing
+the whole batch, and reports throughput and latency percentiles.
+
+Scanned answer sheets go through a two-stage pipeline (``grade_sheets``):
+OCR runs for up to ``OCR_WORKERS`` sheets at once (their tiles share OCR's
+thread pool) while earlier sheets are already being graded, and each result
+is yielded as soon as it is ready.
+"""
+import asyncio
+import math
+import time
+from contextlib import nullcontext
+from typing import Optional
+
+import llm_client
+import ocr
+from config import BULK_EVAL_CONCURRENCY, BULK_EVAL_MAX_CONCURRENCY, OCR_WORKERS
+from utils import achat_with_llm
+
+
+def build_quick_eval_prompt(item: dict) -> str:
+    """Prompt used to grade one {question, student_answer, correct_answer} item."""
+    return f"""Quick evaluation of student answer:
+Question: {item['question']}
+Answer: {item['student_answer']}
+Expected: {item['correct_answer']}
+
+Score (0-100) and brief feedback."""
+
+
+def build_image_eval_prompt(question: str, extracted_text: str, answer_explanation: str = "") -> str:
+    """Prompt used to grade the OCR'd text of a handwritten/photographed answer."""
+    return f"""The following is a student's handwritten/photographed answer to a question.
+
+Question: {question}
+
+Extracted Answer Text:
+{extracted_text}
+
+{answer_explanation if answer_explanation else 'Please evaluate this answer based on accuracy and completeness.'}
+
+Provide:
+1. Transcription confirmation (is the text correct?)
+2. Accuracy assessment
+3. Completeness check
+4. Score (0-100)
+5. Feedback and suggestions"""
+
+
+def resolve_concurrency(concurrency: Optional[int] = None) -> int:
+    """Clamp a requested concurrency to the configured bounds."""
+    if not concurrency:
+        concurrency = BULK_EVAL_CONCURRENCY
+    return max(1, min(int(concurrency), BULK_EVAL_MAX_CONCURRENCY))
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """Nearest-rank percentile; 0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+async def grade_item(index: int, item: dict) -> dict:
+    """Grade a single item, returning a result record (never raises)."""
+    question = item.get("question") if isinstance(item, dict) else None
+    start = time.perf_counter()
+    try:
+        prompt = build_quick_eval_prompt(item)
+        evaluation = await llm_client.acomplete(prompt)
+        status, error = "success", None
+    except KeyError as e:
+        evaluation, status, error = None, "error", f"Missing field: {e.args[0]}"
+    except Exception as e:
+        evaluation, status, error = None, "error", str(e)
+
+    return {
+        "index": index,
+        "question": question,
+        "status": status,
+        "evaluation": evaluation,
+        "error": error,
+        "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+
+
+async def grade_batch(items: list, concurrency: Optional[int] = None) -> dict:
+    """Grade ``items`` concurrently and return ordered results plus stats."""
+    limit = resolve_concurrency(concurrency)
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(index: int, item: dict) -> dict:
+        async with semaphore:
+            return await grade_item(index, item)
+
+    start = time.perf_counter()
+    # gather preserves the order of its arguments, so results line up with input
+    results = await asyncio.gather(*(run(i, item) for i, item in enumerate(items)))
+    wall_time = time.perf_counter() - start
+
+    return {"results": list(results), "stats": _batch_stats(list(results), limit, wall_time)}
+
+
+def _batch_stats(results: list[dict], limit: int, wall_time: float) -> dict:
+    latencies = [r["latency_ms"] for r in results]
+    failed = sum(1 for r in results if r["status"] != "success")
+    return {
+        "total": len(results),
+        "succeeded": len(results) - failed,
+        "failed": failed,
+        "concurrency": limit,
+        "wall_time_s": round(wall_time, 3),
+        "items_per_sec": round(len(results) / wall_time, 2) if wall_time > 0 else 0.0,
+        "p50_latency_ms": percentile(latencies, 50),
+        "p95_latency_ms": percentile(latencies, 95),
+    }
+
+
+async def grade_sheet(index: int, path: str, filename: str, question: str, answer_explanation: str = "",
+                      ocr_slots: Optional[asyncio.Semaphore] = None,
+                      grade_slots: Optional[asyncio.Semaphore] = None) -> dict:
+    """OCR and grade one answer-sheet image, returning a result record (never raises)."""
+    record = {"index": index, "filename": filename, "status": "error", "extracted_text": None,
+              "ocr_confidence": None, "ocr_engine": None, "ocr_degraded": None, "evaluation": None, "error": None}
+    start = time.perf_counter()
+    try:
+        async with ocr_slots or nullcontext():
+            recognition = asyncio.ensure_future(asyncio.to_thread(ocr.recognize_image, path))
+            try:
+                recognized = await asyncio.shield(recognition)
+            except asyncio.CancelledError:
+                # The OCR thread cannot be interrupted; finish it before the
+                # caller removes the image it is reading
+                await asyncio.wait({recognition})
+                raise
+        record.update(extracted_text=recognized["text"], ocr_confidence=recognized["confidence"],
+                      ocr_engine=recognized["engine"], ocr_degraded=recognized["degraded"])
+
+        prompt = build_image_eval_prompt(question, recognized["text"], answer_explanation)
+        async with grade_slots or nullcontext():
+            evaluation = await achat_with_llm(prompt, cache_endpoint="evaluation.evaluate-image")
+        if evaluation.startswith("Error in chat:"):
+            raise Exception(evaluation)
+        record.update(status="success", evaluation=evaluation)
+    except Exception as e:
+        record["error"] = str(e)
+    record["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return record
+
+
+async def grade_sheets(sheets: list[tuple[str, str]], question: str, answer_explanation: str = "",
+                       concurrency: Optional[int] = None):
+    """Grade ``(path, filename)`` answer sheets, yielding results as they finish.
+
+    Yields ``("item", result)`` per sheet in completion order (``result
+    ["index"]`` is its position in ``sheets``), then ``("done", stats)``.
+    """
+    limit = resolve_concurrency(concurrency)
+    ocr_slots = asyncio.Semaphore(max(1, OCR_WORKERS))
+    grade_slots = asyncio.Semaphore(limit)
+
+    start = time.perf_counter()
+    tasks = [
+        asyncio.create_task(grade_sheet(i, path, filename, question, answer_explanation, ocr_slots, grade_slots))
+        for i, (path, filename) in enumerate(sheets)
+    ]
+    results = []
+    try:
+        for finished in asyncio.as_completed(tasks):
+            result = await finished
+            results.append(result)
+            yield "item", result
+    finally:
+        # The client went away: stop OCR/grading of the remaining sheets, and
+        # wait for OCR already running so the caller can delete the images
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    yield "done", _batch_stats(results, limit, time.perf_counter() - start)
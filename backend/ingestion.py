@@ -0,0 +1,194 @@
+"""Background ingestion pipeline for uploaded documents.
+
+An upload returns as soon as the file is on disk; text extraction then runs
+in a process pool (PDF/DOCX parsing is CPU-bound and would otherwise hold the
+GIL; PDFs are split by page across ``pdf_extract``'s pool) and embedding runs
+in a worker thread, so neither blocks the event loop. PDFs and plain text are
+streamed: pages are sanitized, stored, chunked and embedded as they are
+extracted, so memory stays flat however large the file is. At most
+``INGESTION_MAX_CONCURRENT`` documents are ingested at once; the rest wait
+their turn with status ``queued``. Content that is already extracted
+and embedded (a duplicate upload) is only hashed, never re-processed.
+Status changes are also written to the document catalog, so listings show
+them and they outlive the process.
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import document_catalog
+import pdf_extract
+import text_store
+from config import UPLOAD_DIR, INGESTION_MAX_CONCURRENT, INGESTION_PROCESS_WORKERS
+from blob_store import remove_blob
+from chunking import chunk_stream
+from utils import (
+    extract_document_pages, iter_document_records, sanitize_records,
+    embed_document, embed_chunks, delete_document_vectors, is_embedded,
+)
+
+# Their extractors load the whole file anyway, so these go through the process
+# pool; PDFs and plain text are streamed
+_WHOLE_FILE_EXTENSIONS = (".docx", ".doc", ".png", ".jpg", ".jpeg")
+
+_PROCESS_POOL: Optional[ProcessPoolExecutor] = None
+_SEMAPHORE: Optional[asyncio.Semaphore] = None
+_TASKS: set = set()
+_STATUS: dict[str, dict] = {}
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    global _PROCESS_POOL
+    if _PROCESS_POOL is None:
+        # spawn: forking a server with live threads can deadlock the child
+        _PROCESS_POOL = ProcessPoolExecutor(
+            max_workers=max(1, INGESTION_PROCESS_WORKERS), mp_context=multiprocessing.get_context("spawn")
+        )
+    return _PROCESS_POOL
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _SEMAPHORE
+    if _SEMAPHORE is None:
+        _SEMAPHORE = asyncio.Semaphore(max(1, INGESTION_MAX_CONCURRENT))
+    return _SEMAPHORE
+
+
+def _set_status(filename: str, status: str, **fields):
+    entry = _STATUS.setdefault(filename, {"filename": filename})
+    entry.update(fields, status=status, updated_at=time.time())
+
+
+async def _update_status(filename: str, status: str, **fields):
+    _set_status(filename, status, **fields)
+    await asyncio.to_thread(
+        document_catalog.set_status, filename, status,
+        fields.get("content_hash"), fields.get("page_count"), fields.get("error"),
+    )
+
+
+def get_status(filename: str) -> Optional[dict]:
+    """Ingestion status for an upload: queued, extracting, embedding, ready or failed."""
+    entry = _STATUS.get(filename)
+    return dict(entry) if entry else None
+
+
+def _flag_embedding(filename: str, content_hash: str, chunks):
+    """Pass ``chunks`` through, moving the upload to ``embedding`` at the first one."""
+    for i, chunk in enumerate(chunks):
+        if i == 0:
+            _set_status(filename, "embedding", content_hash=content_hash)
+            document_catalog.set_status(filename, "embedding", content_hash)
+        yield chunk
+
+
+def _stream_ingest(filename: str, file_path: str, content_hash: str, replaced_hash: Optional[str],
+                   owner_id: Optional[int], subject: Optional[str]) -> tuple[dict, dict]:
+    """Extract, store and embed a document in one pass over its page records."""
+    recorder = text_store.TextRecorder()
+    records = recorder.feed(sanitize_records(iter_document_records(file_path)))
+    chunks = _flag_embedding(filename, content_hash, chunk_stream(records))
+    report = embed_chunks(filename, chunks, content_hash, replaced_hash, owner_id, subject)
+    # Embedding stops early when the content is already embedded; finish extracting
+    for _ in records:
+        pass
+    return text_store.save_recorded(content_hash, recorder, filename), report
+
+
+async def _extract_and_embed(filename: str, content_hash: str, record: Optional[dict],
+                             replaced_hash: Optional[str], owner_id: Optional[int],
+                             subject: Optional[str]) -> tuple[dict, dict]:
+    """Extract (unless ``record`` is the stored text) and embed; returns ``(record, report)``."""
+    file_path = os.path.join(UPLOAD_DIR, filename)
+    if record is None and not file_path.lower().endswith(_WHOLE_FILE_EXTENSIONS):
+        return await asyncio.to_thread(
+            _stream_ingest, filename, file_path, content_hash, replaced_hash, owner_id, subject
+        )
+
+    if record is None:
+        loop = asyncio.get_running_loop()
+        pages = await loop.run_in_executor(_get_process_pool(), extract_document_pages, file_path)
+        record = await asyncio.to_thread(text_store.save_pages, content_hash, pages, filename)
+
+    await _update_status(filename, "embedding", content_hash=content_hash, page_count=record["page_count"])
+    report = {"added": 0, "reused": 0, "removed": 0}
+    if record["text"]:
+        report = await asyncio.to_thread(
+            embed_document, filename, record["text"], content_hash, replaced_hash,
+            record["page_offsets"], owner_id, subject
+        )
+    elif replaced_hash:
+        await asyncio.to_thread(delete_document_vectors, replaced_hash)
+    return record, report
+
+
+async def _ingest(filename: str, replaced_hash: Optional[str] = None, owner_id: Optional[int] = None,
+                  subject: Optional[str] = None):
+    async with _get_semaphore():
+        started = time.perf_counter()
+        try:
+            if replaced_hash:
+                # The filename's previous content is no longer aliased by anything;
+                # its vectors are diffed against the new version while embedding
+                await asyncio.to_thread(remove_blob, replaced_hash)
+
+            await _update_status(filename, "extracting")
+            content_hash = await asyncio.to_thread(text_store.content_hash_for, filename)
+            if content_hash is None:
+                raise FileNotFoundError(f"{filename} is no longer on disk")
+
+            page_count = await asyncio.to_thread(text_store.page_count_for, content_hash)
+            if page_count is not None and await asyncio.to_thread(is_embedded, content_hash):
+                # Duplicate content: only the hash was read; its stored chunks are
+                # relabelled for this upload without loading or chunking the text
+                deduplicated, record = True, {"page_count": page_count}
+                await _update_status(filename, "embedding", content_hash=content_hash, page_count=page_count)
+                report = await asyncio.to_thread(
+                    embed_chunks, filename, (), content_hash, replaced_hash, owner_id, subject
+                )
+            else:
+                record = await asyncio.to_thread(text_store.load_text, content_hash, filename)
+                deduplicated = record is not None
+                record, report = await _extract_and_embed(
+                    filename, content_hash, record, replaced_hash, owner_id, subject
+                )
+
+            await _update_status(
+                filename, "ready", error=None, content_hash=content_hash, page_count=record["page_count"],
+                deduplicated=deduplicated and not report["added"],
+                chunks_added=report["added"], chunks_reused=report["reused"],
+                chunks_removed=report["removed"], seconds=round(time.perf_counter() - started, 2)
+            )
+        except Exception as e:
+            print(f"Error ingesting {filename}: {str(e)}")
+            if replaced_hash:
+                await asyncio.to_thread(delete_document_vectors, replaced_hash)
+            await _update_status(filename, "failed", error=str(e))
+
+
+def schedule_ingestion(filename: str, replaced_hash: Optional[str] = None, owner_id: Optional[int] = None,
+                       subject: Optional[str] = None) -> dict:
+    """Queue an upload for extraction and embedding; returns its initial status.
+
+    ``replaced_hash`` is the content this filename pointed at before, if no
+    other filename aliases it; its blob is removed and its unchanged chunk
+    vectors are carried over to the new version. ``owner_id`` and ``subject``
+    are recorded on the document's chunks for filtered search.
+    """
+    _set_status(filename, "queued", error=None)
+    task = asyncio.create_task(_ingest(filename, replaced_hash, owner_id, subject))
+    _TASKS.add(task)
+    task.add_done_callback(_TASKS.discard)
+    return get_status(filename)
+
+
+def shutdown():
+    """Stop the extraction process pools (call on app shutdown)."""
+    global _PROCESS_POOL
+    if _PROCESS_POOL is not None:
+        _PROCESS_POOL.shutdown(wait=False, cancel_futures=True)
+        _PROCESS_POOL = None
+    pdf_extract.shutdown()
@@ -0,0 +1,293 @@
+"""Background job queue for bulk grading.
+
+Jobs and their items are stored in SQLite (``grading_jobs`` /
+``grading_job_items``) so they survive a restart. A pool of asyncio workers
+pulls pending items from an in-process queue, grades them with
+``grading.grade_item`` and writes each result back as soon as it is ready.
+On startup every item still pending is re-queued, so an interrupted job
+resumes where it stopped instead of re-grading completed items. Database
+work runs in worker threads so it never blocks the event loop.
+"""
+import asyncio
+import json
+import uuid
+from datetime import datetime
+from typing import Optional
+
+from config import GRADING_JOB_WORKERS
+from grading import grade_item
+from models import SessionLocal, GradingJob, GradingJobItem
+
+_QUEUE: Optional[asyncio.Queue] = None
+_WORKERS: list[asyncio.Task] = []
+_JOB_CONDITIONS: dict[str, asyncio.Condition] = {}
+_JOB_VERSIONS: dict[str, int] = {}
+
+
+def _get_queue() -> asyncio.Queue:
+    global _QUEUE
+    if _QUEUE is None:
+        _QUEUE = asyncio.Queue()
+    return _QUEUE
+
+
+def _get_condition(job_id: str) -> asyncio.Condition:
+    condition = _JOB_CONDITIONS.get(job_id)
+    if condition is None:
+        condition = _JOB_CONDITIONS[job_id] = asyncio.Condition()
+    return condition
+
+
+async def _notify(job_id: str, finished: bool = False):
+    condition = _get_condition(job_id)
+    async with condition:
+        _JOB_VERSIONS[job_id] = _JOB_VERSIONS.get(job_id, 0) + 1
+        if finished:
+            # Nothing changes after this; waiters see their condition retired
+            _JOB_CONDITIONS.pop(job_id, None)
+            _JOB_VERSIONS.pop(job_id, None)
+        condition.notify_all()
+
+
+def item_to_dict(item: GradingJobItem) -> dict:
+    """Serialize a job item result for API responses."""
+    payload = json.loads(item.payload) if item.payload else {}
+    return {
+        "index": item.position,
+        "question": payload.get("question") if isinstance(payload, dict) else None,
+        "status": item.status,
+        "evaluation": item.evaluation,
+        "error": item.error,
+        "latency_ms": item.latency_ms,
+    }
+
+
+def job_to_dict(job: GradingJob, items: list[GradingJobItem]) -> dict:
+    """Serialize a job with progress counts."""
+    done = [i for i in items if i.status != "pending"]
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "total_items": job.total_items,
+        "completed_items": len(done),
+        "failed_items": sum(1 for i in done if i.status == "error"),
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "completed_at": job.completed_at.isoformat() if job.completed_at else None,
+    }
+
+
+def _create_job(items: list) -> tuple[dict, list[int]]:
+    db = SessionLocal()
+    try:
+        job = GradingJob(id=uuid.uuid4().hex, status="queued", total_items=len(items))
+        db.add(job)
+        job_items = [
+            GradingJobItem(job_id=job.id, position=i, payload=json.dumps(item), status="pending")
+            for i, item in enumerate(items)
+        ]
+        if not job_items:
+            job.status = "completed"
+            job.completed_at = datetime.utcnow()
+        db.add_all(job_items)
+        db.commit()
+        return job_to_dict(job, job_items), [i.id for i in job_items]
+    finally:
+        db.close()
+
+
+async def submit_job(items: list) -> dict:
+    """Persist a new job and queue all of its items. Returns the job summary."""
+    summary, item_ids = await asyncio.to_thread(_create_job, items)
+    queue = _get_queue()
+    for item_id in item_ids:
+        queue.put_nowait(item_id)
+    return summary
+
+
+def get_job(job_id: str, since: int = 0, include_results: bool = True) -> Optional[dict]:
+    """Return job progress plus finished item results at positions >= ``since``."""
+    db = SessionLocal()
+    try:
+        job = db.query(GradingJob).filter(GradingJob.id == job_id).first()
+        if not job:
+            return None
+        items = job.items
+        summary = job_to_dict(job, items)
+        if include_results:
+            summary["results"] = [
+                item_to_dict(i) for i in items if i.status != "pending" and i.position >= since
+            ]
+        return summary
+    finally:
+        db.close()
+
+
+def _finished_items(job_id: str, exclude: set) -> tuple[Optional[str], list[dict]]:
+    db = SessionLocal()
+    try:
+        job = db.query(GradingJob).filter(GradingJob.id == job_id).first()
+        if not job:
+            return None, []
+        rows = (
+            db.query(GradingJobItem)
+            .filter(GradingJobItem.job_id == job_id, GradingJobItem.status != "pending")
+            .order_by(GradingJobItem.completed_at)
+            .all()
+        )
+        return job.status, [item_to_dict(r) for r in rows if r.position not in exclude]
+    finally:
+        db.close()
+
+
+async def stream_job(job_id: str, keepalive: float = 15.0):
+    """Yield finished item results as they complete, ending when the job is done.
+
+    Yields ``("item", result)`` tuples, ``("keepalive", None)`` while waiting,
+    and a final ``("done", summary)``.
+    """
+    sent: set = set()
+    while True:
+        condition = _get_condition(job_id)
+        version = _JOB_VERSIONS.get(job_id, 0)
+        status, results = await asyncio.to_thread(_finished_items, job_id, sent)
+        if status is None or status == "completed":
+            # Also drops a condition created after the job finished
+            if _JOB_CONDITIONS.get(job_id) is condition:
+                _JOB_CONDITIONS.pop(job_id, None)
+                _JOB_VERSIONS.pop(job_id, None)
+        if status is None:
+            return
+        for result in results:
+            sent.add(result["index"])
+            yield "item", result
+        if status == "completed":
+            yield "done", await asyncio.to_thread(get_job, job_id, 0, False)
+            return
+        try:
+            async with condition:
+                await asyncio.wait_for(
+                    condition.wait_for(
+                        lambda: _JOB_CONDITIONS.get(job_id) is not condition
+                        or _JOB_VERSIONS.get(job_id, 0) != version
+                    ),
+                    timeout=keepalive,
+                )
+        except asyncio.TimeoutError:
+            yield "keepalive", None
+
+
+def _mark_running(db, job: GradingJob):
+    if job.status == "queued":
+        job.status = "running"
+        db.commit()
+
+
+def _complete_if_done(db, job: GradingJob) -> bool:
+    """Close the job if no item is pending; True if it is completed."""
+    pending = (
+        db.query(GradingJobItem)
+        .filter(GradingJobItem.job_id == job.id, GradingJobItem.status == "pending")
+        .count()
+    )
+    if pending == 0 and job.status != "completed":
+        job.status = "completed"
+        job.completed_at = datetime.utcnow()
+        db.commit()
+    return job.status == "completed"
+
+
+def _start_item(item_id: int) -> Optional[tuple[int, dict]]:
+    """Mark the item's job running; returns ``(position, payload)``, or None if already done."""
+    db = SessionLocal()
+    try:
+        item = db.query(GradingJobItem).filter(GradingJobItem.id == item_id).first()
+        if not item or item.status != "pending":
+            return None
+        _mark_running(db, item.job)
+        try:
+            payload = json.loads(item.payload)
+        except Exception:
+            payload = {}
+        return item.position, payload
+    finally:
+        db.close()
+
+
+def _save_result(item_id: int, result: dict) -> tuple[str, bool]:
+    """Store an item's result; returns ``(job_id, job_completed)``."""
+    db = SessionLocal()
+    try:
+        item = db.query(GradingJobItem).filter(GradingJobItem.id == item_id).first()
+        item.status = result["status"]
+        item.evaluation = result["evaluation"]
+        item.error = result["error"]
+        item.latency_ms = result["latency_ms"]
+        item.completed_at = datetime.utcnow()
+        db.commit()
+        return item.job_id, _complete_if_done(db, item.job)
+    finally:
+        db.close()
+
+
+async def _process_item(item_id: int):
+    started = await asyncio.to_thread(_start_item, item_id)
+    if started is None:
+        return
+    position, payload = started
+    result = await grade_item(position, payload)
+    job_id, completed = await asyncio.to_thread(_save_result, item_id, result)
+    await _notify(job_id, finished=completed)
+
+
+async def _worker():
+    queue = _get_queue()
+    while True:
+        item_id = await queue.get()
+        try:
+            await _process_item(item_id)
+        except Exception as e:
+            print(f"Error processing grading job item {item_id}: {str(e)}")
+        finally:
+            queue.task_done()
+
+
+def _requeue_unfinished() -> int:
+    """Queue every pending item left over from a previous run."""
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(GradingJobItem.id)
+            .join(GradingJob)
+            .filter(GradingJob.status != "completed", GradingJobItem.status == "pending")
+            .order_by(GradingJobItem.job_id, GradingJobItem.position)
+            .all()
+        )
+        # Jobs whose items all finished right before a shutdown still need closing
+        for job in db.query(GradingJob).filter(GradingJob.status != "completed").all():
+            _complete_if_done(db, job)
+    finally:
+        db.close()
+
+    queue = _get_queue()
+    for (item_id,) in rows:
+        queue.put_nowait(item_id)
+    return len(rows)
+
+
+def start_workers(num_workers: Optional[int] = None):
+    """Start the worker pool and resume unfinished jobs (call on app startup)."""
+    if _WORKERS:
+        return
+    resumed = _requeue_unfinished()
+    if resumed:
+        print(f"Resuming {resumed} pending grading job items")
+    for _ in range(max(1, num_workers or GRADING_JOB_WORKERS)):
+        _WORKERS.append(asyncio.create_task(_worker()))
+
+
+async def stop_workers():
+    """Cancel the worker pool (call on app shutdown)."""
+    for task in _WORKERS:
+        task.cancel()
+    await asyncio.gather(*_WORKERS, return_exceptions=True)
+    _WORKERS.clear()
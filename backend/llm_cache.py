@@ -0,0 +1,186 @@
+"""Content-addressed cache for LLM responses.
+
+Entries are keyed on a SHA-256 of (model, system context, prompt, max_tokens)
+so identical requests from any endpoint share one answer. Lookups go through
+a small in-memory LRU first and an on-disk SQLite tier second; entries expire
+after ``LLM_CACHE_TTL`` seconds and the disk tier is trimmed to
+``LLM_CACHE_DISK_ENTRIES`` rows, least recently used first.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from config import (
+    GROK_MODEL,
+    LLM_CACHE_ENABLED,
+    LLM_CACHE_PATH,
+    LLM_CACHE_TTL,
+    LLM_CACHE_MEMORY_ENTRIES,
+    LLM_CACHE_DISK_ENTRIES,
+    LLM_CACHE_DISABLED_ENDPOINTS,
+)
+
+# How many writes between disk-tier eviction sweeps
+_SWEEP_EVERY = 50
+
+
+def make_key(prompt: str, system_context: Optional[str] = None, max_tokens: int = 1000,
+             model: str = GROK_MODEL) -> str:
+    """Hash the parameters that determine an LLM response."""
+    material = json.dumps([model, system_context or "", prompt, max_tokens], ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """Two-tier (memory LRU + SQLite) response cache with hit/miss counters."""
+
+    def __init__(self, path: str, ttl: int, memory_entries: int, disk_entries: int):
+        self.path = path
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._writes = 0
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._endpoint_stats: dict[str, dict] = {}
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " key TEXT PRIMARY KEY, response TEXT NOT NULL,"
+                " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_accessed ON llm_cache (accessed_at)")
+            self._conn.commit()
+        return self._conn
+
+    def _count(self, endpoint: Optional[str], field: str):
+        self._stats[field] += 1
+        if endpoint:
+            counters = self._endpoint_stats.setdefault(endpoint, {"hits": 0, "misses": 0})
+            counters["misses" if field == "misses" else "hits"] += 1
+
+    def _remember(self, key: str, created_at: float, response: str):
+        self._memory[key] = (created_at, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str, endpoint: Optional[str] = None) -> Optional[str]:
+        """Return the cached response for ``key`` or None on miss/expiry."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self._count(endpoint, "memory_hits")
+                    return entry[1]
+                del self._memory[key]
+
+            try:
+                db = self._db()
+                row = db.execute(
+                    "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] > self.ttl:
+                    db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    db.commit()
+                    row = None
+                if row is not None:
+                    db.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                    db.commit()
+                    self._remember(key, row[1], row[0])
+                    self._count(endpoint, "disk_hits")
+                    return row[0]
+            except sqlite3.Error as e:
+                print(f"Error reading LLM cache: {str(e)}")
+
+            self._count(endpoint, "misses")
+            return None
+
+    def put(self, key: str, response: str):
+        """Store a response in both tiers."""
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, response)
+            self._stats["stores"] += 1
+            try:
+                db = self._db()
+                db.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, response, created_at, accessed_at)"
+                    " VALUES (?, ?, ?, ?)",
+                    (key, response, now, now),
+                )
+                db.commit()
+                self._writes += 1
+                if self._writes % _SWEEP_EVERY == 0:
+                    self._sweep(db, now)
+            except sqlite3.Error as e:
+                print(f"Error writing LLM cache: {str(e)}")
+
+    def _sweep(self, db: sqlite3.Connection, now: float):
+        """Drop expired rows, then trim the disk tier to its size limit."""
+        expired = db.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,)).rowcount
+        overflow = db.execute(
+            "DELETE FROM llm_cache WHERE key IN ("
+            " SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.disk_entries,),
+        ).rowcount
+        db.commit()
+        self._stats["evictions"] += max(expired, 0) + max(overflow, 0)
+
+    def clear(self):
+        """Remove every cached response."""
+        with self._lock:
+            self._memory.clear()
+            try:
+                db = self._db()
+                db.execute("DELETE FROM llm_cache")
+                db.commit()
+            except sqlite3.Error as e:
+                print(f"Error clearing LLM cache: {str(e)}")
+
+    def stats(self) -> dict:
+        """Hit/miss counters, overall and per endpoint."""
+        with self._lock:
+            hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+            lookups = hits + self._stats["misses"]
+            try:
+                disk_entries = self._db().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            except sqlite3.Error:
+                disk_entries = None
+            return {
+                **self._stats,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+                "by_endpoint": {k: dict(v) for k, v in self._endpoint_stats.items()},
+            }
+
+
+_CACHE: Optional[LLMResponseCache] = None
+
+
+def get_cache() -> LLMResponseCache:
+    """Return the process-wide response cache."""
+    global _CACHE
+    if _CACHE is None:
+        _CACHE = LLMResponseCache(
+            LLM_CACHE_PATH, LLM_CACHE_TTL, LLM_CACHE_MEMORY_ENTRIES, LLM_CACHE_DISK_ENTRIES
+        )
+    return _CACHE
+
+
+def is_enabled(endpoint: Optional[str]) -> bool:
+    """Whether responses for ``endpoint`` may be cached (None means never)."""
+    return LLM_CACHE_ENABLED and endpoint is not None and endpoint not in LLM_CACHE_DISABLED_ENDPOINTS
@@ -0,0 +1,177 @@
+"""Long-lived async LLM client shared by every route.
+
+One ChatGroq instance is built per process on top of pooled httpx clients
+(keep-alive, bounded connections) instead of constructing a new wrapper for
+every call. Completions are awaited natively, and a semaphore caps how many
+are in flight at once so a burst of requests queues instead of stalling the
+event loop or opening unbounded connections.
+"""
+import asyncio
+import threading
+from typing import Optional
+
+import httpx
+
+from config import (
+    GROK_API_KEY,
+    GROK_MODEL,
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_CONNECTIONS,
+    LLM_MAX_KEEPALIVE_CONNECTIONS,
+    LLM_KEEPALIVE_EXPIRY,
+    LLM_TIMEOUT,
+    LLM_MAX_RETRIES,
+    OCR_VISION_MODEL,
+)
+
+_LLM = None
+_HTTP_CLIENT = None
+_ASYNC_HTTP_CLIENT = None
+_SEMAPHORE = None
+_MODEL_LLMS: dict = {}
+_INIT_LOCK = threading.Lock()
+
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_llm():
+    """Return the process-wide ChatGroq instance, creating it on first use."""
+    global _LLM, _HTTP_CLIENT, _ASYNC_HTTP_CLIENT
+
+    if _LLM is not None:
+        return _LLM
+
+    with _INIT_LOCK:
+        if _LLM is None:
+            try:
+                from langchain_groq import ChatGroq
+            except Exception as e:
+                raise RuntimeError(
+                    "No Grok langchain wrapper available. Install and configure `langchain_groq` "
+                    f"(and set `GROK_API_KEY` in your environment) to use Grok: {str(e)}"
+                )
+
+            _HTTP_CLIENT = httpx.Client(limits=_pool_limits(), timeout=LLM_TIMEOUT)
+            _ASYNC_HTTP_CLIENT = httpx.AsyncClient(limits=_pool_limits(), timeout=LLM_TIMEOUT)
+            try:
+                _LLM = ChatGroq(
+                    model=GROK_MODEL,
+                    api_key=GROK_API_KEY,
+                    timeout=LLM_TIMEOUT,
+                    max_retries=LLM_MAX_RETRIES,
+                    http_client=_HTTP_CLIENT,
+                    http_async_client=_ASYNC_HTTP_CLIENT,
+                )
+            except Exception as e:
+                _HTTP_CLIENT.close()
+                _HTTP_CLIENT = None
+                _ASYNC_HTTP_CLIENT = None
+                raise RuntimeError(f"Could not initialise Grok client: {str(e)}")
+
+    return _LLM
+
+
+def get_llm_for(model: str):
+    """The shared client bound to another model (same connection pool)."""
+    llm = get_llm()
+    if model == GROK_MODEL:
+        return llm
+    with _INIT_LOCK:
+        if model not in _MODEL_LLMS:
+            _MODEL_LLMS[model] = llm.model_copy(update={"model_name": model})
+        return _MODEL_LLMS[model]
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _SEMAPHORE
+    if _SEMAPHORE is None:
+        _SEMAPHORE = asyncio.Semaphore(max(1, LLM_MAX_CONCURRENCY))
+    return _SEMAPHORE
+
+
+def build_messages(prompt: str, system_context: Optional[str] = None) -> list[dict]:
+    """Build the chat messages list sent to the model."""
+    messages = []
+    if system_context:
+        messages.append({"role": "system", "content": system_context})
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+def build_image_messages(prompt: str, image_b64: str, mime: str = "image/png",
+                         system_context: Optional[str] = None) -> list[dict]:
+    """Chat messages asking about one base64-encoded image."""
+    messages = []
+    if system_context:
+        messages.append({"role": "system", "content": system_context})
+    messages.append({"role": "user", "content": [
+        {"type": "text", "text": prompt},
+        {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{image_b64}"}},
+    ]})
+    return messages
+
+
+def _to_text(out) -> str:
+    """Coerce a LangChain message (or dict) into plain text."""
+    content = getattr(out, "content", out)
+    if isinstance(content, dict) and "content" in content:
+        return content["content"]
+    return content
+
+
+async def acomplete(prompt: str, system_context: Optional[str] = None, max_tokens: int = 1000) -> str:
+    """Await a completion without blocking the event loop.
+
+    ``max_tokens`` is accepted for signature compatibility with ``query_grok``
+    but, as before, is not forwarded to the model so long outputs such as
+    lesson plans are not cut short. Errors propagate to the caller.
+    """
+    llm = get_llm()
+    async with _get_semaphore():
+        out = await llm.ainvoke(build_messages(prompt, system_context))
+    return _to_text(out)
+
+
+async def astream(prompt: str, system_context: Optional[str] = None, max_tokens: int = 1000):
+    """Yield completion text pieces as the model produces them."""
+    llm = get_llm()
+    async with _get_semaphore():
+        async for chunk in llm.astream(build_messages(prompt, system_context)):
+            text = _to_text(chunk)
+            if text:
+                yield text
+
+
+def complete(prompt: str, system_context: Optional[str] = None, max_tokens: int = 1000) -> str:
+    """Blocking counterpart of :func:`acomplete` for sync helpers and scripts."""
+    out = get_llm().invoke(build_messages(prompt, system_context))
+    return _to_text(out)
+
+
+def complete_image(prompt: str, image_b64: str, mime: str = "image/png", system_context: Optional[str] = None,
+                   model: str = OCR_VISION_MODEL) -> str:
+    """Blocking completion about an image, using a vision-capable ``model``."""
+    out = get_llm_for(model).invoke(build_image_messages(prompt, image_b64, mime, system_context))
+    return _to_text(out)
+
+
+async def aclose():
+    """Close the pooled HTTP clients (called on application shutdown)."""
+    global _LLM, _HTTP_CLIENT, _ASYNC_HTTP_CLIENT
+    with _INIT_LOCK:
+        http_client, async_http_client = _HTTP_CLIENT, _ASYNC_HTTP_CLIENT
+        _LLM = None
+        _MODEL_LLMS.clear()
+        _HTTP_CLIENT = None
+        _ASYNC_HTTP_CLIENT = None
+
+    if async_http_client is not None:
+        await async_http_client.aclose()
+    if http_client is not None:
+        http_client.close()
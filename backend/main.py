@@ -40,6 +40,39 @@ def ensure_test_user():
         # Startup should not crash if DB or hashing unavailable; log for debugging
         print(f"Warning: could not ensure Testuser exists: {e}")
 
+
+@app.on_event("startup")
+def sync_document_catalog():
+    """Catalog uploads from before the catalog existed and close interrupted ingestions."""
+    try:
+        import document_catalog
+
+        result = document_catalog.sync_catalog()
+        if result["backfilled"] or result["interrupted"]:
+            print(f"Document catalog: {result['backfilled']} backfilled, {result['interrupted']} interrupted")
+    except Exception as e:
+        print(f"Warning: could not sync document catalog: {e}")
+
+
+@app.on_event("startup")
+async def start_grading_workers():
+    """Start background grading workers and resume unfinished jobs."""
+    import jobs
+
+    jobs.start_workers()
+
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    """Stop background workers and release the pooled LLM HTTP connections."""
+    import ingestion
+    import jobs
+    import llm_client
+
+    await jobs.stop_workers()
+    ingestion.shutdown()
+    await llm_client.aclose()
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -77,6 +110,36 @@ def read_root():
 def health_check():
     return {"status": "healthy"}
 
+@app.get("/api/cache/stats")
+def cache_stats():
+    """LLM response and semantic cache hit/miss counters."""
+    import llm_cache
+    import semantic_cache
+
+    return {
+        "status": "success",
+        "llm_cache": llm_cache.get_cache().stats(),
+        "semantic_cache": semantic_cache.stats(),
+    }
+
+@app.get("/api/embeddings/stats")
+def embedding_stats():
+    """Embedding model encode counters and throughput, plus re-ranker counters."""
+    from embeddings import get_embedder
+    from reranker import get_reranker
+
+    embedder = get_embedder()
+    reranker = get_reranker()
+    return {
+        "status": "success",
+        "embeddings": embedder.stats() if embedder else None,
+        "reranker": reranker.stats() if reranker else None,
+    }
+
 if __name__ == "__main__":
+    # Prefer `uvicorn main:app`: spawned pool workers re-import the launching
+    # script, so started this way each one loads the whole app again
+    print("Warning: run the server with `uvicorn main:app --host 0.0.0.0 --port 8000`; "
+          "under `python main.py` every extraction worker re-imports the app")
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
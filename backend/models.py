@@ -1,6 +1,6 @@
 """Database models for user authentication and student analytics."""
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, create_engine
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, LargeBinary, Index, create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 import os
@@ -67,6 +67,91 @@ class Evaluation(Base):
     student = relationship("Student", back_populates="evaluations")
 
 
+class GradingJob(Base):
+    """Background bulk-grading job; items are graded by the in-process worker pool."""
+    __tablename__ = "grading_jobs"
+
+    id = Column(String, primary_key=True, index=True)  # uuid hex
+    status = Column(String, default="queued", index=True)  # queued, running, completed
+    total_items = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    completed_at = Column(DateTime, nullable=True)
+
+    # Relationships
+    items = relationship(
+        "GradingJobItem",
+        back_populates="job",
+        cascade="all, delete-orphan",
+        order_by="GradingJobItem.position",
+    )
+
+
+class GradingJobItem(Base):
+    """One answer inside a grading job, with its result once graded."""
+    __tablename__ = "grading_job_items"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(String, ForeignKey("grading_jobs.id"), nullable=False, index=True)
+    position = Column(Integer)  # index in the submitted batch
+    payload = Column(String)  # JSON of the submitted item
+    status = Column(String, default="pending", index=True)  # pending, success, error
+    evaluation = Column(String, nullable=True)
+    error = Column(String, nullable=True)
+    latency_ms = Column(Float, nullable=True)
+    completed_at = Column(DateTime, nullable=True)
+
+    # Relationships
+    job = relationship("GradingJob", back_populates="items")
+
+
+class ExtractedText(Base):
+    """Text extracted from an upload, stored once per unique file content."""
+    __tablename__ = "extracted_texts"
+
+    content_hash = Column(String, primary_key=True, index=True)  # sha256 of the raw file
+    text_z = Column(LargeBinary)  # zlib-compressed UTF-8 text
+    page_offsets = Column(String)  # JSON list of page start offsets into the text
+    char_count = Column(Integer, default=0)
+    page_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class DocumentFile(Base):
+    """Last known content hash of a stored upload, used to detect file changes."""
+    __tablename__ = "document_files"
+
+    id = Column(Integer, primary_key=True, index=True)
+    filename = Column(String, unique=True, index=True)
+    content_hash = Column(String, index=True)
+    size = Column(Integer)
+    mtime_ns = Column(Integer)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class Document(Base):
+    """Catalog entry for an upload, listed without touching the upload directory."""
+    __tablename__ = "documents"
+    __table_args__ = (
+        # "My ready documents", the most common filtered listing
+        Index("ix_documents_owner_status", "owner_id", "status"),
+        # Filename-prefix search within one owner's documents, in filename order
+        Index("ix_documents_owner_filename", "owner_id", "filename"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    filename = Column(String, unique=True, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
+    subject = Column(String, nullable=True, index=True)
+    content_hash = Column(String, nullable=True, index=True)
+    size = Column(Integer, default=0)
+    file_type = Column(String, index=True)  # extension, e.g. "pdf"
+    page_count = Column(Integer, nullable=True)
+    status = Column(String, default="queued", index=True)  # queued, extracting, embedding, ready, failed
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
 # Create all tables
 Base.metadata.create_all(bind=engine)
 
@@ -0,0 +1,285 @@
+"""In-process exact vector index used when Chroma is not installed.
+
+Vectors live in an append-only float32 file read through ``np.memmap``;
+ids, documents and metadata live in an append-only JSON-lines sidecar
+(``add`` / ``update`` / ``delete`` records replayed on load). A query is one
+matrix-vector product over the live rows, which is exact and fast for the
+few thousand chunks a school's uploads produce. Once enough rows are dead
+the files are rewritten without them (compaction).
+
+``NumpyCollection`` implements the subset of the Chroma collection API the
+app uses (``add``, ``upsert``, ``update``, ``get``, ``query``, ``delete``,
+``count``) with Chroma-style ``where`` filters and cosine distances, so it
+can stand in for a Chroma collection unchanged.
+"""
+import json
+import os
+import threading
+from typing import Optional
+
+import numpy as np
+
+# Compact once this share of rows (and at least this many) are deleted
+_COMPACT_RATIO = 0.3
+_COMPACT_MIN_DEAD = 256
+
+
+def _matches(meta: dict, where: Optional[dict]) -> bool:
+    """Evaluate a Chroma-style ``where`` clause against one metadata dict."""
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(_matches(meta, clause) for clause in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(_matches(meta, clause) for clause in condition):
+                return False
+            continue
+        value = meta.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, operand in condition.items():
+            if op == "$eq":
+                ok = value == operand
+            elif op == "$ne":
+                ok = value != operand
+            elif op == "$in":
+                ok = value in operand
+            elif op == "$nin":
+                ok = value not in operand
+            elif value is None:
+                ok = False
+            elif op == "$gt":
+                ok = value > operand
+            elif op == "$gte":
+                ok = value >= operand
+            elif op == "$lt":
+                ok = value < operand
+            elif op == "$lte":
+                ok = value <= operand
+            else:
+                raise ValueError(f"Unsupported where operator: {op}")
+            if not ok:
+                return False
+    return True
+
+
+class NumpyCollection:
+    """Memory-mapped float32 matrix plus metadata sidecar, with exact cosine search."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        self._log_path = os.path.join(path, "records.jsonl")
+        self._lock = threading.Lock()
+        self._dim: Optional[int] = None
+        self._ids: list[Optional[str]] = []  # per row; None once deleted
+        self._documents: list[Optional[str]] = []
+        self._metadatas: list[dict] = []
+        self._rows: dict[str, int] = {}
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    # -- persistence -----------------------------------------------------
+
+    def _load(self):
+        if os.path.exists(self._log_path):
+            with open(self._log_path, "r", encoding="utf-8") as log:
+                for line in log:
+                    if not line.strip():
+                        continue
+                    try:
+                        self._apply(json.loads(line))
+                    except json.JSONDecodeError:
+                        # A torn final line from an interrupted write
+                        break
+        # Drop vector rows written without a matching record
+        expected = len(self._ids) * (self._dim or 0) * 4
+        if os.path.exists(self._vectors_path) and os.path.getsize(self._vectors_path) > expected:
+            with open(self._vectors_path, "r+b") as vectors:
+                vectors.truncate(expected)
+        self._remap()
+
+    def _apply(self, record: dict):
+        op = record["op"]
+        if op == "add":
+            self._dim = record["dim"]
+            self._rows[record["id"]] = len(self._ids)
+            self._ids.append(record["id"])
+            self._documents.append(record.get("document"))
+            self._metadatas.append(record.get("metadata") or {})
+        elif op == "update":
+            row = self._rows.get(record["id"])
+            if row is not None:
+                self._metadatas[row] = record["metadata"]
+        elif op == "delete":
+            row = self._rows.pop(record["id"], None)
+            if row is not None:
+                self._ids[row] = None
+                self._documents[row] = None
+                self._metadatas[row] = {}
+
+    def _remap(self):
+        rows = len(self._ids)
+        if not rows or not self._dim:
+            self._matrix = np.zeros((0, self._dim or 0), dtype=np.float32)
+            return
+        self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(rows, self._dim))
+
+    def _append(self, records: list[dict], vectors: Optional[np.ndarray] = None):
+        if vectors is not None and len(vectors):
+            with open(self._vectors_path, "ab") as out:
+                out.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self._log_path, "a", encoding="utf-8") as log:
+            for record in records:
+                log.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self._apply(record)
+        if vectors is not None and len(vectors):
+            self._remap()
+
+    def _maybe_compact(self):
+        dead = len(self._ids) - len(self._rows)
+        if dead >= _COMPACT_MIN_DEAD and dead >= _COMPACT_RATIO * len(self._ids):
+            self._compact()
+
+    def _compact(self):
+        """Rewrite both files keeping only live rows."""
+        live = [row for row, chunk_id in enumerate(self._ids) if chunk_id is not None]
+        vectors = np.array(self._matrix[live], dtype=np.float32) if live else np.zeros((0, self._dim or 0))
+        records = [
+            {"op": "add", "id": self._ids[row], "dim": self._dim,
+             "document": self._documents[row], "metadata": self._metadatas[row]}
+            for row in live
+        ]
+        tmp_vectors, tmp_log = self._vectors_path + ".tmp", self._log_path + ".tmp"
+        with open(tmp_vectors, "wb") as out:
+            out.write(vectors.tobytes())
+        with open(tmp_log, "w", encoding="utf-8") as log:
+            for record in records:
+                log.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        self._matrix = np.zeros((0, 0), dtype=np.float32)  # release the old mapping
+        os.replace(tmp_vectors, self._vectors_path)
+        os.replace(tmp_log, self._log_path)
+        self._ids, self._documents, self._metadatas, self._rows = [], [], [], {}
+        for record in records:
+            self._apply(record)
+        self._remap()
+
+    # -- Chroma-compatible API -------------------------------------------
+
+    def count(self) -> int:
+        return len(self._rows)
+
+    def add(self, ids: list[str], embeddings, documents: Optional[list[str]] = None,
+            metadatas: Optional[list[dict]] = None):
+        with self._lock:
+            self._add(ids, embeddings, documents, metadatas)
+
+    def _add(self, ids, embeddings, documents, metadatas):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim != 2 or len(vectors) != len(ids):
+            raise ValueError("embeddings must be one vector per id")
+        if self._dim is not None and self._rows and vectors.shape[1] != self._dim:
+            raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match index ({self._dim})")
+        duplicates = [i for i in ids if i in self._rows]
+        if duplicates:
+            raise ValueError(f"IDs already exist: {duplicates[:3]}")
+        records = [
+            {"op": "add", "id": chunk_id, "dim": int(vectors.shape[1]),
+             "document": documents[i] if documents else None,
+             "metadata": metadatas[i] if metadatas else {}}
+            for i, chunk_id in enumerate(ids)
+        ]
+        self._append(records, vectors)
+
+    def upsert(self, ids: list[str], embeddings, documents: Optional[list[str]] = None,
+               metadatas: Optional[list[dict]] = None):
+        with self._lock:
+            existing = [i for i in ids if i in self._rows]
+            if existing:
+                self._append([{"op": "delete", "id": i} for i in existing])
+            self._add(ids, embeddings, documents, metadatas)
+            self._maybe_compact()
+
+    def update(self, ids: list[str], metadatas: list[dict]):
+        with self._lock:
+            self._append([
+                {"op": "update", "id": chunk_id, "metadata": meta}
+                for chunk_id, meta in zip(ids, metadatas) if chunk_id in self._rows
+            ])
+
+    def _select(self, ids: Optional[list[str]], where: Optional[dict]) -> list[int]:
+        if ids is not None:
+            rows = [self._rows[i] for i in ids if i in self._rows]
+        else:
+            rows = sorted(self._rows.values())
+        return [row for row in rows if _matches(self._metadatas[row], where)]
+
+    def delete(self, ids: Optional[list[str]] = None, where: Optional[dict] = None):
+        with self._lock:
+            rows = self._select(ids, where)
+            if rows:
+                self._append([{"op": "delete", "id": self._ids[row]} for row in rows])
+                self._maybe_compact()
+
+    def get(self, ids: Optional[list[str]] = None, where: Optional[dict] = None, limit: Optional[int] = None,
+            offset: Optional[int] = None, include: Optional[list[str]] = None) -> dict:
+        include = ["documents", "metadatas"] if include is None else include
+        with self._lock:
+            rows = self._select(ids, where)
+            rows = rows[offset or 0:]
+            if limit is not None:
+                rows = rows[:limit]
+            result = {"ids": [self._ids[row] for row in rows]}
+            if "documents" in include:
+                result["documents"] = [self._documents[row] for row in rows]
+            if "metadatas" in include:
+                result["metadatas"] = [dict(self._metadatas[row]) for row in rows]
+            if "embeddings" in include:
+                result["embeddings"] = np.array(self._matrix[rows]) if rows else np.zeros((0, self._dim or 0))
+            return result
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[dict] = None,
+              include: Optional[list[str]] = None) -> dict:
+        """Exact top-``n_results`` by cosine similarity for each query vector."""
+        include = ["documents", "metadatas", "distances"] if include is None else include
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+        with self._lock:
+            rows = np.array(self._select(None, where), dtype=np.int64)
+            result = {key: [] for key in ["ids"] + list(include)}
+            if len(rows):
+                vectors = self._matrix[rows]
+                norms = np.linalg.norm(vectors, axis=1)
+                norms[norms == 0] = 1.0
+                q_norms = np.linalg.norm(queries, axis=1, keepdims=True)
+                q_norms[q_norms == 0] = 1.0
+                # (rows, dim) @ (dim, queries) -> cosine similarity per row and query
+                similarity = (vectors @ (queries / q_norms).T) / norms[:, None]
+            k = min(n_results, len(rows))
+            for q in range(len(queries)):
+                if k:
+                    scores = similarity[:, q]
+                    top = np.argpartition(-scores, k - 1)[:k]
+                    top = top[np.argsort(-scores[top])]
+                    picked, picked_scores = rows[top], scores[top]
+                else:
+                    picked, picked_scores = [], []
+                result["ids"].append([self._ids[row] for row in picked])
+                if "documents" in include:
+                    result["documents"].append([self._documents[row] for row in picked])
+                if "metadatas" in include:
+                    result["metadatas"].append([dict(self._metadatas[row]) for row in picked])
+                if "distances" in include:
+                    result["distances"].append([float(1.0 - s) for s in picked_scores])
+            return result
+
+    def compact(self):
+        """Drop deleted rows from disk now."""
+        with self._lock:
+            self._compact()
@@ -0,0 +1,380 @@
+"""Local OCR for image uploads and photographed/handwritten answers.
+
+Images are cleaned up with Pillow first: EXIF orientation, grayscale,
+downscaling to ``OCR_MAX_SIDE`` (small photos are upscaled), background
+flattening (uneven lighting), contrast stretch, deskew by projection profile
+and Otsu binarization. Tesseract then recognizes the page on the CPU; pages
+taller than ``OCR_TILE_HEIGHT`` are cut into bands at blank rows and the
+bands run in parallel on one pool of ``OCR_WORKERS`` threads shared by all
+images.
+
+Every line comes back with tesseract's confidence. Only lines under
+``OCR_MIN_CONFIDENCE`` are cropped and sent to the vision LLM for
+transcription; if there are too many of them (typical for handwriting) the
+whole image is sent once instead. Without tesseract the LLM reads the whole
+image. Results are cached by image hash in the LLM response cache, so the
+same photo is never recognized twice.
+"""
+import base64
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+import llm_client
+import llm_cache
+from config import (
+    GROK_API_KEY,
+    OCR_LANG,
+    OCR_MAX_SIDE,
+    OCR_TILE_HEIGHT,
+    OCR_WORKERS,
+    OCR_MIN_CONFIDENCE,
+    OCR_MAX_ESCALATIONS,
+    OCR_VISION_MODEL,
+)
+
+# Try to import pytesseract (also needs the tesseract binary on PATH)
+try:
+    import pytesseract
+    TESSERACT_AVAILABLE = True
+except Exception:
+    pytesseract = None
+    TESSERACT_AVAILABLE = False
+
+# Bump when pre-processing or recognition changes, so cached results are redone
+_OCR_VERSION = 2
+_CACHE_ENDPOINT = "ocr"
+
+_MIN_SIDE = 1000  # smaller photos are upscaled 2x; tesseract wants ~30px letters
+_MAX_SKEW = 5.0  # degrees searched either way when deskewing
+_SKEW_STEP = 0.5
+_SKEW_MIN_GAIN = 1.1  # a skew angle must beat the level page's score by this factor
+_INK_RANGE = (0.002, 0.25)  # plausible share of ink pixels; outside it the mask is not text
+_BACKGROUND_SCALE = 16  # background (lighting) is estimated at 1/16 resolution
+_REGION_PADDING = 12  # pixels around a low-confidence region sent to the LLM
+_LLM_MAX_SIDE = 1600  # images sent to the LLM are downscaled to this (px)
+_LLM_MAX_BASE64 = 4 * 1000 * 1000  # the API rejects base64 images over ~4MB
+_LLM_JPEG_QUALITIES = (85, 70, 50)
+
+_TRANSCRIBE_PROMPT = (
+    "Transcribe all text in this image exactly as written, including handwriting. "
+    "Keep the line breaks. Return only the text, with no commentary."
+)
+_TRANSCRIBE_SYSTEM = "You are an OCR expert. Extract text from images accurately."
+
+_TESSERACT_CHECKED = False
+_TILE_POOL = None
+_TILE_POOL_LOCK = threading.Lock()
+
+
+def _tesseract_ready() -> bool:
+    global TESSERACT_AVAILABLE, _TESSERACT_CHECKED
+    if TESSERACT_AVAILABLE and not _TESSERACT_CHECKED:
+        _TESSERACT_CHECKED = True
+        try:
+            pytesseract.get_tesseract_version()
+        except Exception as e:
+            print(f"tesseract binary unavailable, OCR falls back to the LLM: {str(e)}")
+            TESSERACT_AVAILABLE = False
+    return TESSERACT_AVAILABLE
+
+
+def _llm_ready() -> bool:
+    return bool(GROK_API_KEY and OCR_VISION_MODEL)
+
+
+def _get_tile_pool() -> ThreadPoolExecutor:
+    # Shared by every image being recognized, so concurrent images never run
+    # more than OCR_WORKERS tesseract processes in total
+    global _TILE_POOL
+    with _TILE_POOL_LOCK:
+        if _TILE_POOL is None:
+            _TILE_POOL = ThreadPoolExecutor(max_workers=max(1, OCR_WORKERS), thread_name_prefix="ocr-tile")
+        return _TILE_POOL
+
+
+def _reset_tile_pool():
+    # A forked child (ingestion's extraction workers) inherits the pool object
+    # but not its threads, so work submitted to it would never run
+    global _TILE_POOL, _TILE_POOL_LOCK
+    _TILE_POOL = None
+    _TILE_POOL_LOCK = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_tile_pool)
+
+
+# -- pre-processing ------------------------------------------------------
+
+def _otsu_threshold(gray: np.ndarray) -> int:
+    """Grey level that best separates ink from paper."""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    weight = np.cumsum(hist)
+    mean = np.cumsum(hist * levels)
+    total, total_mean = weight[-1], mean[-1]
+    background = total - weight
+    valid = (weight > 0) & (background > 0)
+    between = np.zeros(256)
+    between[valid] = (total_mean * weight[valid] - total * mean[valid]) ** 2 / (weight[valid] * background[valid])
+    return int(np.argmax(between))
+
+
+def _flatten_background(gray: Image.Image) -> Image.Image:
+    """Divide out uneven lighting so one global threshold fits the whole page.
+
+    The paper's brightness is estimated on a small copy where a max filter
+    removes the (darker) text, then blurred and scaled back up.
+    """
+    small = gray.resize((max(1, gray.width // _BACKGROUND_SCALE), max(1, gray.height // _BACKGROUND_SCALE)),
+                        Image.BOX)
+    small = small.filter(ImageFilter.MaxFilter(5)).filter(ImageFilter.GaussianBlur(2))
+    background = np.asarray(small.resize(gray.size, Image.BILINEAR), dtype=np.float32)
+    flat = np.asarray(gray, dtype=np.float32) * 255.0 / np.maximum(background, 1.0)
+    return Image.fromarray(np.clip(flat, 0, 255).astype(np.uint8))
+
+
+def _deskew_angle(ink: Image.Image) -> float:
+    """Rotation (degrees) that makes text lines horizontal.
+
+    ``ink`` is a mask with ink as 255. Text rows give the sharpest row-sum
+    profile when level, so the angle with the largest variance of row ink
+    counts wins. Searched on a box-filtered small copy, which keeps the ink
+    mass of thin strokes. Returns 0 unless the mask looks like text and the
+    best angle clearly beats leaving the page as it is.
+    """
+    small = ink.copy()
+    small.thumbnail((800, 800), Image.BOX)
+    pixels = np.asarray(small, dtype=np.float32)
+    if not _INK_RANGE[0] <= pixels.mean() / 255.0 <= _INK_RANGE[1]:
+        return 0.0
+    level_score = float(np.var(pixels.sum(axis=1)))
+    best_angle, best_score = 0.0, level_score
+    for angle in np.arange(-_MAX_SKEW, _MAX_SKEW + _SKEW_STEP / 2, _SKEW_STEP):
+        if angle == 0:
+            continue
+        rows = np.asarray(small.rotate(float(angle), expand=True, fillcolor=0), dtype=np.float32).sum(axis=1)
+        score = float(np.var(rows))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    if best_score < level_score * _SKEW_MIN_GAIN:
+        return 0.0
+    return best_angle
+
+
+def preprocess(image: Image.Image) -> tuple[Image.Image, Image.Image]:
+    """Return ``(gray, binary)`` page images ready for recognition.
+
+    ``gray`` (deskewed, contrast-stretched) is what low-confidence regions are
+    cropped from for the LLM; ``binary`` is what tesseract reads.
+    """
+    gray = ImageOps.exif_transpose(image).convert("L")
+    longest = max(gray.size)
+    if longest > OCR_MAX_SIDE:
+        gray.thumbnail((OCR_MAX_SIDE, OCR_MAX_SIDE), Image.LANCZOS)
+    elif longest < _MIN_SIDE:
+        gray = gray.resize((gray.width * 2, gray.height * 2), Image.LANCZOS)
+    gray = ImageOps.autocontrast(_flatten_background(gray), cutoff=1)
+
+    threshold = _otsu_threshold(np.asarray(gray))
+    angle = _deskew_angle(gray.point(lambda v: 255 if v < threshold else 0))
+    if abs(angle) >= _SKEW_STEP:
+        gray = gray.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+    binary = gray.point(lambda v: 255 if v >= threshold else 0)
+    return gray, binary
+
+
+def _tile_bounds(binary: Image.Image, tile_height: int) -> list[tuple[int, int]]:
+    """Horizontal bands of about ``tile_height`` rows, cut at the emptiest row near each edge."""
+    height = binary.height
+    if height <= tile_height * 1.25:
+        return [(0, height)]
+    ink = (np.asarray(binary) == 0).sum(axis=1)
+    bounds, top = [], 0
+    while height - top > tile_height * 1.25:
+        low, high = top + int(tile_height * 0.8), min(height - 1, top + int(tile_height * 1.2))
+        cut = low + int(np.argmin(ink[low:high]))
+        bounds.append((top, cut))
+        top = cut
+    bounds.append((top, height))
+    return bounds
+
+
+# -- recognition ---------------------------------------------------------
+
+def _recognize_tile(binary: Image.Image, top: int) -> list[dict]:
+    """Tesseract lines of one band as ``{"text", "confidence", "box", "block"}``."""
+    data = pytesseract.image_to_data(binary, lang=OCR_LANG, output_type=pytesseract.Output.DICT)
+    lines: dict[tuple, dict] = {}
+    for i, word in enumerate(data["text"]):
+        confidence = float(data["conf"][i])
+        if confidence < 0 or not word.strip():
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        left, word_top = data["left"][i], data["top"][i] + top
+        right, bottom = left + data["width"][i], word_top + data["height"][i]
+        line = lines.setdefault(key, {"words": [], "confs": [], "box": [left, word_top, right, bottom],
+                                      "block": (top, key[0])})
+        line["words"].append(word)
+        line["confs"].append(confidence)
+        box = line["box"]
+        line["box"] = [min(box[0], left), min(box[1], word_top), max(box[2], right), max(box[3], bottom)]
+    return [
+        {"text": " ".join(line["words"]), "confidence": sum(line["confs"]) / len(line["confs"]),
+         "words": len(line["words"]), "box": line["box"], "block": line["block"]}
+        for line in lines.values()
+    ]
+
+
+def _encode_for_llm(image: Image.Image) -> str:
+    """Base64 JPEG of ``image``, downscaled to ``_LLM_MAX_SIDE`` and under the API's size limit.
+
+    The full-resolution page stays with tesseract; a full-page PNG of a phone
+    photo alone is several megabytes of base64.
+    """
+    copy = image.convert("L")
+    while True:
+        copy.thumbnail((_LLM_MAX_SIDE, _LLM_MAX_SIDE), Image.LANCZOS)
+        for quality in _LLM_JPEG_QUALITIES:
+            buffer = io.BytesIO()
+            copy.save(buffer, format="JPEG", quality=quality, optimize=True)
+            encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
+            if len(encoded) <= _LLM_MAX_BASE64:
+                return encoded
+        if max(copy.size) <= 400:
+            raise Exception("Image is too large to send to the vision model")
+        copy = copy.resize((copy.width // 2, copy.height // 2), Image.LANCZOS)
+
+
+def _transcribe(image: Image.Image) -> str:
+    """Read an image (or a crop of one) with the vision LLM."""
+    return llm_client.complete_image(_TRANSCRIBE_PROMPT, _encode_for_llm(image), "image/jpeg",
+                                     system_context=_TRANSCRIBE_SYSTEM).strip()
+
+
+def _low_confidence_regions(lines: list[dict]) -> list[list[int]]:
+    """Runs of consecutive low-confidence lines (indices into ``lines``)."""
+    regions, run = [], []
+    for i, line in enumerate(lines):
+        if line["confidence"] < OCR_MIN_CONFIDENCE:
+            run.append(i)
+        elif run:
+            regions.append(run)
+            run = []
+    if run:
+        regions.append(run)
+    return regions
+
+
+def _join_lines(lines: list[dict]) -> str:
+    parts, previous = [], None
+    for line in lines:
+        if previous is not None:
+            parts.append("\n\n" if line["block"] != previous else "\n")
+        parts.append(line["text"])
+        previous = line["block"]
+    return "".join(parts)
+
+
+def _recognize(image: Image.Image) -> dict:
+    gray, binary = preprocess(image)
+
+    if not _tesseract_ready():
+        if not _llm_ready():
+            raise Exception("No OCR engine available: install tesseract and pytesseract, or set GROK_API_KEY")
+        return {"text": _transcribe(gray), "confidence": None, "engine": "llm", "escalated": 1, "degraded": False}
+
+    bounds = _tile_bounds(binary, OCR_TILE_HEIGHT)
+    tiles = list(_get_tile_pool().map(
+        lambda b: _recognize_tile(binary.crop((0, b[0], binary.width, b[1])), b[0]), bounds
+    ))
+    lines = [line for tile in tiles for line in tile]
+
+    words = sum(line["words"] for line in lines)
+    confidence = sum(line["confidence"] * line["words"] for line in lines) / words if words else 0.0
+    result = {"text": _join_lines(lines), "confidence": round(confidence / 100, 3), "engine": "tesseract",
+              "escalated": 0, "degraded": False}
+
+    regions = _low_confidence_regions(lines)
+    if not regions or not _llm_ready():
+        return result
+    low_words = sum(lines[i]["words"] for region in regions for i in region)
+    try:
+        if len(regions) > OCR_MAX_ESCALATIONS or low_words * 2 > words:
+            # Mostly unreadable to tesseract (e.g. handwriting): one call for the whole page
+            result.update(text=_transcribe(gray), engine="tesseract+llm", escalated=1)
+            return result
+        _escalate_regions(gray, lines, regions)
+    except Exception as e:
+        # Keep tesseract's reading rather than failing the upload, but not in the
+        # cache: the next attempt may reach the LLM
+        print(f"OCR escalation to the LLM failed: {str(e)}")
+        result["degraded"] = True
+        return result
+    kept = [line for line in lines if line["text"] is not None]
+    result.update(text=_join_lines(kept), engine="tesseract+llm", escalated=len(regions))
+    return result
+
+
+def _escalate_regions(gray: Image.Image, lines: list[dict], regions: list[list[int]]):
+    """Replace each low-confidence region's lines with the LLM's reading of its crop."""
+    crops = []
+    for region in regions:
+        boxes = [lines[i]["box"] for i in region]
+        crops.append(gray.crop((
+            max(0, min(b[0] for b in boxes) - _REGION_PADDING), max(0, min(b[1] for b in boxes) - _REGION_PADDING),
+            min(gray.width, max(b[2] for b in boxes) + _REGION_PADDING),
+            min(gray.height, max(b[3] for b in boxes) + _REGION_PADDING),
+        )))
+    with ThreadPoolExecutor(max_workers=len(crops)) as pool:
+        transcriptions = list(pool.map(_transcribe, crops))
+    for region, text in zip(regions, transcriptions):
+        lines[region[0]]["text"] = text
+        for i in region[1:]:
+            lines[i]["text"] = None
+
+
+def _cache_key(image_hash: str) -> str:
+    settings = f"{_OCR_VERSION}|{OCR_LANG}|{OCR_MAX_SIDE}|{OCR_MIN_CONFIDENCE}|{OCR_VISION_MODEL}"
+    return hashlib.sha256(f"ocr|{settings}|{image_hash}".encode("utf-8")).hexdigest()
+
+
+def recognize_image(file_path: str) -> dict:
+    """OCR an image file.
+
+    Returns ``{"text", "confidence", "engine", "escalated", "degraded",
+    "cached", "seconds"}``: ``confidence`` is tesseract's mean word confidence
+    (0-1, or None when only the LLM read the image), ``engine`` is
+    ``tesseract``, ``tesseract+llm`` or ``llm`` and ``escalated`` counts the
+    regions sent to the LLM. ``degraded`` means escalation failed and the
+    text is tesseract's low-confidence reading; such results are not cached.
+    Raises if the image cannot be read or no engine is available.
+    """
+    started = time.perf_counter()
+    with open(file_path, "rb") as f:
+        data = f.read()
+
+    use_cache = llm_cache.is_enabled(_CACHE_ENDPOINT)
+    key = _cache_key(hashlib.sha256(data).hexdigest())
+    if use_cache:
+        cached = llm_cache.get_cache().get(key, _CACHE_ENDPOINT)
+        if cached is not None:
+            result = json.loads(cached)
+            result.update(cached=True, seconds=round(time.perf_counter() - started, 3))
+            return result
+
+    with Image.open(io.BytesIO(data)) as image:
+        result = _recognize(image)
+    if use_cache and not result["degraded"]:
+        llm_cache.get_cache().put(key, json.dumps(result))
+    result.update(cached=False, seconds=round(time.perf_counter() - started, 3))
+    return result
+
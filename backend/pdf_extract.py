@@ -0,0 +1,316 @@
+"""Page-parallel PDF text extraction.
+
+``PyPDF2`` extracts pages one after another in pure Python, so a long PDF
+keeps one core busy for seconds. Here the page list is split into ranges of
+``PDF_PAGES_PER_TASK`` pages that run on a pool of ``PDF_EXTRACT_WORKERS``
+processes, and the page texts are joined once at the end (with the page
+start offsets used for citations). ``iter_pages`` streams the pages instead,
+with only a few ranges extracted ahead of the consumer.
+
+Each page gets ``PDF_PAGE_TIMEOUT`` seconds. In a worker that is enforced
+with an interval timer, so a malformed page comes back empty (and is listed
+in ``failed_pages``) instead of hanging ingestion. Where timers are not
+available (Windows) the parent stops waiting for the whole range instead
+and replaces the pool, since a stuck worker cannot be interrupted. That
+deadline runs from when a worker picks the range up (workers record it in a
+shared dict), since the pool is shared and a range may wait behind other
+documents' ranges first.
+
+Run ``python pdf_extract.py file.pdf`` to compare pages/sec against the
+previous serial extraction.
+"""
+import itertools
+import multiprocessing
+import signal
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from itertools import islice
+from typing import Iterator, Optional
+
+from config import PDF_EXTRACT_WORKERS, PDF_PAGES_PER_TASK, PDF_PAGE_TIMEOUT
+
+# Extra seconds the parent allows a range beyond its pages' timeouts
+_RANGE_GRACE = 5.0
+# Seconds between checks on a range no worker has picked up yet
+_QUEUED_POLL = 0.5
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+_MANAGER = None
+_STARTED = None  # task id -> time a worker began it (a manager dict)
+_TASK_IDS = itertools.count()
+
+# Set in each worker by _init_worker
+_WORKER_STARTED = None
+
+
+class PageTimeout(Exception):
+    pass
+
+
+@contextmanager
+def _page_deadline(seconds: float):
+    """Interrupt the block after ``seconds`` where interval timers are available.
+
+    Yields a one-item list set to True if the deadline passed, since PyPDF2
+    catches and logs some exceptions itself.
+    """
+    expired = [False]
+    if (seconds <= 0 or not hasattr(signal, "setitimer")
+            or threading.current_thread() is not threading.main_thread()):
+        yield expired
+        return
+
+    def on_timeout(signum, frame):
+        expired[0] = True
+        raise PageTimeout("page extraction timed out")
+
+    previous = signal.signal(signal.SIGALRM, on_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield expired
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _extract_range(file_path: str, start: int, stop: int, page_timeout: float) -> list[tuple[str, Optional[str]]]:
+    """Extract pages ``start``..``stop - 1`` as ``(text, error)`` pairs (runs in a worker)."""
+    from PyPDF2 import PdfReader
+
+    reader = PdfReader(file_path)
+    results = []
+    for number in range(start, stop):
+        error = None
+        try:
+            with _page_deadline(page_timeout) as expired:
+                text = reader.pages[number].extract_text() or ""
+            if expired[0]:
+                error = "page extraction timed out"
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        if error is None:
+            results.append((text, None))
+        else:
+            results.append(("", error))
+            # An interrupted read can leave the reader mid-object
+            reader = PdfReader(file_path)
+    return results
+
+
+def _init_worker(started):
+    global _WORKER_STARTED
+    _WORKER_STARTED = started
+
+
+def _extract_task(task_id: int, file_path: str, start: int, stop: int,
+                  page_timeout: float) -> list[tuple[str, Optional[str]]]:
+    """``_extract_range`` in a pool worker, recording when it started."""
+    if _WORKER_STARTED is not None:
+        _WORKER_STARTED[task_id] = time.time()
+    return _extract_range(file_path, start, stop, page_timeout)
+
+
+def _in_worker() -> bool:
+    # Worker processes (ours or the ingestion pool's) extract in-process
+    # rather than starting a nested pool
+    return multiprocessing.parent_process() is not None
+
+
+def _get_pool(workers: int):
+    global _POOL, _MANAGER, _STARTED
+    with _POOL_LOCK:
+        if _POOL is None:
+            # spawn: forking a server with live threads can deadlock the child
+            context = multiprocessing.get_context("spawn")
+            if _MANAGER is None:
+                _MANAGER = context.Manager()
+                _STARTED = _MANAGER.dict()
+            _POOL = context.Pool(processes=workers, initializer=_init_worker, initargs=(_STARTED,))
+        return _POOL
+
+
+def _retire_pool(pool, grace: float):
+    """Stop handing work to ``pool`` and kill it once other callers' ranges are done."""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is pool:
+            _POOL = None
+    pool.close()
+    timer = threading.Timer(grace, pool.terminate)
+    timer.daemon = True
+    timer.start()
+
+
+def _submit(file_path: str, start: int, stop: int, page_timeout: float, workers: int) -> list:
+    pool = _get_pool(workers)
+    task_id = next(_TASK_IDS)
+    job = pool.apply_async(_extract_task, (task_id, file_path, start, stop, page_timeout))
+    return [start, stop, task_id, job, pool]
+
+
+def _collect(task: list, file_path: str, page_timeout: float, workers: int):
+    """Wait for a submitted range; returns ``(results, stuck_pool)``.
+
+    The range's deadline starts when a worker picks it up; ``stuck_pool`` is
+    the pool it timed out on, or None. A range still queued on a pool another
+    caller has retired is submitted again.
+    """
+    start, stop = task[0], task[1]
+    limit = page_timeout * (stop - start) + _RANGE_GRACE
+    while True:
+        task_id, job, pool = task[2], task[3], task[4]
+        began = _STARTED.get(task_id)
+        if began is None:
+            wait = _QUEUED_POLL
+        else:
+            wait = began + limit - time.time()
+            if wait <= 0:
+                _STARTED.pop(task_id, None)
+                return [("", "page extraction timed out")] * (stop - start), pool
+        try:
+            results = job.get(timeout=wait)
+            _STARTED.pop(task_id, None)
+            return results, None
+        except multiprocessing.TimeoutError:
+            if began is None and pool is not _POOL and not job.ready():
+                task[:] = _submit(file_path, start, stop, page_timeout, workers)
+
+
+def _iter_parallel(file_path: str, ranges: list[tuple[int, int]], page_timeout: float,
+                   workers: int) -> Iterator[list[tuple[str, Optional[str]]]]:
+    queued = iter(ranges)
+    tasks: deque = deque()
+
+    def submit():
+        for start, stop in islice(queued, 1):
+            tasks.append(_submit(file_path, start, stop, page_timeout, workers))
+
+    # Keep a couple of ranges per worker in flight, not the whole document
+    for _ in range(workers * 2):
+        submit()
+    while tasks:
+        result, stuck_pool = _collect(tasks.popleft(), file_path, page_timeout, workers)
+        if stuck_pool is not None:
+            # Ranges still queued on it move to a fresh pool (see _collect)
+            _retire_pool(stuck_pool, page_timeout * PDF_PAGES_PER_TASK + _RANGE_GRACE)
+        submit()
+        yield result
+
+
+def iter_pages(file_path: str, workers: Optional[int] = None, page_timeout: float = PDF_PAGE_TIMEOUT,
+               pages_per_task: int = PDF_PAGES_PER_TASK) -> Iterator[tuple[str, Optional[str]]]:
+    """Yield ``(text, error)`` for each page in order, as ranges finish.
+
+    Only a few ranges per worker are extracted ahead of the consumer. A page
+    that fails or times out yields ``("", error)``.
+    """
+    from PyPDF2 import PdfReader
+
+    try:
+        page_count = len(PdfReader(file_path).pages)
+    except Exception as e:
+        raise Exception(f"Error extracting PDF: {str(e)}")
+
+    workers = PDF_EXTRACT_WORKERS if workers is None else workers
+    if workers > 0 and not _in_worker() and page_count > 1:
+        # Spread small documents over every worker too
+        per_task = max(1, min(pages_per_task, -(-page_count // workers)))
+        ranges = [(start, min(start + per_task, page_count)) for start in range(0, page_count, per_task)]
+        for result in _iter_parallel(file_path, ranges, page_timeout, workers):
+            yield from result
+    else:
+        for start in range(0, page_count, pages_per_task):
+            yield from _extract_range(file_path, start, min(start + pages_per_task, page_count), page_timeout)
+
+
+def extract_pdf(file_path: str, workers: Optional[int] = None, page_timeout: float = PDF_PAGE_TIMEOUT,
+                pages_per_task: int = PDF_PAGES_PER_TASK) -> dict:
+    """Extract a PDF's text page by page, in parallel where possible.
+
+    Returns ``{"pages", "text", "page_offsets", "failed_pages", "seconds"}``;
+    ``text`` is the pages joined with newlines and ``page_offsets`` the start
+    of each page in it. Pages that fail or time out are empty strings and
+    their (0-based) numbers are listed in ``failed_pages``.
+    """
+    started = time.perf_counter()
+    pages, failed, offsets, position = [], [], [], 0
+    for number, (text, error) in enumerate(iter_pages(file_path, workers, page_timeout, pages_per_task)):
+        if error is not None:
+            failed.append(number)
+        pages.append(text)
+        offsets.append(position)
+        position += len(text) + 1
+
+    return {
+        "pages": pages,
+        "text": "\n".join(pages),
+        "page_offsets": offsets,
+        "failed_pages": failed,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def _legacy_extract(file_path: str) -> str:
+    """The previous serial extractor, kept as the benchmark baseline."""
+    from PyPDF2 import PdfReader
+
+    text = ""
+    with open(file_path, 'rb') as file:
+        pdf_reader = PdfReader(file)
+        for page in pdf_reader.pages:
+            text += page.extract_text() + "\n"
+    return text
+
+
+def benchmark(file_path: str, workers: Optional[int] = None, repeat: int = 3) -> dict:
+    """Pages/sec of the serial and page-parallel extractors on one PDF (best of ``repeat``)."""
+    extract_pdf(file_path, workers=workers)  # start the pool outside the timing
+
+    serial = parallel = float("inf")
+    for _ in range(max(1, repeat)):
+        started = time.perf_counter()
+        legacy_text = _legacy_extract(file_path)
+        serial = min(serial, time.perf_counter() - started)
+
+        started = time.perf_counter()
+        result = extract_pdf(file_path, workers=workers)
+        parallel = min(parallel, time.perf_counter() - started)
+
+    pages = len(result["pages"])
+    return {
+        "pages": pages,
+        "workers": PDF_EXTRACT_WORKERS if workers is None else workers,
+        "serial_pages_per_sec": round(pages / serial, 1) if serial else None,
+        "parallel_pages_per_sec": round(pages / parallel, 1) if parallel else None,
+        "speedup": round(serial / parallel, 2) if parallel else None,
+        "same_text": legacy_text == result["text"] + "\n",
+        "failed_pages": result["failed_pages"],
+    }
+
+
+def shutdown():
+    """Stop the extraction worker pool (call on app shutdown)."""
+    global _POOL, _MANAGER, _STARTED
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.terminate()
+            _POOL = None
+        if _MANAGER is not None:
+            _MANAGER.shutdown()
+            _MANAGER = _STARTED = None
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Benchmark PDF extraction")
+    parser.add_argument("pdf")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    print(json.dumps(benchmark(args.pdf, args.workers, args.repeat), indent=2))
+    shutdown()
@@ -0,0 +1,139 @@
+"""Token-budgeted prompt assembly shared by the routes.
+
+Instead of slicing content to a fixed number of characters, prompts are
+built against a token budget: the model's context window minus room for the
+answer, capped at ``PROMPT_TOKEN_BUDGET``. The fixed parts of a prompt
+(template, system context, the user's question) are counted first, and
+whatever is left goes to the variable part: a document's text, or retrieved
+excerpts packed best-ranked first. Small documents go in whole; large ones
+are cut at a sentence or paragraph boundary instead of mid-word.
+
+Tokens are counted with ``tiktoken`` when it is installed, and otherwise
+estimated from words and punctuation, which slightly overcounts.
+"""
+import re
+from typing import Callable, Optional
+
+from chunking import estimate_tokens
+from config import GROK_MODEL, PROMPT_TOKEN_BUDGET, PROMPT_RESERVED_OUTPUT_TOKENS
+
+# Try to import tiktoken for exact token counts
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except Exception:
+    tiktoken = None
+    TIKTOKEN_AVAILABLE = False
+
+# Context window (tokens) per model; unknown models get the smallest
+MODEL_CONTEXT_TOKENS = {
+    "llama-3.1-8b-instant": 131072,
+    "llama-3.3-70b-versatile": 131072,
+    "mixtral-8x7b-32768": 32768,
+    "gemma2-9b-it": 8192,
+}
+_DEFAULT_CONTEXT_TOKENS = 8192
+
+# Below this many free tokens a partial excerpt is not worth including
+_MIN_PARTIAL_TOKENS = 64
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_BOUNDARY_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+
+_ENCODING = None
+
+
+def _get_encoding():
+    global _ENCODING, TIKTOKEN_AVAILABLE
+    if _ENCODING is None and TIKTOKEN_AVAILABLE:
+        try:
+            _ENCODING = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            # The BPE file is fetched on first use; stay on the estimate if offline
+            print(f"tiktoken unavailable, estimating tokens: {str(e)}")
+            TIKTOKEN_AVAILABLE = False
+    return _ENCODING
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """Number of tokens in ``text``."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+
+def prompt_budget(model: str = GROK_MODEL, reserve_output: int = PROMPT_RESERVED_OUTPUT_TOKENS) -> int:
+    """Input tokens available for one prompt to ``model``."""
+    context = MODEL_CONTEXT_TOKENS.get(model, _DEFAULT_CONTEXT_TOKENS)
+    return max(0, min(PROMPT_TOKEN_BUDGET, context - reserve_output))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut ``text`` to at most ``max_tokens``, at a sentence/line break when one is near the end."""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    encoding = _get_encoding()
+    if encoding is not None:
+        cut = encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    else:
+        tokens = list(_TOKEN_RE.finditer(text))
+        cut = text[:tokens[max_tokens - 1].end()] if max_tokens <= len(tokens) else text
+
+    # Prefer ending on a boundary within the last fifth of the cut
+    boundaries = [m.start() for m in _BOUNDARY_RE.finditer(cut)]
+    if boundaries and boundaries[-1] >= len(cut) * 0.8:
+        cut = cut[:boundaries[-1]]
+    return cut.rstrip()
+
+
+def fit_prompt(template: str, fill: str, text: str, system_context: Optional[str] = None,
+               budget: Optional[int] = None, **fields) -> str:
+    """Format ``template`` with ``text`` in field ``fill``, cut to what the budget leaves.
+
+    Everything else (the template, ``fields`` and ``system_context``) is
+    always kept in full.
+    """
+    budget = prompt_budget() if budget is None else budget
+    fixed = template.format(**fields, **{fill: ""})
+    available = budget - count_tokens(fixed) - count_tokens(system_context)
+    return template.format(**fields, **{fill: truncate_to_tokens(text, available)})
+
+
+def _format_hit(hit: dict) -> str:
+    return f"Source: {hit['filename']}\n{hit['text']}"
+
+
+def pack_excerpts(hits: list[dict], max_tokens: int, render: Callable[[dict], str] = _format_hit) -> str:
+    """Join rendered ``hits`` in rank order until ``max_tokens`` is used.
+
+    A hit that does not fit whole is cut to fill the remainder (if that is
+    worth it), and nothing after it is included.
+    """
+    parts = []
+    remaining = max_tokens
+    for hit in hits:
+        rendered = render(hit)
+        cost = count_tokens(rendered) + (2 if parts else 0)
+        if cost <= remaining:
+            parts.append(rendered)
+            remaining -= cost
+            continue
+        if remaining >= _MIN_PARTIAL_TOKENS:
+            parts.append(truncate_to_tokens(rendered, remaining - 2))
+        break
+    return "\n\n".join(parts)
+
+
+def fit_excerpts_prompt(template: str, hits: list[dict], fill: str = "excerpts", system_context: Optional[str] = None,
+                        budget: Optional[int] = None, render: Callable[[dict], str] = _format_hit, **fields) -> str:
+    """Format ``template`` with as many retrieved excerpts as fit, best first."""
+    budget = prompt_budget() if budget is None else budget
+    fixed = template.format(**fields, **{fill: ""})
+    available = budget - count_tokens(fixed) - count_tokens(system_context)
+    return template.format(**fields, **{fill: pack_excerpts(hits, available, render)})
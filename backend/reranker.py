@@ -0,0 +1,144 @@
+"""Cross-encoder re-ranking of retrieved chunks.
+
+``semantic_search(rerank=True)`` over-fetches ``RERANK_CANDIDATES`` chunks
+and asks a small local cross-encoder to score each (query, chunk) pair on
+CPU, in batches of ``RERANK_BATCH_SIZE``. Scores are cached per pair, so
+repeated questions cost nothing. Scoring stops once ``RERANK_BUDGET_MS`` is
+spent, and the raw vector ranking is used instead. The same happens while
+the model is still loading in the background.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from config import (
+    RERANK_MODEL_NAME,
+    RERANK_BATCH_SIZE,
+    RERANK_BUDGET_MS,
+    RERANK_CACHE_ENTRIES,
+)
+
+# Try to import sentence-transformers' cross-encoder
+try:
+    from sentence_transformers import CrossEncoder
+    RERANK_AVAILABLE = True
+except Exception:
+    CrossEncoder = None
+    RERANK_AVAILABLE = False
+
+
+def _pair_key(query: str, hit: dict) -> str:
+    chunk = hit.get("_meta", {}).get("chunk_hash") or hit["text"]
+    return hashlib.sha256(f"{query}\0{chunk}".encode("utf-8")).hexdigest()
+
+
+class Reranker:
+    """Lazily loaded cross-encoder with a score cache and a latency budget."""
+
+    def __init__(self, model_name: str = RERANK_MODEL_NAME, batch_size: int = RERANK_BATCH_SIZE,
+                 budget_ms: int = RERANK_BUDGET_MS, cache_entries: int = RERANK_CACHE_ENTRIES):
+        self.model_name = model_name
+        self.batch_size = max(1, batch_size)
+        self.budget_ms = budget_ms
+        self.cache_entries = cache_entries
+        self._model = None
+        self._loader: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._scores: OrderedDict[str, float] = OrderedDict()
+        self._stats = {"calls": 0, "reranked": 0, "fallbacks": 0, "cache_hits": 0, "pairs_scored": 0}
+
+    def _load(self):
+        try:
+            self._model = CrossEncoder(self.model_name, device="cpu")
+        except Exception as e:
+            print(f"Error loading re-ranking model: {str(e)}")
+
+    def ready(self) -> bool:
+        """True once the model is loaded; starts loading it in the background otherwise."""
+        if self._model is not None:
+            return True
+        with self._lock:
+            if self._loader is None:
+                self._loader = threading.Thread(target=self._load, daemon=True)
+                self._loader.start()
+        return False
+
+    def _cache_get(self, key: str) -> Optional[float]:
+        with self._lock:
+            score = self._scores.get(key)
+            if score is not None:
+                self._scores.move_to_end(key)
+            return score
+
+    def _cache_put(self, key: str, score: float):
+        with self._lock:
+            self._scores[key] = score
+            self._scores.move_to_end(key)
+            while len(self._scores) > self.cache_entries:
+                self._scores.popitem(last=False)
+
+    def rerank(self, query: str, hits: list[dict], top_k: int) -> list[dict]:
+        """Return the ``top_k`` best ``hits`` by cross-encoder score.
+
+        ``hits`` must be in vector-ranking order; if scoring cannot finish
+        within the budget that order is kept (``hits[:top_k]``).
+        """
+        self._stats["calls"] += 1
+        if len(hits) <= 1:
+            return hits[:top_k]
+
+        keys = [_pair_key(query, hit) for hit in hits]
+        scores = [self._cache_get(key) for key in keys]
+        self._stats["cache_hits"] += sum(score is not None for score in scores)
+        pending = [i for i, score in enumerate(scores) if score is None]
+
+        if pending:
+            if not self.ready():
+                self._stats["fallbacks"] += 1
+                return hits[:top_k]
+            started = time.perf_counter()
+            for start in range(0, len(pending), self.batch_size):
+                if (time.perf_counter() - started) * 1000 > self.budget_ms:
+                    # Scores computed so far stay cached for the next request
+                    self._stats["fallbacks"] += 1
+                    return hits[:top_k]
+                batch = pending[start:start + self.batch_size]
+                batch_scores = self._model.predict(
+                    [(query, hits[i]["text"]) for i in batch], batch_size=self.batch_size, show_progress_bar=False
+                )
+                for i, score in zip(batch, batch_scores):
+                    scores[i] = float(score)
+                    self._cache_put(keys[i], scores[i])
+                self._stats["pairs_scored"] += len(batch)
+
+        self._stats["reranked"] += 1
+        order = sorted(range(len(hits)), key=lambda i: scores[i], reverse=True)[:top_k]
+        ranked = []
+        for i in order:
+            hits[i]["rerank_score"] = round(scores[i], 4)
+            ranked.append(hits[i])
+        return ranked
+
+    def stats(self) -> dict:
+        return {
+            "model": self.model_name,
+            "loaded": self._model is not None,
+            "budget_ms": self.budget_ms,
+            "cached_pairs": len(self._scores),
+            **self._stats,
+        }
+
+
+_RERANKER: Optional[Reranker] = None
+
+
+def get_reranker() -> Optional[Reranker]:
+    """Return the process-wide re-ranker, or None if cross-encoders are unavailable."""
+    global _RERANKER
+    if not RERANK_AVAILABLE:
+        return None
+    if _RERANKER is None:
+        _RERANKER = Reranker()
+    return _RERANKER
@@ -1,9 +1,12 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List
+import asyncio
 import json
-from utils import chat_with_llm
-from utils import chat_with_llm, semantic_search
+from utils import achat_with_llm, astream_chat_with_llm, semantic_search, sse_token_stream
+import semantic_cache
+from prompt_builder import fit_excerpts_prompt
 import requests
 
 router = APIRouter()
@@ -12,6 +15,8 @@ class ChatMessage(BaseModel):
     message: str
     context: Optional[str] = None
     enable_search: bool = False
+    mode: str = "dense"  # document retrieval mode: dense, hybrid or keyword
+    rerank: Optional[bool] = None  # cross-encoder re-ranking (default from RERANK_ENABLED)
 
 class TeachingAdviceRequest(BaseModel):
     topic: str
@@ -38,31 +43,30 @@ class DifferentiationRequest(BaseModel):
 class ChatHistory(BaseModel):
     messages: List[dict]
 
-@router.post("/send")
-async def send_message(request: ChatMessage):
-    """Send a message to the LLM"""
-    try:
-        search_results = ""
-        
-        # If search is enabled, perform web search
-        if request.enable_search:
-            # First try semantic search against local vector DB
-            search_hits = semantic_search(request.message, top_k=3)
-            if search_hits:
-                combined = '\n\n'.join([f"Source: {h['filename']}\n{h['text'][:1000]}" for h in search_hits])
-                prompt = f"""Answer the user's question using your knowledge and the following document excerpts (from uploaded documents):
+async def _build_send_prompt(request: ChatMessage) -> tuple[str, Optional[str]]:
+    """Build the /send prompt.
+
+    Returns ``(prompt, semantic_text)``; ``semantic_text`` is set only for
+    context-free answers, which are reusable across teachers.
+    """
+    # If search is enabled, perform web search
+    if request.enable_search:
+        # First try semantic search against local vector DB
+        search_hits = await asyncio.to_thread(semantic_search, request.message, 3, mode=request.mode, rerank=request.rerank)
+        if search_hits:
+            prompt = fit_excerpts_prompt("""Answer the user's question using your knowledge and the following document excerpts (from uploaded documents):
 
 Document Excerpts:
-{combined}
+{excerpts}
 
-User Question: {request.message}
+User Question: {message}
 
-Provide a comprehensive answer combining both your knowledge and the document excerpts. Cite sources when relevant."""
-            else:
-                # fallback to web search placeholder
-                search_results = await search_google(request.message)
-                if search_results:
-                    prompt = f"""Answer the user's question using your knowledge and the following search results:
+Provide a comprehensive answer combining both your knowledge and the document excerpts. Cite sources when relevant.""", search_hits, message=request.message)
+        else:
+            # fallback to web search placeholder
+            search_results = await search_google(request.message)
+            if search_results:
+                prompt = f"""Answer the user's question using your knowledge and the following search results:
 
 Search Results:
 {search_results}
@@ -70,15 +74,37 @@ Search Results:
 User Question: {request.message}
 
 Provide a comprehensive answer combining both your knowledge and the search results. Cite sources when relevant."""
-                else:
-                    prompt = request.message
-        else:
-            if request.context:
-                prompt = f"{request.context}\n\nUser: {request.message}"
             else:
                 prompt = request.message
+        return prompt, None
+
+    if request.context:
+        # The embedder truncates long input, so a shared context would push the
+        # question out of the similarity key; only exact (llm_cache) hits apply
+        return f"{request.context}\n\nUser: {request.message}", None
+    return request.message, request.message
+
+@router.post("/send")
+async def send_message(request: ChatMessage):
+    """Send a message to the LLM"""
+    try:
+        prompt, semantic_text = await _build_send_prompt(request)
+        
+        if semantic_text:
+            hit = await semantic_cache.lookup("chat.send", semantic_text)
+            if hit:
+                return {
+                    "status": "success",
+                    "message": request.message,
+                    "response": hit["response"],
+                    "search_enabled": request.enable_search,
+                    "cache": "semantic",
+                    "similarity": hit["similarity"]
+                }
         
-        response = chat_with_llm(prompt)
+        response = await achat_with_llm(prompt, cache_endpoint="chat.send")
+        if semantic_text:
+            await semantic_cache.store("chat.send", semantic_text, response)
         
         return {
             "status": "success",
@@ -89,6 +115,31 @@ Provide a comprehensive answer combining both your knowledge and the search resu
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/send/stream")
+async def send_message_stream(request: ChatMessage):
+    """Send a message to the LLM, streaming the reply as server-sent events"""
+    try:
+        prompt, semantic_text = await _build_send_prompt(request)
+        hit = await semantic_cache.lookup("chat.send", semantic_text) if semantic_text else None
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    done = {"status": "success", "message": request.message, "search_enabled": request.enable_search}
+    
+    async def tokens():
+        if hit:
+            done.update({"cache": "semantic", "similarity": hit["similarity"]})
+            yield hit["response"]
+            return
+        parts = []
+        async for text in astream_chat_with_llm(prompt, cache_endpoint="chat.send"):
+            parts.append(text)
+            yield text
+        if semantic_text:
+            await semantic_cache.store("chat.send", semantic_text, "".join(parts))
+    
+    return StreamingResponse(sse_token_stream(tokens(), done), media_type="text/event-stream")
+
 async def search_google(query: str) -> str:
     """Perform a web search"""
     try:
@@ -114,6 +165,16 @@ async def debug_echo(request: ChatMessage):
 async def get_teaching_advice(request: TeachingAdviceRequest):
     """Get teaching advice for a specific challenge"""
     try:
+        semantic_text = f"{request.class_level} teacher. Topic: {request.topic}. Challenge: {request.challenge}"
+        hit = await semantic_cache.lookup("chat.teaching-advice", semantic_text)
+        if hit:
+            return {
+                "status": "success",
+                "response": hit["response"],
+                "cache": "semantic",
+                "similarity": hit["similarity"]
+            }
+        
         prompt = f"""I'm a {request.class_level} teacher and need advice:
 
 Topic: {request.topic}
@@ -129,7 +190,8 @@ Please provide:
 7. How to adapt for different learning styles
 8. Prevention strategies for future"""
         
-        advice = chat_with_llm(prompt)
+        advice = await achat_with_llm(prompt, cache_endpoint="chat.teaching-advice")
+        await semantic_cache.store("chat.teaching-advice", semantic_text, advice)
         
         return {
             "status": "success",
@@ -158,7 +220,7 @@ Provide:
 7. Cross-curricular connections
 8. Differentiation strategies"""
         
-        help_text = chat_with_llm(prompt)
+        help_text = await achat_with_llm(prompt, cache_endpoint="chat.curriculum-help")
         
         return {
             "status": "success",
@@ -186,7 +248,7 @@ Please provide:
 7. Building positive classroom culture
 8. Resources and support available"""
         
-        advice = chat_with_llm(prompt)
+        advice = await achat_with_llm(prompt, cache_endpoint="chat.classroom-management")
         
         return {
             "status": "success",
@@ -199,6 +261,15 @@ Please provide:
 async def get_assessment_help(request: AssessmentHelpRequest):
     """Get help with assessment and grading"""
     try:
+        hit = await semantic_cache.lookup("chat.assessment-help", request.question)
+        if hit:
+            return {
+                "status": "success",
+                "response": hit["response"],
+                "cache": "semantic",
+                "similarity": hit["similarity"]
+            }
+        
         prompt = f"""I need help with assessment:
 
 Question: {request.question}
@@ -213,7 +284,8 @@ Provide:
 7. Tools and resources
 8. Examples of strong vs weak responses"""
         
-        help_text = chat_with_llm(prompt)
+        help_text = await achat_with_llm(prompt, cache_endpoint="chat.assessment-help")
+        await semantic_cache.store("chat.assessment-help", request.question, help_text)
         
         return {
             "status": "success",
@@ -243,7 +315,7 @@ Provide differentiation strategies for:
 
 Include specific activities and materials."""
         
-        strategies = chat_with_llm(prompt)
+        strategies = await achat_with_llm(prompt, cache_endpoint="chat.differentiation-strategies")
         
         return {
             "status": "success",
@@ -1,71 +1,91 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import os
-import shutil
-from config import UPLOAD_DIR, ALLOWED_EXTENSIONS, MAX_FILE_SIZE
+import asyncio
+from config import ALLOWED_EXTENSIONS, MAX_FILE_SIZE, DOCUMENT_LIST_PAGE_SIZE
 from utils import (
-    extract_text_from_pdf,
-    extract_text_from_image,
-    extract_text_from_docx,
-    extract_text_from_doc,
-    embed_document,
     semantic_search,
-    chat_with_llm,
-    sanitize_text,
+    semantic_search_many,
+    achat_with_llm,
+    astream_chat_with_llm,
+    sse_token_stream,
 )
-from typing import Optional
+import text_store
+import document_catalog
+import ingestion as ingestion_pipeline
+from upload_stream import check_content_length
+from blob_store import store_upload
+from auth import decode_token
+from prompt_builder import fit_prompt, fit_excerpts_prompt
+from summarizer import EXPLAIN_MODES, build_explain_prompt
+from typing import Optional, List
 
 router = APIRouter()
 
+# Most questions accepted by one batch search request
+MAX_BATCH_QUERIES = 50
+
 class DocumentResponse(BaseModel):
     filename: str
     size: int
     content: str
     file_type: str
 
+def _owner_id(token: Optional[str]) -> Optional[int]:
+    """Teacher id from an optional Bearer token (401 if one is given but invalid)."""
+    if not token:
+        return None
+    if token.startswith("Bearer "):
+        token = token[7:]
+    decoded = decode_token(token)
+    if not decoded:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    return int(decoded["user_id"])
+
 @router.post("/upload")
-async def upload_document(file: UploadFile = File(...)):
-    """Upload a document and trigger embedding process for RAG."""
+async def upload_document(
+    request: Request,
+    file: UploadFile = File(...),
+    token: Optional[str] = None,
+    subject: Optional[str] = None
+):
+    """Upload a document and queue extraction and embedding for RAG.
+
+    Returns once the file is on disk; poll ``/status/{filename}`` for progress.
+    With a ``token`` the document's chunks are tagged with the teacher's id,
+    and with ``subject`` by subject, so searches can be scoped to them.
+    """
     try:
         # Validate file
-        if file.size > MAX_FILE_SIZE:
-            raise HTTPException(status_code=413, detail="File too large")
+        check_content_length(request)
+        owner_id = _owner_id(token)
+        filename = os.path.basename(file.filename)
         
         # Get file extension
-        file_ext = file.filename.split('.')[-1].lower()
+        file_ext = filename.split('.')[-1].lower()
         if file_ext not in ALLOWED_EXTENSIONS:
             raise HTTPException(status_code=400, detail=f"File type {file_ext} not allowed")
         
-        # Save file
-        file_path = os.path.join(UPLOAD_DIR, file.filename)
-        with open(file_path, 'wb') as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Save file (streamed, size-limited, hashed, deduplicated by content)
+        saved = await store_upload(file, filename, MAX_FILE_SIZE)
+        replaced_hash = await asyncio.to_thread(text_store.record_file_hash, filename, saved["sha256"])
+        await asyncio.to_thread(
+            document_catalog.record_upload, filename, saved["size"], saved["sha256"], owner_id, subject
+        )
         
-        # Extract content based on file type
-        if file_ext == 'pdf':
-            content = extract_text_from_pdf(file_path)
-        elif file_ext in ['png', 'jpg', 'jpeg']:
-            content = extract_text_from_image(file_path)
-        elif file_ext == 'docx':
-            content = extract_text_from_docx(file_path)
-        elif file_ext == 'doc':
-            content = extract_text_from_doc(file_path)
-        else:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-        
-        # Trigger embedding and store in vector database (RAG)
-        try:
-            embed_document(filename=file.filename, text=content)
-        except Exception as e:
-            print(f"Warning: embedding failed but upload succeeded: {str(e)}")
+        # Extraction and embedding (RAG) run in the background ingestion pipeline
+        ingestion = ingestion_pipeline.schedule_ingestion(filename, replaced_hash, owner_id, subject)
         
         return {
             "status": "success",
-            "filename": file.filename,
-            "size": file.size,
+            "filename": filename,
+            "size": saved["size"],
+            "content_hash": saved["sha256"],
+            "duplicate": saved["duplicate"],
             "file_type": file_ext,
-            "message": "Document uploaded and processed successfully"
+            "ingestion_status": ingestion["status"],
+            "message": "Document uploaded; processing in background"
         }
     
     except HTTPException as e:
@@ -73,52 +93,82 @@ async def upload_document(file: UploadFile = File(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error uploading document: {str(e)}")
 
+@router.get("/status/{filename}")
+async def get_ingestion_status(filename: str):
+    """Get the background ingestion status of an uploaded document"""
+    status = ingestion_pipeline.get_status(filename)
+    if status is None:
+        # Ingested before this server process started
+        entry = await asyncio.to_thread(document_catalog.get_document, filename)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="File not found")
+        status = {key: entry[key] for key in ("filename", "status", "error", "content_hash", "page_count")}
+    return status
+
 @router.get("/list")
-async def list_documents():
-    """List all uploaded documents"""
+async def list_documents(
+    token: Optional[str] = None,
+    file_type: Optional[str] = None,
+    status: Optional[str] = None,
+    subject: Optional[str] = None,
+    prefix: Optional[str] = None,
+    limit: int = DOCUMENT_LIST_PAGE_SIZE,
+    cursor: Optional[str] = None
+):
+    """List uploaded documents one page at a time, newest first.
+
+    With a ``token`` the teacher's own uploads are listed, without one the
+    uploads made without a token. ``file_type``, ``status``, ``subject`` and
+    a filename ``prefix`` narrow the list (a prefix search is in filename
+    order); pass the returned ``next_cursor`` as ``cursor`` for the next page.
+    """
     try:
-        files = os.listdir(UPLOAD_DIR)
-        documents = []
-        for filename in files:
-            file_path = os.path.join(UPLOAD_DIR, filename)
-            if os.path.isfile(file_path):
-                size = os.path.getsize(file_path)
-                documents.append({
-                    "filename": filename,
-                    "size": size,
-                    "path": file_path
-                })
-        return {"documents": documents}
+        owner_id = _owner_id(token)
+        return await asyncio.to_thread(
+            document_catalog.list_documents, owner_id, file_type, status, subject, prefix, limit, cursor
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    except HTTPException as e:
+        raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _load_document_text(filename: str) -> str:
+    """Stored text of an upload (extracted on first use); raises 404 if missing."""
+    record = await asyncio.to_thread(text_store.get_document_text, filename)
+    if record is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    return record["text"]
+
+
+def _check_explain_mode(mode: str):
+    if mode not in EXPLAIN_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(EXPLAIN_MODES)}")
+
+
 @router.get("/explain/{filename}")
-async def explain_document(filename: str):
-    """Get explanation of document"""
+async def explain_document(filename: str, mode: str = "auto"):
+    """Get explanation of document
+
+    Long documents are summarized section by section and the summaries
+    merged (``mode=auto``, the default, or ``map_reduce``); ``single``
+    explains only what fits in one prompt.
+    """
     try:
-        file_path = os.path.join(UPLOAD_DIR, filename)
-        if not os.path.exists(file_path):
-            raise HTTPException(status_code=404, detail="File not found")
-        
-        file_ext = filename.split('.')[-1].lower()
-        
-        if file_ext == 'pdf':
-            content = extract_text_from_pdf(file_path)
-        elif file_ext in ['png', 'jpg', 'jpeg']:
-            content = extract_text_from_image(file_path)
-        else:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
+        _check_explain_mode(mode)
+        content = await _load_document_text(filename)
         
         # Generate explanation using LLM
-        from utils import chat_with_llm
-        explanation_prompt = f"Please provide a clear and concise explanation of the following content in markdown and structured format:\n\n{content[:3000]}"
-        explanation = chat_with_llm(explanation_prompt)
+        explanation_prompt, coverage = await build_explain_prompt(content, mode)
+        explanation = await achat_with_llm(explanation_prompt, cache_endpoint="document.explain")
         
         return {
             "filename": filename,
             "explanation": explanation,
-            "content_preview": content[:2000]
+            "content_preview": content[:2000],
+            "mode": coverage["mode"],
+            "sections": coverage["sections"]
         }
     except HTTPException as e:
         raise e
@@ -126,54 +176,147 @@ async def explain_document(filename: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/explain/{filename}/stream")
+async def explain_document_stream(filename: str, mode: str = "auto"):
+    """Stream the explanation of a document as server-sent events
+
+    For long documents the section summaries are produced first; only the
+    final merged explanation is streamed.
+    """
+    try:
+        _check_explain_mode(mode)
+        content = await _load_document_text(filename)
+        explanation_prompt, coverage = await build_explain_prompt(content, mode)
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    tokens = astream_chat_with_llm(explanation_prompt, cache_endpoint="document.explain")
+    done = {"filename": filename, "content_preview": content[:2000], **coverage}
+    return StreamingResponse(sse_token_stream(tokens, done), media_type="text/event-stream")
+
+
 class AskRequest(BaseModel):
     question: str
+    mode: str = "dense"  # retrieval mode: dense, hybrid or keyword
+    rerank: Optional[bool] = None  # cross-encoder re-ranking (default from RERANK_ENABLED)
+
+
+async def _search_filters(filename: Optional[str], subject: Optional[str], token: Optional[str]) -> dict:
+    """Search filters for a request; a filename is resolved to its content hash."""
+    filters = {"owner_id": _owner_id(token), "subject": subject}
+    if filename:
+        content_hash = await asyncio.to_thread(text_store.content_hash_for, os.path.basename(filename))
+        if content_hash is None:
+            raise HTTPException(status_code=404, detail="File not found")
+        filters["content_hash"] = content_hash
+    return filters
+
+
+class SearchRequest(BaseModel):
+    query: str
+    top_k: int = 3
+    filename: Optional[str] = None
+    subject: Optional[str] = None
+    expand: int = 0
+    mode: str = "dense"
+    rerank: Optional[bool] = None
+
+
+@router.post("/search")
+async def search_documents(request: SearchRequest, token: Optional[str] = None):
+    """Semantic search over uploaded documents.
+
+    Optionally scoped to one ``filename``, a ``subject``, and (with a
+    ``token``) the calling teacher's own uploads.
+    """
+    try:
+        filters = await _search_filters(request.filename, request.subject, token)
+        hits = await asyncio.to_thread(
+            semantic_search, request.query, max(1, min(request.top_k, 20)), request.expand,
+            mode=request.mode, rerank=request.rerank, **filters
+        )
+        return {"status": "success", "query": request.query, "results": hits}
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    top_k: int = 3
+    filename: Optional[str] = None
+    subject: Optional[str] = None
+    expand: int = 0
+    mode: str = "dense"
+    rerank: Optional[bool] = None
+
+
+@router.post("/search/batch")
+async def search_documents_batch(request: BatchSearchRequest, token: Optional[str] = None):
+    """Semantic search for several questions in one embedding batch and one vector query.
+
+    Takes the same filters as ``/search``; returns one result list per query.
+    """
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="No queries provided")
+    if len(request.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_QUERIES} queries per request")
+    try:
+        filters = await _search_filters(request.filename, request.subject, token)
+        results = await asyncio.to_thread(
+            semantic_search_many, request.queries, max(1, min(request.top_k, 20)), request.expand,
+            mode=request.mode, rerank=request.rerank, **filters
+        )
+        return {
+            "status": "success",
+            "results": [{"query": q, "results": hits} for q, hits in zip(request.queries, results)]
+        }
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/ask/{filename}")
 async def ask_document_question(filename: str, request: AskRequest):
     """Answer a question about a specific uploaded document using semantic search (RAG)."""
     try:
-        # Try semantic search first (global store may contain the doc text)
-        hits = semantic_search(request.question, top_k=3)
+        content_hash = await asyncio.to_thread(text_store.content_hash_for, filename)
+        if content_hash is None:
+            raise HTTPException(status_code=404, detail="File not found")
+
+        # Semantic search over this document's chunks only
+        hits = await asyncio.to_thread(
+            semantic_search, request.question, 3, content_hash=content_hash, mode=request.mode,
+            rerank=request.rerank
+        )
 
         # If there are hits, include excerpts in the prompt
         if hits:
-            combined = '\n\n'.join([f"Source: {h['filename']}\n{h['text'][:1200]}" for h in hits])
-            prompt = f"""Use the following document excerpts to answer the question. Cite sources where relevant.
+            prompt = fit_excerpts_prompt("""Use the following document excerpts to answer the question. Cite sources where relevant.
 
 Document excerpts:
-{combined}
+{excerpts}
 
-Question: {request.question}
+Question: {question}
 
-Provide a clear, concise answer in markdown."""
+Provide a clear, concise answer in markdown.""", hits, question=request.question)
         else:
-            # fallback: read file and answer from full content (use proper extractors)
-            file_path = os.path.join(UPLOAD_DIR, filename)
-            if not os.path.exists(file_path):
-                raise HTTPException(status_code=404, detail="File not found")
-            file_ext = filename.split('.')[-1].lower()
-
-            if file_ext == 'pdf':
-                content = extract_text_from_pdf(file_path)
-            elif file_ext in ['png', 'jpg', 'jpeg']:
-                content = extract_text_from_image(file_path)
-            elif file_ext == 'docx':
-                content = extract_text_from_docx(file_path)
-            elif file_ext == 'doc':
-                content = extract_text_from_doc(file_path)
-            else:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-
-            # sanitize content before sending to LLM
-            content = sanitize_text(content)
-
-            prompt = f"Answer the question using the document content below.\n\nDocument:\n{content[:3000]}\n\nQuestion: {request.question}"
-
-        answer = chat_with_llm(prompt)
+            # fallback: answer from the stored (already sanitized) document text
+            content = await _load_document_text(filename)
+
+            prompt = fit_prompt(
+                "Answer the question using the document content below.\n\nDocument:\n{content}\n\nQuestion: {question}",
+                "content", content, question=request.question
+            )
+
+        answer = await achat_with_llm(prompt, cache_endpoint="document.ask")
 
         return {"status": "success", "response": answer}
+    except HTTPException as e:
+        raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
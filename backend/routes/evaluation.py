@@ -1,10 +1,18 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List
 import os
 import shutil
-from config import UPLOAD_DIR
-from utils import extract_text_from_image, chat_with_llm
+import tempfile
+import zipfile
+import asyncio
+from config import MAX_FILE_SIZE, UPLOAD_CHUNK_SIZE, BULK_IMAGE_MAX_SHEETS
+from utils import achat_with_llm, format_sse
+import ocr
+from grading import grade_batch, grade_sheets, build_image_eval_prompt
+import jobs
+from upload_stream import save_upload
 
 router = APIRouter()
 
@@ -38,7 +46,7 @@ Provide your evaluation in the following format:
 6. Feedback: [Detailed constructive feedback]
 7. Suggested Resources: [Recommendations to improve]"""
         
-        evaluation = chat_with_llm(prompt)
+        evaluation = await achat_with_llm(prompt, cache_endpoint="evaluation.evaluate-answer")
         
         return {
             "status": "success",
@@ -48,6 +56,13 @@ Provide your evaluation in the following format:
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+_SHEET_EXTENSIONS = {"png", "jpg", "jpeg"}
+
+
+def _extension(filename: str) -> str:
+    return filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+
+
 @router.post("/evaluate-image")
 async def evaluate_image(
     file: UploadFile = File(...),
@@ -55,46 +70,128 @@ async def evaluate_image(
     answer_explanation: str = ""
 ):
     """Evaluate answer from uploaded image"""
+    # Private temp directory so concurrent uploads of the same filename don't clash
+    workdir = tempfile.mkdtemp(prefix="sheet-")
+    file_path = os.path.join(workdir, os.path.basename(file.filename or "answer"))
     try:
-        # Save temporary file
-        file_path = os.path.join(UPLOAD_DIR, f"temp_{file.filename}")
-        with open(file_path, 'wb') as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        await save_upload(file, file_path, MAX_FILE_SIZE)
         
-        # Extract text from image
-        extracted_text = extract_text_from_image(file_path)
+        # Extract text from image (local OCR; the LLM only reads unclear regions)
+        recognized = await asyncio.to_thread(ocr.recognize_image, file_path)
+        extracted_text = recognized["text"]
         
         # Evaluate the extracted answer
-        prompt = f"""The following is a student's handwritten/photographed answer to a question.
-
-Question: {question}
-
-Extracted Answer Text:
-{extracted_text}
-
-{answer_explanation if answer_explanation else 'Please evaluate this answer based on accuracy and completeness.'}
-
-Provide:
-1. Transcription confirmation (is the text correct?)
-2. Accuracy assessment
-3. Completeness check
-4. Score (0-100)
-5. Feedback and suggestions"""
-        
-        evaluation = chat_with_llm(prompt)
-        
-        # Clean up temp file
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        prompt = build_image_eval_prompt(question, extracted_text, answer_explanation)
+        evaluation = await achat_with_llm(prompt, cache_endpoint="evaluation.evaluate-image")
         
         return {
             "status": "success",
             "extracted_text": extracted_text,
+            "ocr_confidence": recognized["confidence"],
+            "ocr_engine": recognized["engine"],
+            "ocr_degraded": recognized["degraded"],
             "evaluation": evaluation,
             "filename": file.filename
         }
+    except HTTPException as e:
+        raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error evaluating image: {str(e)}")
+    finally:
+        # Clean up temp files
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _unpack_sheets(zip_path: str, workdir: str, first_index: int, limit: int) -> list[tuple[str, str]]:
+    """Extract the images in a zip of scans into ``workdir``, in name order."""
+    sheets = []
+    with zipfile.ZipFile(zip_path) as archive:
+        members = sorted(
+            (m for m in archive.infolist()
+             if not m.is_dir() and not m.filename.startswith("__MACOSX/")
+             and not os.path.basename(m.filename).startswith(".")
+             and _extension(m.filename) in _SHEET_EXTENSIONS),
+            key=lambda m: m.filename,
+        )
+        if len(members) > limit:
+            raise HTTPException(status_code=400, detail=f"At most {BULK_IMAGE_MAX_SHEETS} answer sheets per request")
+        for member in members:
+            name = os.path.basename(member.filename)
+            path = os.path.join(workdir, f"{first_index + len(sheets):04d}_{name}")
+            # Copy with a running size check; the sizes in the zip header can lie
+            size = 0
+            with archive.open(member) as src, open(path, "wb") as out:
+                for block in iter(lambda: src.read(UPLOAD_CHUNK_SIZE), b""):
+                    size += len(block)
+                    if size > MAX_FILE_SIZE:
+                        raise HTTPException(status_code=413, detail=f"{name} is too large")
+                    out.write(block)
+            sheets.append((path, name))
+    return sheets
+
+
+async def _collect_sheets(files: List[UploadFile], workdir: str) -> list[tuple[str, str]]:
+    """Save uploaded images (and images inside uploaded zips) as ``(path, filename)`` sheets."""
+    sheets = []
+    for i, file in enumerate(files):
+        name = os.path.basename(file.filename or f"sheet-{i}")
+        ext = _extension(name)
+        if ext == "zip":
+            zip_path = os.path.join(workdir, f"upload-{i}.zip")
+            await save_upload(file, zip_path, MAX_FILE_SIZE)
+            try:
+                sheets += await asyncio.to_thread(
+                    _unpack_sheets, zip_path, workdir, len(sheets), BULK_IMAGE_MAX_SHEETS - len(sheets)
+                )
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail=f"{name} is not a valid zip file")
+            finally:
+                os.remove(zip_path)
+        elif ext in _SHEET_EXTENSIONS:
+            if len(sheets) >= BULK_IMAGE_MAX_SHEETS:
+                raise HTTPException(status_code=400, detail=f"At most {BULK_IMAGE_MAX_SHEETS} answer sheets per request")
+            path = os.path.join(workdir, f"{len(sheets):04d}_{name}")
+            await save_upload(file, path, MAX_FILE_SIZE)
+            sheets.append((path, name))
+        else:
+            raise HTTPException(status_code=400, detail=f"{name}: answer sheets must be images or zip files of images")
+    return sheets
+
+
+@router.post("/evaluate-images")
+async def evaluate_images(
+    files: List[UploadFile] = File(...),
+    question: str = "",
+    answer_explanation: str = "",
+    concurrency: Optional[int] = None
+):
+    """Grade a stack of scanned answer sheets (images, or zip files of images).
+
+    OCR and grading are pipelined across sheets, and each sheet's result is
+    streamed as a server-sent ``item`` event as soon as it is graded (its
+    ``index`` is the sheet's upload order), followed by a ``done`` event with
+    batch stats. A sheet that fails is reported with ``status: error``.
+    """
+    workdir = tempfile.mkdtemp(prefix="sheets-")
+    try:
+        sheets = await _collect_sheets(files, workdir)
+        if not sheets:
+            raise HTTPException(status_code=400, detail="No answer-sheet images found")
+    except BaseException:
+        shutil.rmtree(workdir, ignore_errors=True)
+        raise
+
+    async def events():
+        results = grade_sheets(sheets, question, answer_explanation, concurrency)
+        try:
+            async for kind, data in results:
+                yield format_sse(data, event=kind)
+        finally:
+            # Close the grader first (it waits for running OCR) before removing the images
+            await results.aclose()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
 
 @router.post("/rubric-based")
 async def rubric_based_evaluation(
@@ -128,7 +225,7 @@ Provide:
 5. Areas for improvement
 6. Specific feedback"""
         
-        evaluation = chat_with_llm(prompt)
+        evaluation = await achat_with_llm(prompt, cache_endpoint="evaluation.rubric-based")
         
         return {
             "status": "success",
@@ -141,29 +238,71 @@ Provide:
 
 @router.post("/bulk-evaluate")
 async def bulk_evaluate_answers(
-    evaluations: list  # List of {question, student_answer, correct_answer}
+    evaluations: List[dict],  # List of {question, student_answer, correct_answer}
+    concurrency: Optional[int] = None
 ):
-    """Evaluate multiple answers"""
+    """Evaluate multiple answers concurrently.
+
+    Results keep the input order; an item that fails is reported with
+    ``status: error`` instead of failing the whole batch.
+    """
     try:
-        results = []
-        for item in evaluations:
-            prompt = f"""Quick evaluation of student answer:
-Question: {item['question']}
-Answer: {item['student_answer']}
-Expected: {item['correct_answer']}
-
-Score (0-100) and brief feedback."""
-            
-            eval_result = chat_with_llm(prompt)
-            results.append({
-                "question": item['question'],
-                "evaluation": eval_result
-            })
-        
+        batch = await grade_batch(evaluations, concurrency=concurrency)
+        results = [
+            {
+                "question": r["question"],
+                "evaluation": r["evaluation"],
+                "status": r["status"],
+                "error": r["error"],
+                "latency_ms": r["latency_ms"],
+            }
+            for r in batch["results"]
+        ]
+
         return {
             "status": "success",
             "evaluations": results,
-            "total_evaluated": len(results)
+            "total_evaluated": batch["stats"]["succeeded"],
+            "total_failed": batch["stats"]["failed"],
+            "stats": batch["stats"]
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/bulk-jobs")
+async def submit_bulk_job(
+    evaluations: List[dict]  # List of {question, student_answer, correct_answer}
+):
+    """Queue a batch for background grading and return its job id immediately."""
+    try:
+        job = await jobs.submit_job(evaluations)
+        return {"status": "success", "job": job}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/bulk-jobs/{job_id}")
+async def get_bulk_job(job_id: str, since: int = 0):
+    """Poll a grading job: progress counts plus results finished so far.
+
+    Pass ``since`` to only receive results for items at or after that index.
+    """
+    job = await asyncio.to_thread(jobs.get_job, job_id, since)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"status": "success", "job": job}
+
+@router.get("/bulk-jobs/{job_id}/stream")
+async def stream_bulk_job(job_id: str):
+    """Stream per-item results as server-sent events while the job runs."""
+    if await asyncio.to_thread(jobs.get_job, job_id, 0, False) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        async for kind, data in jobs.stream_job(job_id):
+            if kind == "keepalive":
+                yield ": keepalive\n\n"
+            else:
+                yield format_sse(data, event=kind)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
-from utils import chat_with_llm
+from utils import achat_with_llm, astream_chat_with_llm, sse_token_stream
 
 router = APIRouter()
 
@@ -20,13 +21,11 @@ class LessonPlanResponse(BaseModel):
     resources: List[str]
     assessments: str
 
-@router.post("/create")
-async def create_lesson_plan(request: LessonPlanRequest):
-    """Create a detailed lesson plan"""
-    try:
-        topics_str = ", ".join(request.topics)
-        
-        prompt = f"""Create a comprehensive lesson plan with the following requirements:
+def _build_lesson_plan_prompt(request: LessonPlanRequest) -> str:
+    """Prompt shared by the regular and streaming lesson plan endpoints."""
+    topics_str = ", ".join(request.topics)
+    
+    return f"""Create a comprehensive lesson plan with the following requirements:
 
 Chapter: {request.chapter_name}
 Topics: {topics_str}
@@ -50,8 +49,14 @@ Format as a structured timeline that spreads content across {request.total_weeks
 the data should be presented in a markdown clear and organized manner, suitable for direct implementation by educators.
 
 """
+
+@router.post("/create")
+async def create_lesson_plan(request: LessonPlanRequest):
+    """Create a detailed lesson plan"""
+    try:
+        prompt = _build_lesson_plan_prompt(request)
         
-        lesson_plan = chat_with_llm(prompt)
+        lesson_plan = await achat_with_llm(prompt, cache_endpoint="lesson_plan.create")
         
         return {
             "status": "success",
@@ -63,6 +68,19 @@ the data should be presented in a markdown clear and organized manner, suitable
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/create/stream")
+async def create_lesson_plan_stream(request: LessonPlanRequest):
+    """Create a lesson plan, streaming markdown tokens as server-sent events"""
+    prompt = _build_lesson_plan_prompt(request)
+    tokens = astream_chat_with_llm(prompt, cache_endpoint="lesson_plan.create")
+    done = {
+        "status": "success",
+        "chapter": request.chapter_name,
+        "total_weeks": request.total_weeks,
+        "lectures_total": request.total_weeks * request.lectures_per_week
+    }
+    return StreamingResponse(sse_token_stream(tokens, done), media_type="text/event-stream")
+
 @router.post("/week-plan")
 async def create_week_plan(
     chapter_name: str,
@@ -93,7 +111,7 @@ For each lecture, provide:
 
 Create a detailed, hour-by-hour or minute-by-minute breakdown in markdown format."""
         
-        week_plan = chat_with_llm(prompt)
+        week_plan = await achat_with_llm(prompt, cache_endpoint="lesson_plan.week-plan")
         
         return {
             "status": "success",
@@ -137,7 +155,7 @@ Include:
 4. Accessibility considerations
 5. Homework preview"""
         
-        schedule = chat_with_llm(prompt)
+        schedule = await achat_with_llm(prompt, cache_endpoint="lesson_plan.daily-schedule")
         
         return {
             "status": "success",
@@ -181,7 +199,7 @@ For each week, specify:
 - How it connects to learning objectives
 - Feedback timeline"""
         
-        assessment_plan = chat_with_llm(prompt)
+        assessment_plan = await achat_with_llm(prompt, cache_endpoint="lesson_plan.assessment-plan")
         
         return {
             "status": "success",
@@ -220,7 +238,7 @@ Provide recommendations for:
 9. Extensions for advanced students
 10. Support resources for struggling students"""
         
-        resources = chat_with_llm(prompt)
+        resources = await achat_with_llm(prompt, cache_endpoint="lesson_plan.resource-recommendations")
         
         return {
             "status": "success",
@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import List
-from utils import generate_questions, chat_with_llm
+from utils import generate_questions, achat_with_llm
+from prompt_builder import fit_prompt
 
 router = APIRouter()
 
@@ -23,19 +24,20 @@ async def generate_questions_endpoint(request: QuestionRequest):
             raise HTTPException(status_code=400, detail="Invalid difficulty level")
         
         # Generate questions using LLM
-        prompt = f"""Generate {request.num_questions} {request.difficulty} level {request.question_type} questions based on this content.
+        prompt = fit_prompt("""Generate {num_questions} {difficulty} level {question_type} questions based on this content.
         
 Content:
-{request.content[:2000]}
+{content}
 
-For {request.question_type} format:
+For {question_type} format:
 - If multiple_choice: include 4 options (A, B, C, D) and indicate correct answer
 - If short_answer: provide expected answer keywords
 - If essay: provide key points to cover
 
-Format as numbered list with clear structure."""
+Format as numbered list with clear structure.""", "content", request.content, num_questions=request.num_questions,
+            difficulty=request.difficulty, question_type=request.question_type)
         
-        questions_text = chat_with_llm(prompt)
+        questions_text = await achat_with_llm(prompt, cache_endpoint="questions.generate")
         
         return {
             "status": "success",
@@ -53,18 +55,18 @@ Format as numbered list with clear structure."""
 async def generate_answer_key(request: QuestionRequest):
     """Generate answer key for questions"""
     try:
-        prompt = f"""Based on the following content, generate a comprehensive answer key with detailed explanations.
+        prompt = fit_prompt("""Based on the following content, generate a comprehensive answer key with detailed explanations.
 
 Content:
-{request.content[:2000]}
+{content}
 
 For each point, provide:
 1. Key concepts
 2. Important details
 3. Common student mistakes to watch for
-4. Tips for teaching this topic"""
+4. Tips for teaching this topic""", "content", request.content)
         
-        answer_key = chat_with_llm(prompt)
+        answer_key = await achat_with_llm(prompt, cache_endpoint="questions.answer-key")
         
         return {
             "status": "success",
@@ -81,13 +83,14 @@ async def generate_practice_questions(request: QuestionRequest):
         all_questions = {}
         
         for difficulty in difficulties:
-            prompt = f"""Generate {request.num_questions // 3} {difficulty} level questions about:
+            prompt = fit_prompt("""Generate {count} {difficulty} level questions about:
 
-{request.content[:1500]}
+{content}
 
-Format clearly with difficulty level."""
+Format clearly with difficulty level.""", "content", request.content, count=request.num_questions // 3,
+                difficulty=difficulty)
             
-            questions = chat_with_llm(prompt)
+            questions = await achat_with_llm(prompt, cache_endpoint="questions.practice-questions")
             all_questions[difficulty] = questions
         
         return {
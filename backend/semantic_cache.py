@@ -0,0 +1,121 @@
+"""Semantic cache for near-duplicate chat questions.
+
+Incoming questions are embedded with the shared ``all-MiniLM-L6-v2`` model and
+looked up in a dedicated Chroma collection (``semantic_cache``). If a prior
+question for the same endpoint and model is at least
+``SEMANTIC_CACHE_THRESHOLD`` cosine-similar, its answer is returned instead of
+calling the LLM, so paraphrases like "how do I grade objectively" and "tips to
+score fairly" share one answer.
+"""
+import asyncio
+import hashlib
+import time
+from typing import Optional
+
+import utils
+from embeddings import get_embedder
+from config import GROK_MODEL, SEMANTIC_CACHE_ENABLED, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL
+
+_COLLECTION = None
+_STATS = {"hits": 0, "misses": 0, "stores": 0}
+
+
+def _get_collection():
+    """Get or create the Chroma collection backing the semantic cache."""
+    global _COLLECTION
+
+    if not SEMANTIC_CACHE_ENABLED or not utils.VEC_AVAILABLE:
+        return None
+    try:
+        if _COLLECTION is None:
+            _COLLECTION = utils._open_collection("semantic_cache")
+        return _COLLECTION
+    except Exception as e:
+        print(f"Error initializing semantic cache: {str(e)}")
+        return None
+
+
+def _embed(text: str):
+    return get_embedder().encode([text])
+
+
+def _lookup(endpoint: str, text: str) -> Optional[dict]:
+    collection = _get_collection()
+    if collection is None or collection.count() == 0:
+        return None
+
+    results = collection.query(
+        query_embeddings=_embed(text),
+        n_results=1,
+        where={"$and": [{"endpoint": endpoint}, {"model": GROK_MODEL}]},
+        include=["documents", "metadatas", "distances"],
+    )
+    if not results["ids"] or not results["ids"][0]:
+        return None
+
+    meta = results["metadatas"][0][0]
+    similarity = 1.0 - results["distances"][0][0]
+    if similarity < SEMANTIC_CACHE_THRESHOLD:
+        return None
+    if time.time() - meta.get("created_at", 0) > SEMANTIC_CACHE_TTL:
+        collection.delete(ids=[results["ids"][0][0]])
+        return None
+    return {
+        "response": meta["response"],
+        "similarity": round(similarity, 4),
+        "matched_question": results["documents"][0][0],
+    }
+
+
+def _store(endpoint: str, text: str, response: str):
+    collection = _get_collection()
+    if collection is None:
+        return
+    entry_id = hashlib.sha256(f"{GROK_MODEL}\n{endpoint}\n{text}".encode("utf-8")).hexdigest()
+    collection.upsert(
+        ids=[entry_id],
+        embeddings=_embed(text),
+        documents=[text],
+        metadatas=[{
+            "endpoint": endpoint,
+            "model": GROK_MODEL,
+            "response": response,
+            "created_at": time.time(),
+        }],
+    )
+
+
+async def lookup(endpoint: str, text: str) -> Optional[dict]:
+    """Return a cached answer for a semantically similar question, or None."""
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    try:
+        hit = await asyncio.to_thread(_lookup, endpoint, text)
+    except Exception as e:
+        print(f"Error in semantic cache lookup: {str(e)}")
+        hit = None
+    _STATS["hits" if hit else "misses"] += 1
+    return hit
+
+
+async def store(endpoint: str, text: str, response: str):
+    """Remember ``response`` as the answer to ``text`` (error replies are skipped)."""
+    if not SEMANTIC_CACHE_ENABLED or not isinstance(response, str) or response.startswith("Error in chat:"):
+        return
+    try:
+        await asyncio.to_thread(_store, endpoint, text, response)
+        _STATS["stores"] += 1
+    except Exception as e:
+        print(f"Error in semantic cache store: {str(e)}")
+
+
+def stats() -> dict:
+    """Hit/miss counters and entry count."""
+    collection = _get_collection()
+    lookups = _STATS["hits"] + _STATS["misses"]
+    return {
+        **_STATS,
+        "hit_rate": round(_STATS["hits"] / lookups, 3) if lookups else 0.0,
+        "threshold": SEMANTIC_CACHE_THRESHOLD,
+        "entries": collection.count() if collection is not None else 0,
+    }
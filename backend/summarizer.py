@@ -0,0 +1,142 @@
+"""Map-reduce explanations of long documents.
+
+A document that fits the prompt budget is explained in one call, as before.
+A longer one is split into sections of about ``EXPLAIN_SECTION_TOKENS`` at
+heading and paragraph boundaries (map). The sections are summarized
+concurrently, bounded by the shared LLM concurrency limit. The partial
+summaries are then merged into one explanation (reduce); if they are still
+too long for one prompt, they are summarized again in groups first.
+
+Section summaries go through the LLM response cache, whose key is a hash of
+the prompt and so of the section text. Re-explaining a document, or a
+revised version of it, only calls the model for sections whose text changed.
+"""
+import asyncio
+import zlib
+
+from chunking import estimate_tokens, split_blocks, structured_chunks
+from config import EXPLAIN_SECTION_TOKENS
+from prompt_builder import count_tokens, fit_prompt, prompt_budget
+from utils import achat_with_llm
+
+EXPLAIN_MODES = ("auto", "single", "map_reduce")
+
+EXPLAIN_TEMPLATE = (
+    "Please provide a clear and concise explanation of the following content in markdown and structured format:\n\n"
+    "{content}"
+)
+
+SECTION_TEMPLATE = """Summarize this section of a longer teaching document for a teacher.
+Keep every key concept, definition, formula, worked example and question it contains; be concise.
+
+Section:
+{content}
+
+Summary:"""
+
+COMBINE_TEMPLATE = """The following are summaries of consecutive parts of one document.
+Merge them into a single summary that keeps every key concept, definition, formula and question.
+
+{content}
+
+Merged summary:"""
+
+REDUCE_TEMPLATE = """The following are summaries of consecutive sections of one document, in order.
+Using them, provide a clear and concise explanation of the whole document in markdown and structured format.
+
+{content}"""
+
+
+def _is_cut_point(block: str) -> bool:
+    # Content-defined: roughly one block in four ends a section
+    return zlib.crc32(block.encode("utf-8")) % 4 == 0
+
+
+def split_sections(text: str, section_tokens: int = EXPLAIN_SECTION_TOKENS) -> list[str]:
+    """Split text into sections of at most ``section_tokens`` at paragraph/heading breaks.
+
+    Past half the budget a section ends before a heading or after a block
+    picked by its content hash, so an edit only moves the boundaries next to
+    it and the other sections keep their exact text (and cached summaries).
+    """
+    spans = []
+    for start, end, heading in split_blocks(text):
+        tokens = estimate_tokens(text[start:end])
+        if tokens > section_tokens:
+            # A single oversized paragraph is split at sentence breaks
+            for s, e, _ in structured_chunks(text[start:end], section_tokens, 0):
+                spans.append((start + s, start + e, False, estimate_tokens(text[start + s:start + e])))
+        else:
+            spans.append((start, end, heading, tokens))
+
+    sections, current, used = [], None, 0
+    for start, end, heading, tokens in spans:
+        block = text[start:end]
+        if current is not None and (used + tokens > section_tokens or (used >= section_tokens // 2 and heading)):
+            sections.append(text[current[0]:current[1]])
+            current, used = None, 0
+        current = (current[0], end) if current else (start, end)
+        used += tokens
+        if used >= section_tokens // 2 and _is_cut_point(block):
+            sections.append(text[current[0]:current[1]])
+            current, used = None, 0
+    if current:
+        sections.append(text[current[0]:current[1]])
+    return sections or [text]
+
+
+async def _summarize(template: str, content: str, **fields) -> str:
+    summary = await achat_with_llm(fit_prompt(template, "content", content, **fields),
+                                   cache_endpoint="document.explain.section")
+    if summary.startswith("Error in chat:"):
+        raise Exception(summary)
+    return summary
+
+
+async def _combine(group: list[str]) -> str:
+    if len(group) == 1:
+        return group[0]
+    return await _summarize(COMBINE_TEMPLATE, "\n\n".join(group))
+
+
+async def _reduce(summaries: list[str], budget: int) -> str:
+    """Join summaries, combining them in groups until they fit in one prompt."""
+    reserve = count_tokens(REDUCE_TEMPLATE.format(content=""))
+    while True:
+        joined = "\n\n".join(f"Part {i + 1}:\n{s}" for i, s in enumerate(summaries))
+        if len(summaries) == 1 or count_tokens(joined) + reserve <= budget:
+            return joined
+
+        groups, group, used = [], [], 0
+        for summary in summaries:
+            cost = count_tokens(summary)
+            if group and used + cost > budget // 2:
+                groups.append(group)
+                group, used = [], 0
+            group.append(summary)
+            used += cost
+        groups.append(group)
+        if len(groups) == len(summaries):
+            # Every summary is too large to pair up; let the final prompt cut the tail
+            return joined
+        summaries = await asyncio.gather(*[_combine(group) for group in groups])
+
+
+async def build_explain_prompt(text: str, mode: str = "auto") -> tuple[str, dict]:
+    """Prompt that explains ``text``, running the map stage first if needed.
+
+    ``mode`` is ``"single"`` (one prompt, cut to the budget), ``"map_reduce"``
+    or ``"auto"`` (map-reduce only when the text does not fit). Returns
+    ``(prompt, info)`` where ``info`` describes how the text was covered.
+    """
+    budget = prompt_budget()
+    fits = count_tokens(text) + count_tokens(EXPLAIN_TEMPLATE.format(content="")) <= budget
+    if mode == "single" or (mode == "auto" and fits):
+        return fit_prompt(EXPLAIN_TEMPLATE, "content", text), {"mode": "single", "sections": 1}
+
+    sections = split_sections(text)
+    summaries = await asyncio.gather(*[
+        _summarize(SECTION_TEMPLATE, section) for section in sections
+    ])
+    merged = await _reduce(list(summaries), budget)
+    return fit_prompt(REDUCE_TEMPLATE, "content", merged), {"mode": "map_reduce", "sections": len(sections)}
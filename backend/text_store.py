@@ -0,0 +1,275 @@
+"""Persistent store of extracted document text.
+
+Uploads are parsed once: the sanitized text is zlib-compressed and stored in
+``extracted_texts`` keyed by the SHA-256 of the raw file, together with the
+start offset of every page. ``document_files`` remembers each upload's hash
+alongside its size and mtime, so later reads only re-hash (and re-extract)
+when the file on disk has actually changed. Several filenames may share one
+content hash; the text is kept until the last of them points elsewhere.
+Large uploads are stored from a stream of page records (``TextRecorder``)
+rather than a list of pages.
+"""
+import hashlib
+import json
+import os
+import zlib
+from typing import Iterable, Iterator, Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from config import UPLOAD_DIR
+from models import SessionLocal, ExtractedText, DocumentFile
+from utils import extract_document_pages
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(file_path: str) -> str:
+    """SHA-256 of a file's contents, read in chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def join_pages(pages: list[str]) -> tuple[str, list[int]]:
+    """Join page texts with newlines and return (text, page start offsets)."""
+    offsets = []
+    position = 0
+    for page in pages:
+        offsets.append(position)
+        position += len(page) + 1
+    return "\n".join(pages), offsets
+
+
+def _record(row: ExtractedText, filename: Optional[str] = None) -> dict:
+    return {
+        "filename": filename,
+        "content_hash": row.content_hash,
+        "text": zlib.decompress(row.text_z).decode("utf-8"),
+        "page_offsets": json.loads(row.page_offsets or "[0]"),
+        "page_count": row.page_count,
+    }
+
+
+def _file_hash(db, filename: str, file_path: str, refresh: bool = False) -> str:
+    """Content hash for ``filename``, re-hashing only if size/mtime changed."""
+    stat = os.stat(file_path)
+    entry = db.query(DocumentFile).filter(DocumentFile.filename == filename).first()
+    if not refresh and entry and entry.size == stat.st_size and entry.mtime_ns == stat.st_mtime_ns:
+        return entry.content_hash
+
+    content_hash = hash_file(file_path)
+    _set_file_hash(db, filename, stat, content_hash, entry)
+    return content_hash
+
+
+def _set_file_hash(db, filename: str, stat: os.stat_result, content_hash: str,
+                   entry: Optional[DocumentFile] = None) -> Optional[str]:
+    """Point ``filename`` at ``content_hash``; returns the previous hash if it is now orphaned."""
+    if entry is None:
+        entry = db.query(DocumentFile).filter(DocumentFile.filename == filename).first()
+    previous = entry.content_hash if entry else None
+    if entry is None:
+        entry = DocumentFile(filename=filename)
+        db.add(entry)
+    entry.content_hash = content_hash
+    entry.size = stat.st_size
+    entry.mtime_ns = stat.st_mtime_ns
+    db.commit()
+
+    if previous and previous != content_hash and _drop_if_unreferenced(db, previous):
+        return previous
+    return None
+
+
+def record_file_hash(filename: str, content_hash: str) -> Optional[str]:
+    """Record a hash computed while saving an upload, so it is not re-read.
+
+    Returns the hash the filename used to point at if no filename aliases it
+    any more, so the caller can drop that content's blob and vectors.
+    """
+    stat = os.stat(os.path.join(UPLOAD_DIR, filename))
+    db = SessionLocal()
+    try:
+        return _set_file_hash(db, filename, stat, content_hash)
+    finally:
+        db.close()
+
+
+def aliases_for(content_hash: str) -> list[str]:
+    """All filenames whose current content is ``content_hash``."""
+    db = SessionLocal()
+    try:
+        rows = db.query(DocumentFile.filename).filter(DocumentFile.content_hash == content_hash).all()
+        return [r[0] for r in rows]
+    finally:
+        db.close()
+
+
+def _drop_if_unreferenced(db, content_hash: str) -> bool:
+    """Delete stored text that no upload points at any more; True if dropped."""
+    still_used = db.query(DocumentFile).filter(DocumentFile.content_hash == content_hash).count()
+    if not still_used:
+        db.query(ExtractedText).filter(ExtractedText.content_hash == content_hash).delete()
+        db.commit()
+    return not still_used
+
+
+def store_pages(db, content_hash: str, pages: list[str]) -> ExtractedText:
+    """Compress and persist extracted pages under ``content_hash``."""
+    text, offsets = join_pages(pages)
+    row = db.query(ExtractedText).filter(ExtractedText.content_hash == content_hash).first()
+    if row is None:
+        row = ExtractedText(content_hash=content_hash)
+        db.add(row)
+    row.text_z = zlib.compress(text.encode("utf-8"), 6)
+    row.page_offsets = json.dumps(offsets)
+    row.char_count = len(text)
+    row.page_count = len(pages)
+    db.commit()
+    return row
+
+
+class TextRecorder:
+    """Compresses sanitized ``{"page", "text"}`` records as they stream past.
+
+    ``feed`` passes the records through unchanged, so extraction can be
+    stored and chunked in one pass without joining the text; afterwards
+    ``save_recorded`` persists what was captured.
+    """
+
+    def __init__(self):
+        self._compressor = zlib.compressobj(6)
+        self._parts: list[bytes] = []
+        self._page = None
+        self.page_offsets: list[int] = []
+        self.char_count = 0
+        self.complete = False
+        self.error: Optional[Exception] = None
+
+    def _write(self, text: str):
+        self._parts.append(self._compressor.compress(text.encode("utf-8")))
+        self.char_count += len(text)
+
+    def feed(self, records: Iterable[dict]) -> Iterator[dict]:
+        try:
+            for record in records:
+                if record["page"] != self._page:
+                    # Pages are joined with newlines, as in join_pages
+                    if self._page is not None:
+                        self._write("\n")
+                    self._page = record["page"]
+                    self.page_offsets.append(self.char_count)
+                self._write(record["text"])
+                yield record
+        except Exception as e:
+            self.error = e
+            raise
+        self.complete = True
+
+    def compressed(self) -> bytes:
+        return b"".join(self._parts) + self._compressor.flush()
+
+
+def save_recorded(content_hash: str, recorder: TextRecorder, filename: Optional[str] = None) -> dict:
+    """Persist a fully fed ``TextRecorder``; returns the record without its ``text``.
+
+    Re-raises the extraction error if the records did not finish.
+    """
+    if recorder.error is not None:
+        raise recorder.error
+    if not recorder.complete:
+        raise Exception("Extraction did not finish")
+
+    db = SessionLocal()
+    try:
+        row = db.query(ExtractedText).filter(ExtractedText.content_hash == content_hash).first()
+        if row is None:
+            row = ExtractedText(content_hash=content_hash)
+            db.add(row)
+        row.text_z = recorder.compressed()
+        row.page_offsets = json.dumps(recorder.page_offsets)
+        row.char_count = recorder.char_count
+        row.page_count = len(recorder.page_offsets)
+        try:
+            db.commit()
+        except IntegrityError:
+            # A concurrent request stored the same content first
+            db.rollback()
+            row = db.query(ExtractedText).filter(ExtractedText.content_hash == content_hash).first()
+        return {
+            "filename": filename,
+            "content_hash": content_hash,
+            "page_offsets": json.loads(row.page_offsets or "[0]"),
+            "page_count": row.page_count,
+        }
+    finally:
+        db.close()
+
+
+def content_hash_for(filename: str, refresh: bool = False) -> Optional[str]:
+    """Current content hash of an upload, or None if the file does not exist."""
+    file_path = os.path.join(UPLOAD_DIR, filename)
+    if not os.path.isfile(file_path):
+        return None
+
+    db = SessionLocal()
+    try:
+        return _file_hash(db, filename, file_path, refresh=refresh)
+    finally:
+        db.close()
+
+
+def load_text(content_hash: str, filename: Optional[str] = None) -> Optional[dict]:
+    """Stored text record for ``content_hash``, or None if not extracted yet."""
+    db = SessionLocal()
+    try:
+        row = db.query(ExtractedText).filter(ExtractedText.content_hash == content_hash).first()
+        return _record(row, filename) if row else None
+    finally:
+        db.close()
+
+
+def page_count_for(content_hash: str) -> Optional[int]:
+    """Page count of stored text, without loading it; None if not extracted yet."""
+    db = SessionLocal()
+    try:
+        row = db.query(ExtractedText.page_count).filter(ExtractedText.content_hash == content_hash).first()
+        return row[0] if row else None
+    finally:
+        db.close()
+
+
+def save_pages(content_hash: str, pages: list[str], filename: Optional[str] = None) -> dict:
+    """Persist extracted pages (no-op if another request stored them first)."""
+    db = SessionLocal()
+    try:
+        try:
+            row = store_pages(db, content_hash, pages)
+        except IntegrityError:
+            # A concurrent request stored the same content first
+            db.rollback()
+            row = db.query(ExtractedText).filter(ExtractedText.content_hash == content_hash).first()
+        return _record(row, filename)
+    finally:
+        db.close()
+
+
+def get_document_text(filename: str, refresh: bool = False) -> Optional[dict]:
+    """Return the extracted text record for an upload, extracting it at most once.
+
+    Returns None if the file does not exist. The record has ``text``,
+    ``page_offsets``, ``page_count``, ``content_hash`` and ``filename``.
+    Pass ``refresh=True`` right after (re)writing the file to force a re-hash.
+    """
+    content_hash = content_hash_for(filename, refresh=refresh)
+    if content_hash is None:
+        return None
+
+    record = load_text(content_hash, filename)
+    if record is None:
+        pages = extract_document_pages(os.path.join(UPLOAD_DIR, filename))
+        record = save_pages(content_hash, pages, filename)
+    return record
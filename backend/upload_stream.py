@@ -0,0 +1,59 @@
+"""Streaming, bounded-memory saving of uploaded files.
+
+Uploads are copied chunk by chunk with async file I/O, the size limit is
+enforced as bytes are written (aborting as soon as it is exceeded), and a
+SHA-256 of the content is computed on the fly. Data goes to a unique temp
+file next to the destination and is moved into place with an atomic rename,
+so concurrent uploads of the same filename never interleave their bytes.
+"""
+import hashlib
+import os
+import tempfile
+from typing import Optional
+
+import aiofiles
+from fastapi import HTTPException, Request, UploadFile
+
+from config import MAX_FILE_SIZE, UPLOAD_CHUNK_SIZE
+
+# Allowance for multipart boundaries and part headers on top of the file itself
+_MULTIPART_OVERHEAD = 64 * 1024
+
+
+def check_content_length(request: Request, max_size: int = MAX_FILE_SIZE):
+    """Reject a request up front when its declared body is already too large."""
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_size + _MULTIPART_OVERHEAD:
+        raise HTTPException(status_code=413, detail="File too large")
+
+
+async def save_upload(file: UploadFile, dest_path: str, max_size: Optional[int] = MAX_FILE_SIZE) -> dict:
+    """Stream ``file`` to ``dest_path`` atomically.
+
+    Returns ``{"path", "size", "sha256"}``. Raises HTTP 413 (leaving nothing
+    on disk) once more than ``max_size`` bytes have been received.
+    """
+    directory = os.path.dirname(dest_path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".upload-", suffix=".part")
+    os.close(fd)
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(tmp_path, 'wb') as out:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if max_size is not None and size > max_size:
+                    raise HTTPException(status_code=413, detail="File too large")
+                digest.update(chunk)
+                await out.write(chunk)
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    return {"path": dest_path, "size": size, "sha256": digest.hexdigest()}
@@ -1,18 +1,25 @@
-from config import GROK_API_KEY, GROK_API_URL, GROK_MODEL
-from typing import Optional
+from typing import Iterable, Iterator, Optional
+import asyncio
+import llm_client
+import llm_cache
 import numpy as np
 import os
 import json
+import time
+import uuid
+import hashlib
 from datetime import datetime
 import re
 
-# Try to import sentence-transformers for dense embeddings
-try:
-    from sentence_transformers import SentenceTransformer
-    SENTENCE_AVAILABLE = True
-except Exception:
-    SentenceTransformer = None
-    SENTENCE_AVAILABLE = False
+# Dense embeddings come from the shared embedding service
+from embeddings import SENTENCE_AVAILABLE, get_embedder
+from chunking import chunk_document, merge_chunks
+from prompt_builder import fit_prompt
+import bm25_index
+import pdf_extract
+import ocr
+from reranker import get_reranker
+from config import SEARCH_RRF_K, RERANK_ENABLED, RERANK_CANDIDATES
 
 # Try to import Chroma for persistent vector database
 try:
@@ -23,99 +30,64 @@ except Exception:
     chromadb = None
     CHROMA_AVAILABLE = False
 
-# Whether we have any vector embedding capability
-VEC_AVAILABLE = SENTENCE_AVAILABLE and CHROMA_AVAILABLE
+from numpy_index import NumpyCollection
+
+# Whether we have any vector embedding capability (Chroma, or the NumPy
+# fallback index when Chroma is not installed)
+VEC_AVAILABLE = SENTENCE_AVAILABLE
 
 
 def query_grok(prompt: str, system_context: Optional[str] = None, max_tokens: int = 1000):
     """
-    Query Grok via the user's preferred langchain wrapper if available,
-    otherwise fall back to a direct HTTP call to the Grok endpoint.
+    Query Grok through the shared, pooled client in ``llm_client``.
 
+    Blocking; async route handlers should use ``aquery_grok`` instead.
     Returns the response string.
     """
+    return llm_client.complete(prompt, system_context=system_context, max_tokens=max_tokens)
 
-    # Build messages list
-    messages = []
-    if system_context:
-        messages.append({"role": "system", "content": system_context})
-    messages.append({"role": "user", "content": prompt})
 
-    # Try langchain_grok (user said they updated to use this). Support
-    # a couple of possible package names/CLIs to be tolerant.
-    try:
-        # Try the common name first
-        from langchain_groq import ChatGroq
-        llm = ChatGroq(model=GROK_MODEL, api_key=GROK_API_KEY)
-        # some wrappers accept a messages list or a single prompt
-        if hasattr(llm, "invoke"):
-            out = llm.invoke(messages)
-            out=out.content
-        else:
-            out = llm(messages)
-            out=out.content
+async def aquery_grok(prompt: str, system_context: Optional[str] = None, max_tokens: int = 1000):
+    """Async version of ``query_grok`` that does not block the event loop."""
+    return await llm_client.acomplete(prompt, system_context=system_context, max_tokens=max_tokens)
 
-        # If LangChain-style response object, try to coerce to text
-        if isinstance(out, dict) and "content" in out:
-            return out["content"]
-        return out
-    except Exception:
-        pass
 
-    try:
-        # Try alternative package name (typo variants in ecosystem)
-        from langchain_groq import ChatGroq
-        llm = ChatGroq(model=GROK_MODEL, api_key=GROK_API_KEY)
-        if hasattr(llm, "invoke"):
-            out = llm.invoke(messages)
-            out=out.content
-        else:
-            out = llm(messages)
-            out=out.content
-        if isinstance(out, dict) and "content" in out:
-            return out["content"]
-        return out
-    except Exception:
-        pass
-
-    # If we reach here the langchain wrapper wasn't available.
-    raise RuntimeError(
-        "No Grok langchain wrapper available. Install and configure `langchain_grok` "
-        "or `langchain_groq` (and set `GROK_API_KEY` in your environment) to use Grok."
-    )
+def format_sse(data, event: Optional[str] = None) -> str:
+    """Format one server-sent event; non-string data is sent as JSON."""
+    if not isinstance(data, str):
+        data = json.dumps(data)
+    lines = [f"event: {event}"] if event else []
+    lines.extend(f"data: {line}" for line in data.split("\n"))
+    return "\n".join(lines) + "\n\n"
 
 def extract_text_from_pdf(file_path: str) -> str:
     """Extract text from PDF file"""
-    from PyPDF2 import PdfReader
-    
-    text = ""
-    try:
-        with open(file_path, 'rb') as file:
-            pdf_reader = PdfReader(file)
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-    except Exception as e:
-        raise Exception(f"Error extracting PDF: {str(e)}")
-    
-    return text
+    return pdf_extract.extract_pdf(file_path)["text"]
+
+def extract_pdf_pages(file_path: str) -> list[str]:
+    """Extract text from a PDF file, one string per page"""
+    result = pdf_extract.extract_pdf(file_path)
+    if result["failed_pages"]:
+        print(f"Could not extract pages {[n + 1 for n in result['failed_pages']]} of {os.path.basename(file_path)}")
+    return result["pages"]
 
 def extract_text_from_image(file_path: str) -> str:
-    """Extract text from image using OCR via Grok"""
+    """Extract text from an image with local OCR (see ocr.py)"""
     try:
-        # Read image and encode as base64 for Grok
-        import base64
-        with open(file_path, 'rb') as f:
-            image_data = base64.b64encode(f.read()).decode('utf-8')
-        
-        # Use Grok to analyze the image
-        prompt = f"Extract and return all text from this image. Be as accurate as possible."
-        # Note: Grok's vision capability would be used here if available
-        result = query_grok(prompt, system_context="You are an OCR expert. Extract text from images accurately.")
-        return result
+        return ocr.recognize_image(file_path)["text"]
     except Exception as e:
         return f"Error extracting text from image: {str(e)}"
 
 
+def _clean_whitespace(text: str) -> str:
+    # Remove common binary artifacts (nulls, bell, etc.)
+    text = re.sub(r"[\x00-\x08\x0B\x0C\x0E-\x1F]+", " ", text)
+
+    # Replace multiple whitespace/newlines with single ones
+    text = re.sub(r"[ \t]+", " ", text)
+    return re.sub(r"\n{3,}", "\n\n", text)
+
+
 def sanitize_text(text: str) -> str:
     """Remove non-printable/binary characters and collapse excessive whitespace.
 
@@ -128,15 +100,28 @@ def sanitize_text(text: str) -> str:
         except Exception:
             return ""
 
-    # Remove common binary artifacts (nulls, bell, etc.)
-    text = re.sub(r"[\x00-\x08\x0B\x0C\x0E-\x1F]+", " ", text)
+    # Trim leading/trailing whitespace
+    return _clean_whitespace(text).strip()
 
-    # Replace multiple whitespace/newlines with single ones
-    text = re.sub(r"[ \t]+", " ", text)
-    text = re.sub(r"\n{3,}", "\n\n", text)
 
-    # Trim leading/trailing whitespace
-    return text.strip()
+def sanitize_records(records: Iterable[dict]) -> Iterator[dict]:
+    """Streaming ``sanitize_text`` over ``{"page", "text"}`` records.
+
+    Each record is cleaned as it arrives; whitespace at its end is held back
+    until the next record of the same page, so the concatenated output of a
+    page equals ``sanitize_text`` of the whole page.
+    """
+    page, carry, started = None, "", False
+    for record in records:
+        if record["page"] != page:
+            page, carry, started = record["page"], "", False
+        text = _clean_whitespace(carry + record["text"])
+        kept = text.rstrip()
+        carry = text[len(kept):]
+        if not started:
+            kept = kept.lstrip()
+            started = bool(kept)
+        yield {**record, "text": kept}
 
 
 def extract_text_from_docx(file_path: str) -> str:
@@ -179,15 +164,111 @@ def extract_text_from_doc(file_path: str) -> str:
     except Exception as e:
         return f"Error extracting .doc: {str(e)}"
 
+def is_extraction_error(text: str) -> bool:
+    """Whether an extractor returned one of its error messages instead of text."""
+    return isinstance(text, str) and text.startswith(("Error:", "Error extracting"))
+
+
+# Plain-text uploads are read in blocks of this many characters
+_TEXT_BLOCK_CHARS = 1024 * 1024
+
+
+def iter_pdf_records(file_path: str) -> Iterator[dict]:
+    """Yield one record per PDF page as the page-parallel extractor produces it."""
+    failed = []
+    for number, (text, error) in enumerate(pdf_extract.iter_pages(file_path)):
+        if error is not None:
+            failed.append(number + 1)
+        yield {"page": number, "text": text}
+    if failed:
+        print(f"Could not extract pages {failed} of {os.path.basename(file_path)}")
+
+
+def iter_docx_records(file_path: str) -> Iterator[dict]:
+    """Yield one record per non-empty .docx paragraph."""
+    try:
+        from docx import Document
+    except Exception as e:
+        raise Exception(f"Error: python-docx not installed. Install 'python-docx' to extract .docx files: {str(e)}")
+
+    try:
+        doc = Document(file_path)
+    except Exception as e:
+        raise Exception(f"Error extracting .docx: {str(e)}")
+    separator = ""
+    for paragraph in doc.paragraphs:
+        if paragraph.text:
+            yield {"page": 0, "text": separator + paragraph.text}
+            separator = "\n"
+
+
+def iter_text_records(file_path: str) -> Iterator[dict]:
+    """Yield a plain-text file in blocks instead of reading it whole."""
+    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+        for block in iter(lambda: f.read(_TEXT_BLOCK_CHARS), ""):
+            yield {"page": 0, "text": block}
+
+
+def _single_record(text: str) -> Iterator[dict]:
+    # .doc (textract) and image OCR only ever return the whole text
+    if is_extraction_error(text):
+        raise Exception(text)
+    yield {"page": 0, "text": text}
+
+
+def iter_document_records(file_path: str) -> Iterator[dict]:
+    """Lazily extract any supported upload as ``{"page", "text"}`` records.
+
+    ``page`` is the 0-based page number; a page may span several records,
+    which concatenate to its text. PDFs have one record per page, .docx one
+    per paragraph and plain text one per block; formats without page
+    structure are page 0. Every document yields at least one record. Raises
+    if the extractor reports an error. Pass the records through
+    ``sanitize_records`` before use.
+    """
+    file_ext = file_path.split('.')[-1].lower()
+
+    if file_ext == 'pdf':
+        records = iter_pdf_records(file_path)
+    elif file_ext in ['png', 'jpg', 'jpeg']:
+        records = _single_record(extract_text_from_image(file_path))
+    elif file_ext == 'docx':
+        records = iter_docx_records(file_path)
+    elif file_ext == 'doc':
+        records = _single_record(extract_text_from_doc(file_path))
+    else:
+        records = iter_text_records(file_path)
+
+    empty = True
+    for record in records:
+        empty = False
+        yield record
+    if empty:
+        yield {"page": 0, "text": ""}
+
+
+def extract_document_pages(file_path: str) -> list[str]:
+    """Extract sanitized text from any supported upload as a list of pages.
+
+    PDFs yield one entry per page; other formats have no page structure and
+    yield a single entry. Raises if the extractor reports an error.
+    """
+    pages: list[list[str]] = []
+    for record in sanitize_records(iter_document_records(file_path)):
+        if record["page"] >= len(pages):
+            pages.append([])
+        pages[-1].append(record["text"])
+    return ["".join(parts) for parts in pages]
+
 def generate_questions(content: str, num_questions: int = 5, difficulty: str = "medium") -> list[str]:
     """Generate questions from content using Grok"""
-    prompt = f"""Generate {num_questions} {difficulty} difficulty questions based on the following content. 
+    prompt = fit_prompt("""Generate {num_questions} {difficulty} difficulty questions based on the following content. 
     Return only the questions, one per line, numbered.
     
     Content:
-    {content[:2000]}
+    {content}
     
-    Questions:"""
+    Questions:""", "content", content, num_questions=num_questions, difficulty=difficulty)
     
     try:
         response_text = query_grok(prompt, max_tokens=500)
@@ -265,118 +346,516 @@ def chat_with_llm(message: str, system_context: Optional[str] = None) -> str:
         return f"Error in chat: {str(e)}"
 
 
-### Vector store helpers using Chroma for persistent RAG
+async def achat_with_llm(message: str, system_context: Optional[str] = None,
+                         cache_endpoint: Optional[str] = None) -> str:
+    """Async chat with LLM using the shared Grok client.
+
+    When ``cache_endpoint`` names the calling endpoint (and it is not opted
+    out in config), identical requests are answered from the response cache.
+    """
+    if system_context:
+        prompt = f"{system_context}\n\nUser: {message}"
+    else:
+        prompt = message
+
+    use_cache = llm_cache.is_enabled(cache_endpoint)
+    if use_cache:
+        key = llm_cache.make_key(prompt, system_context=system_context, max_tokens=1000)
+        cached = await asyncio.to_thread(llm_cache.get_cache().get, key, cache_endpoint)
+        if cached is not None:
+            return cached
+
+    try:
+        response = await aquery_grok(prompt, system_context=system_context, max_tokens=1000)
+    except Exception as e:
+        return f"Error in chat: {str(e)}"
+
+    if use_cache and isinstance(response, str):
+        await asyncio.to_thread(llm_cache.get_cache().put, key, response)
+    return response
+
+
+async def astream_chat_with_llm(message: str, system_context: Optional[str] = None,
+                                cache_endpoint: Optional[str] = None):
+    """Streaming counterpart of ``achat_with_llm``: yields text as it arrives.
+
+    A cached response is yielded in one piece; a freshly streamed one is
+    stored in the response cache once it completes, exactly like the
+    non-streaming path. Errors propagate to the caller.
+    """
+    if system_context:
+        prompt = f"{system_context}\n\nUser: {message}"
+    else:
+        prompt = message
+
+    use_cache = llm_cache.is_enabled(cache_endpoint)
+    if use_cache:
+        key = llm_cache.make_key(prompt, system_context=system_context, max_tokens=1000)
+        cached = await asyncio.to_thread(llm_cache.get_cache().get, key, cache_endpoint)
+        if cached is not None:
+            yield cached
+            return
+
+    parts = []
+    async for text in llm_client.astream(prompt, system_context=system_context, max_tokens=1000):
+        parts.append(text)
+        yield text
+
+    if use_cache:
+        await asyncio.to_thread(llm_cache.get_cache().put, key, "".join(parts))
+
+
+async def sse_token_stream(tokens, done: Optional[dict] = None):
+    """Wrap an async iterator of text pieces as server-sent events.
+
+    Emits ``token`` events, then a ``done`` event carrying ``done`` plus the
+    full ``response`` text, or an ``error`` event if the stream fails.
+    """
+    parts = []
+    try:
+        async for text in tokens:
+            parts.append(text)
+            yield format_sse({"token": text}, event="token")
+    except Exception as e:
+        yield format_sse({"detail": str(e)}, event="error")
+        return
+    yield format_sse({**(done or {}), "response": "".join(parts)}, event="done")
+
+
+### Vector store helpers (Chroma, or the NumPy fallback index) for persistent RAG
 
 _CHROMA_CLIENT = None
 _COLLECTION = None
-_EMBED_MODEL = None
+_BM25_CHECKED = False
 _DB_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "vector_store")
 
-def _get_chroma_collection():
-    """Get or create the Chroma collection for document embeddings."""
-    global _CHROMA_CLIENT, _COLLECTION, _EMBED_MODEL
+def _get_chroma_client():
+    """Get the persistent Chroma client, creating it on first use."""
+    global _CHROMA_CLIENT
+
+    if not CHROMA_AVAILABLE:
+        return None
+    if _CHROMA_CLIENT is None:
+        os.makedirs(_DB_PATH, exist_ok=True)
+        _CHROMA_CLIENT = chromadb.PersistentClient(path=_DB_PATH)
+    return _CHROMA_CLIENT
+
+
+def _open_collection(name: str):
+    """Get or create a cosine-space vector collection.
     
-    if not CHROMA_AVAILABLE or not SENTENCE_AVAILABLE:
+    Uses Chroma when installed, otherwise an exact-search ``NumpyCollection``
+    stored under the same vector_store directory (same API either way).
+    """
+    if not CHROMA_AVAILABLE:
+        return NumpyCollection(os.path.join(_DB_PATH, "numpy", name))
+    # Vectors always come from the embedding service, so Chroma must not
+    # load its own default model
+    return _get_chroma_client().get_or_create_collection(
+        name=name,
+        metadata={"hnsw:space": "cosine"},
+        embedding_function=None
+    )
+
+
+def _get_vector_collection():
+    """Get or create the vector collection for document embeddings."""
+    global _COLLECTION
+    
+    if not VEC_AVAILABLE:
         return None
     
     try:
         if _COLLECTION is None:
-            # Initialize embedding model
-            if _EMBED_MODEL is None:
-                _EMBED_MODEL = SentenceTransformer('all-MiniLM-L6-v2')
-            
-            # Initialize Chroma client with persistent storage
-            os.makedirs(_DB_PATH, exist_ok=True)
-            _CHROMA_CLIENT = chromadb.PersistentClient(path=_DB_PATH)
-            
-            # Get or create collection
-            _COLLECTION = _CHROMA_CLIENT.get_or_create_collection(
-                name="documents",
-                metadata={"hnsw:space": "cosine"}
-            )
+            _COLLECTION = _open_collection("documents")
         
         return _COLLECTION
     except Exception as e:
-        print(f"Error initializing Chroma: {str(e)}")
+        print(f"Error initializing vector store: {str(e)}")
         return None
 
 
-def embed_document(filename: str, text: str):
+def _keyword_index() -> bm25_index.BM25Index:
+    """Get the BM25 index, rebuilding it from Chroma once per process if they differ."""
+    global _BM25_CHECKED
+
+    index = bm25_index.get_index()
+    if not _BM25_CHECKED:
+        _BM25_CHECKED = True
+        collection = _get_vector_collection()
+        if collection is not None and index.count() != collection.count():
+            print("Rebuilding keyword index from the vector store")
+            index.clear()
+            offset = 0
+            while True:
+                page = collection.get(limit=500, offset=offset, include=['documents', 'metadatas'])
+                if not page['ids']:
+                    break
+                index.add(page['ids'], page['documents'], [m or {} for m in page['metadatas']])
+                offset += len(page['ids'])
+    return index
+
+
+def _chunk_hash(chunk: str) -> str:
+    return hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+
+
+def owner_key(owner_id) -> str:
+    """Metadata flag marking a chunk as belonging to teacher ``owner_id``.
+
+    Chunks are shared by every upload of the same content, so ownership is a
+    set of ``owner_<id>: True`` flags rather than a single field.
+    """
+    return f"owner_{owner_id}"
+
+
+# New chunks are embedded and stored in batches of this many while streaming
+_EMBED_FLUSH_CHUNKS = 256
+
+
+def embed_document(filename: str, text: str, content_hash: Optional[str] = None,
+                   previous_hash: Optional[str] = None, page_offsets: Optional[list[int]] = None,
+                   owner_id: Optional[int] = None, subject: Optional[str] = None) -> dict:
     """Create dense embeddings for a document and store in Chroma vector database.
     
     This enables persistent RAG: embeddings survive server restarts and
     semantic search retrieves relevant excerpts for context-aware LLM answering.
+    
+    Chunks come from ``chunking.chunk_document``; ``page_offsets`` (from the
+    extracted-text store, whose text is already sanitized) adds page numbers
+    to each chunk's metadata. See ``embed_chunks`` for the other arguments.
+    
+    Returns ``{"added", "reused", "removed"}`` chunk counts.
     """
-    if not CHROMA_AVAILABLE or not SENTENCE_AVAILABLE:
-        print("Chroma or sentence-transformers not available for embedding")
-        return
+    return embed_chunks(filename, _document_chunks(text, page_offsets), content_hash, previous_hash,
+                        owner_id, subject)
+
+
+def _document_chunks(text: str, page_offsets: Optional[list[int]]) -> Iterator[dict]:
+    # A generator, so nothing is sanitized or chunked if embed_chunks finds
+    # the content already embedded
+    if page_offsets is None:
+        # Sanitize incoming text to remove binary/control characters
+        text = sanitize_text(text)
+    yield from chunk_document(text, page_offsets)
+
+
+def is_embedded(content_hash: str) -> bool:
+    """True if chunks of this document content are already in the vector store."""
+    collection = _get_vector_collection() if VEC_AVAILABLE else None
+    if collection is None:
+        return False
+    try:
+        return bool(collection.get(where={"content_hash": content_hash}, limit=1, include=[])["ids"])
+    except Exception as e:
+        print(f"Error checking stored embeddings: {str(e)}")
+        return False
+
+
+def embed_chunks(filename: str, chunks: Iterable[dict], content_hash: Optional[str] = None,
+                 previous_hash: Optional[str] = None, owner_id: Optional[int] = None,
+                 subject: Optional[str] = None) -> dict:
+    """Embed and store a document's chunks, consuming them as they come.
+
+    ``chunks`` may be a ``chunking.chunk_stream`` generator: new chunks are
+    embedded and stored ``_EMBED_FLUSH_CHUNKS`` at a time, so memory stays
+    flat however long the document is.
+
+    With ``content_hash``, chunks are stored once per distinct content: if
+    that content is already embedded (e.g. the same file uploaded under
+    another name) nothing is re-embedded and ``chunks`` is not consumed.
+    ``previous_hash`` is the content this upload replaces; its chunks are
+    diffed by chunk hash against the new ones, so unchanged chunks keep their
+    vectors (relabelled in place), only new chunks are embedded and removed
+    chunks are deleted. ``owner_id`` (the uploading teacher) and ``subject``
+    are recorded on every chunk for filtered retrieval.
+
+    If storing fails part way, the chunks added so far are removed again and
+    the error is raised, so the caller can mark the upload failed. Returns ``{"added", "reused", "removed"}`` chunk counts.
+    """
+    report = {"added": 0, "reused": 0, "removed": 0}
+    if not VEC_AVAILABLE:
+        print("sentence-transformers not available for embedding")
+        return report
     
-    collection = _get_chroma_collection()
+    collection = _get_vector_collection()
     if collection is None:
-        return
+        return report
     
+    added_ids: list[str] = []
     try:
-        # Sanitize incoming text to remove binary/control characters
-        text = sanitize_text(text)
-        # Create a unique ID for this document
-        doc_id = filename.replace('/', '_').replace('\\', '_')
+        keywords = _keyword_index()
+        # Create a unique ID prefix for this document
+        if content_hash:
+            existing = collection.get(where={"content_hash": content_hash}, include=['metadatas'])
+            if existing["ids"]:
+                print(f"Reusing stored embeddings for {filename}")
+                report["reused"] = len(existing["ids"])
+                if owner_id is not None or subject:
+                    tagged = [_tag(meta or {}, owner_id, subject) for meta in existing["metadatas"]]
+                    collection.update(ids=existing["ids"], metadatas=tagged)
+                    keywords.update_metadata(existing["ids"], tagged)
+                if previous_hash and previous_hash != content_hash:
+                    report["removed"] = _delete_where(collection, {"content_hash": previous_hash})
+                return report
+            doc_id = content_hash[:16]
+            previous = {"content_hash": previous_hash} if previous_hash else None
+        else:
+            doc_id = filename.replace('/', '_').replace('\\', '_')
+            previous = {"filename": filename}
         
-        # Split text into chunks for better retrieval (max 1000 chars per chunk)
-        chunks = []
-        chunk_size = 1000
-        for i in range(0, len(text), chunk_size):
-            chunk = text[i:i+chunk_size]
-            if chunk.strip():
-                chunks.append(chunk)
+        # Stored chunks of the previous version, grouped by chunk hash
+        stored: dict[str, list[str]] = {}
+        if previous:
+            old = collection.get(where=previous, include=['documents', 'metadatas'])
+            for chunk_id, doc, meta in zip(old['ids'], old['documents'], old['metadatas']):
+                h = (meta or {}).get("chunk_hash") or _chunk_hash(doc or "")
+                stored.setdefault(h, []).append(chunk_id)
         
-        if not chunks:
-            chunks = [text]
+        kept_ids, kept_metas = [], []
+        new_ids, new_chunks, new_metas = [], [], []
+        embed_seconds = 0.0
+
+        def flush_new():
+            # Embed only what changed; unchanged vectors stay where they are
+            nonlocal embed_seconds
+            if not new_chunks:
+                return
+            start = time.perf_counter()
+            embeddings = get_embedder().encode(new_chunks)
+            embed_seconds += time.perf_counter() - start
+            collection.add(
+                ids=new_ids,
+                embeddings=embeddings,
+                documents=new_chunks,
+                metadatas=new_metas
+            )
+            added_ids.extend(new_ids)
+            keywords.add(new_ids, new_chunks, new_metas)
+            new_ids.clear()
+            new_chunks.clear()
+            new_metas.clear()
+
+        for chunk in chunks:
+            h = _chunk_hash(chunk["text"])
+            meta = {"filename": filename, "chunk": chunk["index"], "chunk_hash": h,
+                    "start": chunk["start"], "end": chunk["end"], "tokens": chunk["tokens"]}
+            for key in ("section", "page", "page_end"):
+                if key in chunk:
+                    meta[key] = chunk[key]
+            if content_hash:
+                meta["content_hash"] = content_hash
+            _tag(meta, owner_id, subject)
+            if stored.get(h):
+                kept_ids.append(stored[h].pop())
+                kept_metas.append(meta)
+            else:
+                new_ids.append(f"{doc_id}_{uuid.uuid4().hex[:12]}")
+                new_chunks.append(chunk["text"])
+                new_metas.append(meta)
+                if len(new_chunks) >= _EMBED_FLUSH_CHUNKS:
+                    flush_new()
+        flush_new()
+        stale_ids = [chunk_id for ids in stored.values() for chunk_id in ids]
         
-        # Add chunks to collection with metadata
-        ids = [f"{doc_id}_{i}" for i in range(len(chunks))]
-        metadatas = [{"filename": filename, "chunk": i} for i in range(len(chunks))]
+        if added_ids:
+            rate = len(added_ids) / embed_seconds if embed_seconds > 0 else 0.0
+            print(f"Embedded {len(added_ids)} chunks from {filename} ({rate:.1f} chunks/sec)")
+        if kept_ids:
+            collection.update(ids=kept_ids, metadatas=kept_metas)
+            keywords.update_metadata(kept_ids, kept_metas)
+        if stale_ids:
+            collection.delete(ids=stale_ids)
+            keywords.delete(stale_ids)
         
-        collection.add(
-            ids=ids,
-            documents=chunks,
-            metadatas=metadatas
-        )
-        print(f"Embedded {len(chunks)} chunks from {filename}")
+        report.update(added=len(added_ids), reused=len(kept_ids), removed=len(stale_ids))
+        if kept_ids or stale_ids:
+            print(f"Re-embedded {filename}: {report['added']} new, {report['reused']} reused, "
+                  f"{report['removed']} removed chunks")
+        return report
     except Exception as e:
         print(f"Error embedding document: {str(e)}")
+        if added_ids:
+            # Do not leave a partial document that would later be reused as complete
+            collection.delete(ids=added_ids)
+            _keyword_index().delete(added_ids)
+        raise
+
+
+def _tag(meta: dict, owner_id: Optional[int], subject: Optional[str]) -> dict:
+    if owner_id is not None:
+        meta[owner_key(owner_id)] = True
+    if subject:
+        meta["subject"] = subject.strip().lower()
+    return meta
+
+
+def _delete_where(collection, where: dict) -> int:
+    ids = collection.get(where=where, include=[])["ids"]
+    if ids:
+        collection.delete(ids=ids)
+        _keyword_index().delete(ids)
+    return len(ids)
+
 
+def delete_document_vectors(content_hash: str):
+    """Remove every stored chunk of a document content from the vector store."""
+    collection = _get_vector_collection()
+    if collection is None:
+        return
+    try:
+        collection.delete(where={"content_hash": content_hash})
+        _keyword_index().delete_content(content_hash)
+    except Exception as e:
+        print(f"Error deleting document vectors: {str(e)}")
+
+
+def _expand_hit(collection, hit: dict, window: int) -> dict:
+    """Widen a retrieved chunk with its ``window`` neighbours on each side."""
+    meta = hit.pop("_meta")
+    if window <= 0 or "start" not in meta:
+        return hit
+    owner = {"content_hash": meta["content_hash"]} if meta.get("content_hash") else {"filename": meta.get("filename")}
+    index = meta.get("chunk", 0)
+    neighbours = collection.get(
+        where={"$and": [owner, {"chunk": {"$gte": index - window}}, {"chunk": {"$lte": index + window}}]},
+        include=['documents', 'metadatas']
+    )
+    pieces = [
+        (m["start"], doc)
+        for doc, m in zip(neighbours['documents'], neighbours['metadatas'])
+        if m and "start" in m
+    ]
+    if pieces:
+        hit["text"] = merge_chunks(pieces)
+    return hit
+
+
+def _search_where(filename: Optional[str] = None, content_hash: Optional[str] = None,
+                  owner_id: Optional[int] = None, subject: Optional[str] = None) -> Optional[dict]:
+    """Build a Chroma ``where`` clause from the given metadata filters."""
+    clauses = []
+    if filename:
+        clauses.append({"filename": filename})
+    if content_hash:
+        clauses.append({"content_hash": content_hash})
+    if owner_id is not None:
+        clauses.append({owner_key(owner_id): True})
+    if subject:
+        clauses.append({"subject": subject.strip().lower()})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+SEARCH_MODES = ("dense", "hybrid", "keyword")
 
-def semantic_search(query: str, top_k: int = 3) -> list[dict]:
+
+def semantic_search(query: str, top_k: int = 3, expand: int = 0, filename: Optional[str] = None,
+                    content_hash: Optional[str] = None, owner_id: Optional[int] = None,
+                    subject: Optional[str] = None, mode: str = "dense",
+                    rerank: Optional[bool] = None) -> list[dict]:
     """Perform semantic search over stored documents using Chroma.
     
     Returns top_k most relevant document excerpts from the vector database.
+    With ``expand``, each excerpt is widened to include that many
+    neighbouring chunks on either side. ``filename``, ``content_hash``,
+    ``owner_id`` and ``subject`` restrict the search to matching chunks
+    (applied inside Chroma, not after retrieval). Chunks are labelled with
+    the filename that first stored them, so prefer ``content_hash`` to scope
+    a search to one upload.
+    
+    ``mode`` is ``"dense"`` (vectors only), ``"keyword"`` (BM25 only) or
+    ``"hybrid"`` (both, merged by reciprocal rank fusion), which also finds
+    exact terms such as question numbers and formula names.
+    
+    ``rerank`` (default ``RERANK_ENABLED``) over-fetches candidates and
+    re-orders them with a cross-encoder (see ``reranker``), keeping the
+    vector order if that would exceed its latency budget.
+    """
+    return semantic_search_many(
+        [query], top_k, expand, filename=filename, content_hash=content_hash,
+        owner_id=owner_id, subject=subject, mode=mode, rerank=rerank
+    )[0]
+
+
+def semantic_search_many(queries: list[str], top_k: int = 3, expand: int = 0, filename: Optional[str] = None,
+                         content_hash: Optional[str] = None, owner_id: Optional[int] = None,
+                         subject: Optional[str] = None, mode: str = "dense",
+                         rerank: Optional[bool] = None) -> list[list[dict]]:
+    """Run ``semantic_search`` for several queries at once.
+    
+    All queries are encoded in one embedding batch and sent to Chroma as a
+    single query; returns one result list per query, in order. Arguments are
+    as for ``semantic_search``.
     """
-    if not CHROMA_AVAILABLE or not SENTENCE_AVAILABLE:
-        return []
+    empty = [[] for _ in queries]
+    if not queries or not VEC_AVAILABLE:
+        return empty
     
-    collection = _get_chroma_collection()
+    collection = _get_vector_collection()
     if collection is None:
-        return []
+        return empty
+    
+    if mode not in SEARCH_MODES:
+        mode = "dense"
+    reranker = get_reranker() if (RERANK_ENABLED if rerank is None else rerank) else None
+    # Fusion and re-ranking need a deeper candidate list from each retriever
+    shortlist = max(top_k, RERANK_CANDIDATES) if reranker else top_k
+    candidates = shortlist if mode == "dense" else max(shortlist, top_k * 4, 20)
     
     try:
-        results = collection.query(
-            query_texts=[query],
-            n_results=top_k,
-            include=['documents', 'metadatas']
-        )
+        dense = [[] for _ in queries]
+        if mode != "keyword":
+            results = collection.query(
+                query_embeddings=get_embedder().encode(queries),
+                n_results=candidates,
+                where=_search_where(filename, content_hash, owner_id, subject),
+                include=['documents', 'metadatas']
+            )
+            for q, ids in enumerate((results or {}).get('ids') or []):
+                docs = results['documents'][q]
+                metas = results['metadatas'][q] if results['metadatas'] else [None] * len(ids)
+                dense[q] = [(chunk_id, doc, meta or {}) for chunk_id, doc, meta in zip(ids, docs, metas)]
         
-        # Transform results into expected format
         retrieved = []
-        if results and results['documents'] and len(results['documents']) > 0:
-            for i, doc in enumerate(results['documents'][0]):
-                meta = results['metadatas'][0][i] if results['metadatas'] else {}
-                retrieved.append({
+        for q, query in enumerate(queries):
+            keyword = []
+            if mode != "dense":
+                keyword = [
+                    (hit["id"], hit["text"], hit["meta"])
+                    for hit in _keyword_index().search(
+                        query, candidates, filename=filename, content_hash=content_hash,
+                        owner_id=owner_id, subject=subject
+                    )
+                ]
+            
+            if mode == "hybrid":
+                pool = {chunk_id: (doc, meta) for chunk_id, doc, meta in keyword + dense[q]}
+                fused = bm25_index.reciprocal_rank_fusion(
+                    [[c[0] for c in dense[q]], [c[0] for c in keyword]], SEARCH_RRF_K
+                )
+                ranked = [(chunk_id, *pool[chunk_id]) for chunk_id, _ in fused[:shortlist]]
+            else:
+                ranked = (dense[q] or keyword)[:shortlist]
+            
+            # Transform results into expected format
+            hits = [
+                {
                     "filename": meta.get("filename", "unknown"),
                     "text": doc,
-                    "chunk": meta.get("chunk", 0)
-                })
+                    "chunk": meta.get("chunk", 0),
+                    "content_hash": meta.get("content_hash"),
+                    "section": meta.get("section"),
+                    "page": meta.get("page"),
+                    "_meta": meta
+                }
+                for _, doc, meta in ranked
+            ]
+            hits = reranker.rerank(query, hits, top_k) if reranker else hits[:top_k]
+            retrieved.append([_expand_hit(collection, hit, expand) for hit in hits])
         
         return retrieved
     except Exception as e:
         print(f"Error in semantic search: {str(e)}")
-        return []
+        return empty
@@ -1,4 +1,4 @@
 @echo off
 cd backend
 call venv\Scripts\activate.bat
-python main.py
+uvicorn main:app --host 0.0.0.0 --port 8000
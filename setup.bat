@@ -52,7 +52,7 @@ echo.
 echo Backend is ready to run. To start it:
 echo   1. Open a PowerShell/CMD window
 echo   2. Navigate to the backend folder
-echo   3. Run: python main.py
+echo   3. Run: uvicorn main:app --host 0.0.0.0 --port 8000
 echo.
 echo Backend will be available at: http://localhost:8000
 echo API Docs at: http://localhost:8000/docs
@@ -78,7 +78,7 @@ echo ║   Quick Commands                                      ║
 echo ╚════════════════════════════════════════════════════════╝
 echo.
 echo Backend:
-echo   python main.py              - Start backend server
+echo   uvicorn main:app            - Start backend server
 echo   http://localhost:8000/docs  - API Documentation
 echo.
 echo Frontend: